@@ -0,0 +1,336 @@
+import os
+import re
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from label_io import LEGACY_LOCKS_DIRNAME
+
+INDEX_DIR = '.cache/indexes'
+LEGACY_INDEX_FILENAME = '.index.sqlite'  # Older versions kept the index inside the folder
+VALIDATE_INTERVAL = 10.0  # Seconds between full mtime checks of a folder
+
+_SEQ_RE = re.compile(r'_(\d+)$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    stem TEXT PRIMARY KEY,
+    seq INTEGER,
+    mtime_ns INTEGER,
+    size INTEGER,
+    has_image INTEGER
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    stem TEXT,
+    idx INTEGER,
+    cls TEXT,
+    valid INTEGER,
+    x REAL,
+    y REAL,
+    w REAL,
+    h REAL,
+    PRIMARY KEY (stem, idx)
+);
+CREATE INDEX IF NOT EXISTS annotations_cls ON annotations (cls, stem);
+CREATE INDEX IF NOT EXISTS files_order ON files (seq, stem);
+"""
+
+
+def parse_label_file(label_file):
+    """
+    Parse a YOLO label file
+
+    Returns:
+        list: (line_index, class, box) tuples for every non-empty line, where box
+        is (x, y, w, h) for well-formed 5-field lines and None otherwise
+    """
+    rows = []
+    with open(label_file) as f:
+        for idx, line in enumerate(f):
+            parts = line.strip().split()
+            if not parts:
+                continue
+            box = None
+            if len(parts) == 5:
+                try:
+                    box = tuple(float(p) for p in parts[1:])
+                except ValueError:
+                    box = None
+            rows.append((idx, parts[0], box))
+    return rows
+
+
+class AnnotationIndex:
+    """
+    SQLite index of every annotation in an annotated-images folder
+
+    The index is derived state, so it lives under cache_dir (keyed by the
+    folder's absolute path) rather than in the dataset folder. It is validated
+    against the label files' mtimes and sizes: at most once every
+    VALIDATE_INTERVAL seconds, or immediately when the labels or images
+    directory changes. Edits made through the reviewer update it file by file
+    via update_file/remove_file.
+
+    Args:
+        folder_path (str): Annotated folder with images/ and labels/
+        cache_dir (str): Directory holding one index database per folder
+    """
+
+    def __init__(self, folder_path, cache_dir=INDEX_DIR):
+        self.folder_path = folder_path
+        self.labels_dir = os.path.join(folder_path, 'labels')
+        self.images_dir = os.path.join(folder_path, 'images')
+        os.makedirs(cache_dir, exist_ok=True)
+        digest = hashlib.sha1(os.path.abspath(folder_path).encode()).hexdigest()
+        self.db_path = os.path.join(os.path.abspath(cache_dir), f'{digest[:16]}.sqlite')
+        for suffix in ('', '-wal', '-shm'):
+            # Drop an index and lock files left in the dataset folder by an older version
+            try:
+                os.remove(os.path.join(folder_path, LEGACY_INDEX_FILENAME + suffix))
+            except OSError:
+                pass
+        shutil.rmtree(os.path.join(folder_path, LEGACY_LOCKS_DIRNAME), ignore_errors=True)
+        self._lock = threading.Lock()
+        self._validated_at = 0.0
+        self._dir_mtimes = None
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection for one transaction; connections are not shared across threads"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _current_dir_mtimes(self):
+        mtimes = []
+        for path in (self.labels_dir, self.images_dir):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _seq(self, stem):
+        # Numeric frame suffix used for natural ordering; -1 sorts unnumbered names first
+        match = _SEQ_RE.search(stem)
+        return int(match.group(1)) if match else -1
+
+    def _index_file(self, conn, stem, has_image=None):
+        """(Re)parse one label file into the index"""
+        label_file = os.path.join(self.labels_dir, stem + '.txt')
+        conn.execute('DELETE FROM annotations WHERE stem = ?', (stem,))
+        try:
+            st = os.stat(label_file)
+            rows = parse_label_file(label_file)
+        except OSError:
+            conn.execute('DELETE FROM files WHERE stem = ?', (stem,))
+            return
+        if has_image is None:
+            has_image = os.path.exists(os.path.join(self.images_dir, stem + '.jpg'))
+        conn.execute(
+            'INSERT OR REPLACE INTO files (stem, seq, mtime_ns, size, has_image) VALUES (?, ?, ?, ?, ?)',
+            (stem, self._seq(stem), st.st_mtime_ns, st.st_size, int(has_image))
+        )
+        conn.executemany(
+            'INSERT INTO annotations (stem, idx, cls, valid, x, y, w, h) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(stem, idx, cls, box is not None) + (box or (None, None, None, None)) for idx, cls, box in rows]
+        )
+
+    def refresh(self, force=False):
+        """Bring the index up to date with the label files on disk"""
+        with self._lock:
+            dir_mtimes = self._current_dir_mtimes()
+            if (not force and dir_mtimes == self._dir_mtimes
+                    and time.time() - self._validated_at < VALIDATE_INTERVAL):
+                return
+
+            on_disk = {}
+            if os.path.isdir(self.labels_dir):
+                for entry in os.scandir(self.labels_dir):
+                    if entry.name.endswith('.txt'):
+                        st = entry.stat()
+                        on_disk[entry.name[:-4]] = (st.st_mtime_ns, st.st_size)
+            images = set(os.listdir(self.images_dir)) if os.path.isdir(self.images_dir) else set()
+
+            with self._connect() as conn:
+                indexed = {
+                    stem: ((mtime_ns, size), has_image)
+                    for stem, mtime_ns, size, has_image in conn.execute(
+                        'SELECT stem, mtime_ns, size, has_image FROM files')
+                }
+                for stem in indexed.keys() - on_disk.keys():
+                    conn.execute('DELETE FROM annotations WHERE stem = ?', (stem,))
+                    conn.execute('DELETE FROM files WHERE stem = ?', (stem,))
+                for stem, signature in on_disk.items():
+                    has_image = (stem + '.jpg') in images
+                    if stem not in indexed or indexed[stem][0] != signature:
+                        self._index_file(conn, stem, has_image)
+                    elif bool(indexed[stem][1]) != has_image:
+                        conn.execute('UPDATE files SET has_image = ? WHERE stem = ?', (int(has_image), stem))
+
+            self._dir_mtimes = dir_mtimes
+            self._validated_at = time.time()
+
+    def update_file(self, stem):
+        """Re-index a single label file after it was edited"""
+        with self._lock, self._connect() as conn:
+            self._index_file(conn, stem)
+
+    def remove_file(self, stem):
+        """Drop a frame from the index after it was deleted"""
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM annotations WHERE stem = ?', (stem,))
+            conn.execute('DELETE FROM files WHERE stem = ?', (stem,))
+
+    def class_counts(self):
+        """Return {class: number of annotations} for the whole folder"""
+        self.refresh()
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT cls, COUNT(*) FROM annotations GROUP BY cls'))
+
+    def annotations_for_classes(self, class_names):
+        """
+        Return well-formed annotations of the given classes on frames that have an image
+
+        Returns:
+            list: (stem, annotations) tuples in natural frame order
+        """
+        self.refresh()
+        if not class_names:
+            return []
+        placeholders = ','.join('?' * len(class_names))
+        query = f"""
+            SELECT a.stem, a.idx, a.cls, a.x, a.y, a.w, a.h
+            FROM annotations a JOIN files f ON f.stem = a.stem
+            WHERE f.has_image = 1 AND a.valid = 1 AND a.cls IN ({placeholders})
+            ORDER BY f.seq, f.stem, a.idx
+        """
+        results = []
+        with self._connect() as conn:
+            for stem, idx, cls, x, y, w, h in conn.execute(query, list(class_names)):
+                if not results or results[-1][0] != stem:
+                    results.append((stem, []))
+                results[-1][1].append(self._annotation(idx, cls, x, y, w, h))
+        return results
+
+    def _annotation(self, idx, cls, x, y, w, h):
+        return {
+            'id': idx,
+            'class': cls,
+            'x': x,
+            'y': y,
+            'width': w,
+            'height': h
+        }
+
+    def _match_clause(self, class_names):
+        """SQL condition (on files f) and params selecting frames with any of the classes"""
+        placeholders = ','.join('?' * len(class_names))
+        clause = f"""
+            f.has_image = 1 AND EXISTS (
+                SELECT 1 FROM annotations a
+                WHERE a.stem = f.stem AND a.valid = 1 AND a.cls IN ({placeholders})
+            )
+        """
+        return clause, list(class_names)
+
+    def _annotations_for_stems(self, conn, stems, class_names):
+        annotations = {stem: [] for stem in stems}
+        if not stems:
+            return annotations
+        query = f"""
+            SELECT stem, idx, cls, x, y, w, h FROM annotations
+            WHERE stem IN ({','.join('?' * len(stems))}) AND valid = 1
+              AND cls IN ({','.join('?' * len(class_names))})
+            ORDER BY stem, idx
+        """
+        for stem, idx, cls, x, y, w, h in conn.execute(query, list(stems) + list(class_names)):
+            annotations[stem].append(self._annotation(idx, cls, x, y, w, h))
+        return annotations
+
+    def count_images(self, class_names, before=None):
+        """
+        Count frames with annotations of the given classes
+
+        Args:
+            before (tuple): Only count frames ordered before this (seq, stem) key
+        """
+        self.refresh()
+        if not class_names:
+            return 0
+        clause, params = self._match_clause(class_names)
+        if before is not None:
+            clause += ' AND (f.seq, f.stem) < (?, ?)'
+            params += list(before)
+        with self._connect() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM files f WHERE {clause}', params).fetchone()[0]
+
+    def list_images(self, class_names, offset=0, limit=50, after=None):
+        """
+        Return one page of frames with annotations of the given classes
+
+        Frames are in stable natural order (numeric suffix, then name).
+
+        Args:
+            offset (int): Number of matching frames to skip
+            limit (int): Maximum number of frames to return
+            after (tuple): Cursor; only return frames ordered after this (seq, stem) key
+
+        Returns:
+            list: (stem, seq, annotations) tuples
+        """
+        self.refresh()
+        if not class_names:
+            return []
+        clause, params = self._match_clause(class_names)
+        if after is not None:
+            clause += ' AND (f.seq, f.stem) > (?, ?)'
+            params += list(after)
+        query = f'SELECT f.stem, f.seq FROM files f WHERE {clause} ORDER BY f.seq, f.stem LIMIT ? OFFSET ?'
+        with self._connect() as conn:
+            rows = conn.execute(query, params + [limit, offset]).fetchall()
+            annotations = self._annotations_for_stems(conn, [stem for stem, _ in rows], class_names)
+        return [(stem, seq, annotations[stem]) for stem, seq in rows]
+
+    def sort_key(self, stem):
+        """Return the (seq, stem) ordering key of a frame"""
+        return (self._seq(stem), stem)
+
+    def image_annotations(self, stem, class_names):
+        """
+        Return the annotations of the given classes for one frame
+
+        Returns:
+            list: Annotations, or None if the frame has no image or no matching annotations
+        """
+        self.refresh()
+        if not class_names:
+            return None
+        with self._connect() as conn:
+            row = conn.execute('SELECT has_image FROM files WHERE stem = ?', (stem,)).fetchone()
+            if row is None or not row[0]:
+                return None
+            annotations = self._annotations_for_stems(conn, [stem], class_names)[stem]
+        return annotations or None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(folder_path):
+    """Return the shared AnnotationIndex for a folder"""
+    key = os.path.abspath(folder_path)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = AnnotationIndex(folder_path)
+        return _indexes[key]
@@ -1,8 +1,21 @@
 import os
 import cv2
-from ultralytics import YOLO
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from model_registry import registry as model_registry
 import json
 import numpy as np
+from progress import ProgressTracker
+from metrics import StageTimer
+from inference import predict
+from checkpoint import JobJournal
+from detection_cache import DetectionCache, image_key
+from annotation_index import get_index
+from label_io import locked_many, write_label_lines
+from onnx_backend import BACKENDS
+
+logger = logging.getLogger(__name__)
 
 class ImageAnnotator:
     def __init__(self):
@@ -47,51 +60,213 @@ class ImageAnnotator:
         
         return intersection / union if union > 0 else 0.0
 
+    def iou_matrix(self, boxes):
+        """
+        Calculate pairwise IoU between boxes in YOLO format (x_center, y_center, width, height)
+        
+        Args:
+            boxes: (N, 4) array of boxes
+            
+        Returns:
+            np.ndarray: (N, N) array of IoU values
+        """
+        x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        
+        # Convert to corner coordinates
+        x_min, x_max = x - w/2, x + w/2
+        y_min, y_max = y - h/2, y + h/2
+        
+        # Calculate intersection for every pair
+        inter_w = np.minimum(x_max[:, None], x_max[None, :]) - np.maximum(x_min[:, None], x_min[None, :])
+        inter_h = np.minimum(y_max[:, None], y_max[None, :]) - np.maximum(y_min[:, None], y_min[None, :])
+        overlaps = (inter_w > 0) & (inter_h > 0)
+        intersection = np.where(overlaps, inter_w * inter_h, 0)
+        
+        # Calculate union
+        area = w * h
+        union = area[:, None] + area[None, :] - intersection
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(overlaps & (union > 0), intersection / union, 0)
+
     def filter_overlapping_detections(self, boxes, classes, iou_threshold=0.5):
         """
         Filter out overlapping detections with high IoU
         
+        Boxes are visited from largest to smallest area and a box is kept only if
+        its IoU with every box kept so far is at most iou_threshold.
+        
         Args:
-            boxes: List of (x, y, w, h) boxes
-            classes: List of class labels
+            boxes: (N, 4) array or list of (x, y, w, h) boxes
+            classes: (N,) array or list of class labels
             iou_threshold: IoU threshold for overlap detection
             
         Returns:
-            tuple: (filtered_boxes, filtered_classes)
+            tuple: (filtered_boxes, filtered_classes) as arrays, in original order
         """
+        boxes = np.asarray(boxes)
+        classes = np.asarray(classes)
         if len(boxes) <= 1:
             return boxes, classes
         
-        # Convert to list for easier manipulation
-        boxes = list(boxes)
-        classes = list(classes)
+        # Sort by area (larger boxes first) to prioritize them; stable so ties keep input order
+        areas = boxes[:, 2] * boxes[:, 3]
+        sorted_indices = np.argsort(-areas, kind='stable')
         
-        # Sort by area (larger boxes first) to prioritize them
-        areas = [w * h for _, _, w, h in boxes]
-        sorted_indices = sorted(range(len(boxes)), key=lambda i: areas[i], reverse=True)
-        
-        filtered_indices = []
+        iou = self.iou_matrix(boxes)
+        suppressed = np.zeros(len(boxes), dtype=bool)
+        keep = np.zeros(len(boxes), dtype=bool)
         
         for i in sorted_indices:
-            should_keep = True
-            
-            # Check overlap with already kept boxes
-            for kept_idx in filtered_indices:
-                iou = self.calculate_iou(boxes[i], boxes[kept_idx])
-                if iou > iou_threshold:
-                    should_keep = False
-                    break
-            
-            if should_keep:
-                filtered_indices.append(i)
+            if suppressed[i]:
+                continue
+            keep[i] = True
+            suppressed |= iou[i] > iou_threshold
         
         # Return filtered results in original order
-        filtered_boxes = [boxes[i] for i in sorted(filtered_indices)]
-        filtered_classes = [classes[i] for i in sorted(filtered_indices)]
+        return boxes[keep], classes[keep]
+
+    def make_labels(self, detections, class_map, iou_threshold, image_size):
+        """
+        Turn raw detections into YOLO label lines
         
-        return filtered_boxes, filtered_classes
+        Args:
+            detections (Detections): Raw model detections for one image
+            class_map (dict): Model class index -> output class number
+            iou_threshold (float): IoU threshold for overlap filtering
+            image_size (tuple): (width, height) of the image in pixels
+            
+        Returns:
+            tuple: (label_lines, filtered_count)
+        """
+        # Only keep classes in the selected mappings, mapped to their new class numbers
+        keys = np.array(sorted(class_map))
+        values = np.array([class_map[k] for k in keys])
+        mask = np.isin(detections.cls, keys)
+        label_boxes = detections.xywh[mask]
+        label_classes = values[np.searchsorted(keys, detections.cls[mask])]
+        if len(label_boxes) == 0:
+            return [], 0
 
-    def process(self, folder_name, model_path, class_mappings, iou_threshold=0.5):
+        # Filter overlapping detections
+        original_count = len(label_boxes)
+        label_boxes, label_classes = self.filter_overlapping_detections(
+            label_boxes, label_classes, iou_threshold
+        )
+        filtered_count = original_count - len(label_boxes)
+
+        w_img, h_img = image_size
+        normalized = label_boxes / np.array([w_img, h_img, w_img, h_img], dtype=label_boxes.dtype)
+        label_lines = [
+            f"{cls} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+            for cls, (x, y, w, h) in zip(label_classes.tolist(), normalized.tolist())
+        ]
+        return label_lines, filtered_count
+
+    def parse_class_mappings(self, class_mappings):
+        """
+        Parse a JSON string of class mappings into {model class: output class}
+        
+        Raises:
+            ValueError: If the mappings are malformed or empty
+        """
+        try:
+            class_map = json.loads(class_mappings)
+            # Convert string keys to integers
+            class_map = {int(k): int(v) for k, v in class_map.items()}
+        except json.JSONDecodeError:
+            raise ValueError('Invalid class mappings format')
+        except (ValueError, TypeError, AttributeError):
+            raise ValueError('Invalid class number format')
+
+        if not class_map:
+            raise ValueError('No classes selected for annotation')
+        return class_map
+
+    def _move_image(self, src_path, dst_path):
+        """Give a source image its new name without re-encoding it"""
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        try:
+            os.link(src_path, dst_path)
+        except OSError:
+            # Hardlinks unsupported (e.g. across filesystems); fall back to a byte copy
+            shutil.copyfile(src_path, dst_path)
+        os.remove(src_path)
+
+    def _read_bytes(self, path, timer):
+        """Read an image file and compute its detection cache key"""
+        with timer.stage('read'):
+            try:
+                data = np.fromfile(path, dtype=np.uint8)
+            except OSError:
+                return None, None
+        with timer.stage('hash'):
+            return data, image_key(data)
+
+    def _decode(self, data, timer):
+        with timer.stage('decode'):
+            return cv2.imdecode(data, cv2.IMREAD_COLOR) if data is not None and data.size else None
+
+    def _lookup(self, names, reads, cache, io_pool, timer):
+        """
+        Look a batch of read images up in the detection cache and start decoding the misses
+
+        Cache hits are never decoded: their detections and image size come from the cache.
+
+        Args:
+            names (list): Image names of the batch
+            reads (list): Futures of _read_bytes for each image
+            cache (DetectionCache): Cache to read, or None
+            io_pool (ThreadPoolExecutor): Pool the misses are decoded on
+
+        Returns:
+            list: (image name, cache key, (detections, (width, height)) or None on a miss,
+                future of the decoded image or None on a hit) per image
+        """
+        with timer.stage('wait_read'):
+            reads = [f.result() for f in reads]
+        cached = {}
+        if cache is not None:
+            with timer.stage('cache_lookup'):
+                cached = cache.get_many(key for _, key in reads if key is not None)
+        return [
+            (img_name, key, cached[key], None) if key in cached else
+            (img_name, key, None, io_pool.submit(self._decode, data, timer))
+            for img_name, (data, key) in zip(names, reads)
+        ]
+
+    def _save_annotated(self, src_path, img, images_out, labels_out, out_img_name, label_lines, timer):
+        """Write the label file and move the source image into the annotated folder"""
+        label_name = os.path.splitext(out_img_name)[0] + '.txt'
+        with timer.stage('write_labels'):
+            with open(os.path.join(labels_out, label_name), 'w') as f:
+                f.write('\n'.join(label_lines))
+
+        out_path = os.path.join(images_out, out_img_name)
+        if src_path.lower().endswith(('.jpg', '.jpeg')):
+            with timer.stage('move'):
+                self._move_image(src_path, out_path)
+        else:
+            # Other formats are converted so the dataset is all JPEG
+            if img is None:
+                # Detections came from the cache, so the image wasn't decoded yet
+                with timer.stage('decode'):
+                    img = cv2.imread(src_path)
+            with timer.stage('encode'):
+                if not cv2.imwrite(out_path, img):
+                    raise IOError(f'Could not write {out_path}')
+            os.remove(src_path)
+
+    def _remove_source(self, src_path):
+        try:
+            os.remove(src_path)
+        except Exception as e:
+            logger.warning('Could not delete %s: %s', src_path, e)
+
+    def process(self, folder_name, model_path, class_mappings, iou_threshold=0.5, progress=None,
+                batch_size=8, io_threads=4, resume=False, use_detection_cache=True, relabel_only=False,
+                backend='torch', imgsz=None, int8=False, threads=None):
         """
         Process extracted images and create YOLO format annotations
         
@@ -100,14 +275,33 @@ class ImageAnnotator:
             model_path (str): Path to the YOLO model file
             class_mappings (str): JSON string of class mappings (only for selected classes)
             iou_threshold (float): IoU threshold for overlap filtering (default: 0.5)
+            progress (ProgressTracker): Optional tracker for progress and cancellation
+            batch_size (int): Number of images sent to the model per call
+            io_threads (int): Number of threads decoding images and writing results
+            resume (bool): Continue an interrupted annotation of this folder. Every
+                image keeps the output name it was given before the interruption.
+            use_detection_cache (bool): Reuse raw detections this model already produced
+                for an image (here or during extraction) and store new ones
+            relabel_only (bool): Rewrite the labels of the already annotated folder
+                folder_name from cached detections instead (see relabel)
+            backend (str): Inference backend, 'torch' or 'onnx' (ONNX Runtime on the CPU)
+            imgsz (int): Inference size (default: 640)
+            int8 (bool): Use an int8-quantized model with the onnx backend
+            threads (int): ONNX Runtime intra-op threads
             
         Returns:
             dict: Result containing status and message
         """
+        if relabel_only:
+            return self.relabel(folder_name, model_path, class_mappings, iou_threshold, progress=progress,
+                                batch_size=batch_size, io_threads=io_threads, backend=backend, imgsz=imgsz,
+                                int8=int8, threads=threads)
         try:
             # Validate inputs
             if not os.path.exists(model_path):
                 return {'error': 'Model file not found'}
+            if backend not in BACKENDS:
+                return {'error': f'Unknown inference backend: {backend}'}
             if not folder_name:
                 return {'error': 'No folder name provided'}
 
@@ -122,98 +316,367 @@ class ImageAnnotator:
             os.makedirs(images_out, exist_ok=True)
             os.makedirs(labels_out, exist_ok=True)
 
-            # Load model
-            model = YOLO(model_path)
+            # The model is loaded on the first image missing from the detection cache
+            model = None
+
+            def get_model():
+                nonlocal model
+                if model is None:
+                    model = model_registry.get_model(model_path, backend, imgsz, int8, threads)
+                return model
 
             # Parse class mappings
             try:
-                class_map = json.loads(class_mappings)
-                # Convert string keys to integers
-                class_map = {int(k): int(v) for k, v in class_map.items()}
-            except json.JSONDecodeError:
-                return {'error': 'Invalid class mappings format'}
-            except ValueError:
-                return {'error': 'Invalid class number format'}
+                class_map = self.parse_class_mappings(class_mappings)
+            except ValueError as e:
+                return {'error': str(e)}
 
-            if not class_map:
-                return {'error': 'No classes selected for annotation'}
+            # Source images are moved or deleted as they are processed, so the output
+            # name given to each one is journaled before any of its files change
+            settings = json.loads(json.dumps({
+                'model_sha256': model_registry.content_hash(model_path),
+                'inference': {'backend': backend, 'imgsz': imgsz, 'int8': bool(int8)},
+                'class_map': class_map,
+                'iou_threshold': iou_threshold
+            }))
+            journal = JobJournal(out_folder)
+            assigned = {}  # Journaled source image -> output name (None: no labels)
+            img_num = 0
+            if journal.exists():
+                if not resume:
+                    return {'error': f'An interrupted annotation of "{folder_name}" exists; resume it to continue'}
+                journal_settings, entries = journal.load()
+                if journal_settings != settings:
+                    return {'error': 'The interrupted annotation used a different model or settings'}
+                for entry in entries:
+                    assigned[entry['src']] = entry['out']
+                    if entry['out']:
+                        img_num = max(img_num, int(os.path.splitext(entry['out'])[0].rsplit('_', 1)[1]) + 1)
+            resumed = bool(assigned)
+            journal.open(settings)
 
             # Process images
             image_files = [f for f in os.listdir(input_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
             image_files.sort()
+            for img_name in [f for f in image_files if f in assigned and assigned[f] is None]:
+                # Already found to have no labels; only the delete was interrupted
+                self._remove_source(os.path.join(input_folder, img_name))
+                image_files.remove(img_name)
             total_images = len(image_files)
-            img_num = 0
+            if progress is None:
+                progress = ProgressTracker(total_images, unit='images')
+            else:
+                progress.total = total_images
             total_filtered = 0
+            cached_count = 0
+            unreadable = []  # Images that could not be read or decoded; left in the input folder
+            progress.extra.update({'filtered_count': 0, 'unreadable': unreadable})
+            timer = StageTimer()
+            predict_options = {'imgsz': imgsz} if imgsz else {}
+            cache = None
+            if use_detection_cache:
+                cache = DetectionCache(model_registry.detector_key(model_path, backend, imgsz, int8))
+
+            # Images for the next batch are read, looked up in the detection cache and,
+            # on a miss, decoded on the I/O pool while the current batch runs through
+            # the model; label writes and moves of finished images also run on the pool.
+            batch_size = max(1, int(batch_size))
+            batches = [image_files[i:i + batch_size] for i in range(0, total_images, batch_size)]
+            io_pool = ThreadPoolExecutor(max_workers=io_threads)
+            writes = []
+            try:
+                def read_batch(names):
+                    return [io_pool.submit(self._read_bytes, os.path.join(input_folder, n), timer) for n in names]
+
+                # Reads run two batches ahead, lookups and decodes one batch ahead
+                pending = self._lookup(batches[0], read_batch(batches[0]), cache, io_pool, timer) if batches else []
+                pending_reads = read_batch(batches[1]) if len(batches) > 1 else []
+                for batch_idx, names in enumerate(batches):
+                    progress.update(batch_idx * batch_size)
+                    if progress.cancelled:
+                        break
+
+                    batch = []  # (image name, decoded image or None on a cache hit, detections, (width, height))
+                    misses = []
+                    for img_name, key, hit, decoding in pending:
+                        if hit is not None:
+                            batch.append([img_name, None, hit[0], hit[1]])
+                            continue
+                        with timer.stage('wait_read'):
+                            img = decoding.result()
+                        if img is None:
+                            logger.warning('Could not read image %s', img_name)
+                            unreadable.append(img_name)
+                            continue
+                        h_img, w_img = img.shape[:2]
+                        batch.append([img_name, img, None, (w_img, h_img)])
+                        misses.append((batch[-1], key))
+                    if batch_idx + 1 < len(batches):
+                        pending = self._lookup(batches[batch_idx + 1], pending_reads, cache, io_pool, timer)
+                    if batch_idx + 2 < len(batches):
+                        pending_reads = read_batch(batches[batch_idx + 2])
+
+                    cached_count += len(batch) - len(misses)
+                    if misses:
+                        # Only images the model has not seen yet go through it
+                        detections = predict(get_model(), [entry[1] for entry, _ in misses], timer=timer,
+                                             **predict_options)
+                        for (entry, key), det in zip(misses, detections):
+                            entry[2] = det
+                            if cache is not None:
+                                cache.add(key, det, entry[3])
+
+                    decisions = []
+                    records = []
+                    for img_name, img, det, (w_img, h_img) in batch:
+                        img_path = os.path.join(input_folder, img_name)
+                        with timer.stage('filter'):
+                            label_lines, filtered_count = self.make_labels(
+                                det, class_map, iou_threshold, (w_img, h_img)
+                            )
+                        total_filtered += filtered_count
+                        if filtered_count > 0:
+                            logger.debug('Filtered %d overlapping detections in %s', filtered_count, img_name)
 
-            for idx, img_name in enumerate(image_files):
-                if idx % 10 == 0:  # Print progress every 10 images
-                    print(f"Processing image {idx + 1}/{total_images}")
-                    
-                img_path = os.path.join(input_folder, img_name)
-                img = cv2.imread(img_path)
-                if img is None:
-                    print(f"Warning: Could not read image {img_name}")
-                    continue
-
-                results = model(img)
-                label_boxes = []
-                label_classes = []
-
-                for r in results:
-                    for box, cls in zip(r.boxes.xywh, r.boxes.cls):
-                        cls = int(cls)
-                        # Only process if class is in selected mappings
-                        if cls in class_map:
-                            x, y, w, h = box
-                            label_boxes.append((x, y, w, h))
-                            # Use mapped class number
-                            label_classes.append(class_map[cls])
-
-                # Filter overlapping detections
-                original_count = len(label_boxes)
-                if label_boxes:
-                    label_boxes, label_classes = self.filter_overlapping_detections(
-                        label_boxes, label_classes, iou_threshold
-                    )
-                    filtered_count = original_count - len(label_boxes)
-                    total_filtered += filtered_count
-                    
-                    if filtered_count > 0:
-                        print(f"Filtered {filtered_count} overlapping detections in {img_name}")
-
-                if label_boxes:
-                    h_img, w_img = img.shape[:2]
-                    label_lines = []
-                    for cls, (x, y, w, h) in zip(label_classes, label_boxes):
-                        label_lines.append(f"{cls} {x/w_img:.6f} {y/h_img:.6f} {w/w_img:.6f} {h/h_img:.6f}")
-
-                    out_img_name = f"{folder_name}_{img_num}.jpg"
-                    cv2.imwrite(os.path.join(images_out, out_img_name), img)
-                    label_name = os.path.splitext(out_img_name)[0] + '.txt'
-                    with open(os.path.join(labels_out, label_name), 'w') as f:
-                        f.write('\n'.join(label_lines))
-                    img_num += 1
-
-                # Delete the original image after processing
-                try:
-                    os.remove(img_path)
-                except Exception as e:
-                    print(f"Warning: Could not delete {img_path}: {e}")
+                        if img_name in assigned:
+                            out_img_name = assigned[img_name]
+                        elif label_lines:
+                            out_img_name = f"{folder_name}_{img_num}.jpg"
+                            img_num += 1
+                            records.append({'src': img_name, 'out': out_img_name})
+                        else:
+                            out_img_name = None
+                            records.append({'src': img_name, 'out': None})
+                        decisions.append((img_path, img, out_img_name, label_lines))
+
+                    progress.extra['filtered_count'] = total_filtered
+                    if records:
+                        with timer.stage('journal'):
+                            journal.append(records)
+                    for img_path, img, out_img_name, label_lines in decisions:
+                        if out_img_name:
+                            writes.append(io_pool.submit(
+                                self._save_annotated, img_path, img, images_out, labels_out,
+                                out_img_name, label_lines, timer
+                            ))
+                        else:
+                            # Delete the original image after processing
+                            writes.append(io_pool.submit(self._remove_source, img_path))
+
+                    # Surface write errors early and drop finished futures
+                    for future in [f for f in writes if f.done()]:
+                        future.result()
+                        writes.remove(future)
+
+                for future in writes:
+                    future.result()
+            finally:
+                io_pool.shutdown(wait=True)
+                journal.close()
+                if cache is not None:
+                    cache.flush()
+
+            if not progress.cancelled:
+                progress.update(total_images)
+            progress.finish()
+            if progress.cancelled:
+                return {
+                    'cancelled': True,
+                    'message': f'Annotation cancelled after {progress.done} of {total_images} images. {img_num} images and labels saved to {out_folder}. Run again with resume to continue.',
+                    'processed_count': img_num,
+                    'filtered_count': total_filtered,
+                    'unreadable': unreadable,
+                    'cached_count': cached_count,
+                    'output_folder': out_folder,
+                    'progress': progress.snapshot(),
+                    'stage_timings': timer.snapshot()
+                }
+
+            journal.remove()
 
             # Clean up empty input folder
             try:
                 if os.path.isdir(input_folder):
                     os.rmdir(input_folder)
             except Exception as e:
-                print(f"Warning: Could not delete input folder: {e}")
+                logger.warning('Could not delete input folder %s: %s', input_folder, e)
 
+            message = f'Annotation complete! {img_num} images and labels saved to {out_folder}. Filtered {total_filtered} overlapping detections.'
+            if resumed:
+                message += f' Resumed after {len(assigned)} previously processed images.'
+            if cached_count:
+                message += f' Reused cached detections for {cached_count} images.'
+            if unreadable:
+                message += f' {len(unreadable)} unreadable images were left in {input_folder}.'
             return {
                 'success': True,
-                'message': f'Annotation complete! {img_num} images and labels saved to {out_folder}. Filtered {total_filtered} overlapping detections.',
+                'message': message,
                 'processed_count': img_num,
                 'filtered_count': total_filtered,
-                'output_folder': out_folder
+                'unreadable': unreadable,
+                'cached_count': cached_count,
+                'backend': backend,
+                'output_folder': out_folder,
+                'progress': progress.snapshot(),
+                'stage_timings': timer.snapshot()
+            }
+
+        except Exception as e:
+            return {'error': f'Error during annotation: {str(e)}'} 
+    def relabel(self, folder_name, model_path, class_mappings, iou_threshold=0.5, progress=None,
+                batch_size=8, io_threads=4, chunk_size=512, backend='torch', imgsz=None, int8=False, threads=None):
+        """
+        Recompute the labels of an annotated folder with new class mappings or IoU threshold
+
+        Raw detections are taken from the detection cache, so only images this
+        model has never seen go through the model. Images are not touched;
+        images left without labels keep an empty label file.
+        
+        Args:
+            folder_name (str): Name of the folder in annotated-images
+            model_path (str): Path to the YOLO model whose detections are used
+            class_mappings (str): JSON string of class mappings
+            iou_threshold (float): IoU threshold for overlap filtering
+            progress (ProgressTracker): Optional tracker for progress and cancellation
+            batch_size (int): Number of cache misses sent to the model per call
+            io_threads (int): Number of threads reading and hashing images
+            chunk_size (int): Images looked up in the cache at a time
+            backend, imgsz, int8, threads: Inference settings, as for process. The
+                cached detections used are those of these settings.
+            
+        Returns:
+            dict: Result containing status and message
+        """
+        try:
+            if not os.path.exists(model_path):
+                return {'error': 'Model file not found'}
+            if backend not in BACKENDS:
+                return {'error': f'Unknown inference backend: {backend}'}
+            if not folder_name:
+                return {'error': 'No folder name provided'}
+            out_folder = os.path.join(self.annotated_dir, folder_name)
+            images_dir = os.path.join(out_folder, 'images')
+            labels_dir = os.path.join(out_folder, 'labels')
+            if not os.path.isdir(images_dir):
+                return {'error': f'Annotated folder "{folder_name}" not found'}
+            try:
+                class_map = self.parse_class_mappings(class_mappings)
+            except ValueError as e:
+                return {'error': str(e)}
+            os.makedirs(labels_dir, exist_ok=True)
+
+            image_files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+            total_images = len(image_files)
+            if progress is None:
+                progress = ProgressTracker(total_images, unit='images')
+            else:
+                progress.total = total_images
+
+            cache = DetectionCache(model_registry.detector_key(model_path, backend, imgsz, int8))
+            predict_options = {'imgsz': imgsz} if imgsz else {}
+            timer = StageTimer()
+            model = None
+            batch_size = max(1, int(batch_size))
+            relabeled = cached_count = inferred = empty = total_filtered = 0
+            unreadable = []  # Images that could not be read or decoded; their labels are left as they were
+            progress.extra.update({'filtered_count': 0, 'unreadable': unreadable})
+            chunks = [image_files[i:i + chunk_size] for i in range(0, total_images, chunk_size)]
+            io_pool = ThreadPoolExecutor(max_workers=io_threads)
+            try:
+                def read_chunk(names):
+                    return [io_pool.submit(self._read_bytes, os.path.join(images_dir, n), timer) for n in names]
+
+                pending_reads = read_chunk(chunks[0]) if chunks else []
+                for chunk_idx, names in enumerate(chunks):
+                    progress.update(chunk_idx * chunk_size)
+                    if progress.cancelled:
+                        break
+                    with timer.stage('wait_read'):
+                        reads = [f.result() for f in pending_reads]
+                    if chunk_idx + 1 < len(chunks):
+                        pending_reads = read_chunk(chunks[chunk_idx + 1])
+
+                    with timer.stage('cache_lookup'):
+                        cached = cache.get_many(key for _, key in reads if key is not None)
+                    found = {}  # image name -> (detections, (width, height))
+                    misses = []
+                    for img_name, (data, key) in zip(names, reads):
+                        if key in cached:
+                            found[img_name] = cached[key]
+                        elif key is not None:
+                            misses.append((img_name, data, key))
+                        else:
+                            logger.warning('Could not read image %s', img_name)
+                            unreadable.append(img_name)
+                    cached_count += len(found)
+
+                    # Images the model has not seen yet go through it once
+                    for i in range(0, len(misses), batch_size):
+                        batch = []
+                        for img_name, data, key in misses[i:i + batch_size]:
+                            img = self._decode(data, timer)
+                            if img is None:
+                                logger.warning('Could not read image %s', img_name)
+                                unreadable.append(img_name)
+                                continue
+                            batch.append((img_name, img, key))
+                        if not batch:
+                            continue
+                        if model is None:
+                            model = model_registry.get_model(model_path, backend, imgsz, int8, threads)
+                        detections = predict(model, [img for _, img, _ in batch], timer=timer, **predict_options)
+                        for (img_name, img, key), det in zip(batch, detections):
+                            h_img, w_img = img.shape[:2]
+                            cache.add(key, det, (w_img, h_img))
+                            found[img_name] = (det, (w_img, h_img))
+                        inferred += len(batch)
+
+                    label_files = {}
+                    for img_name in names:
+                        if img_name not in found:
+                            continue
+                        det, image_size = found[img_name]
+                        with timer.stage('filter'):
+                            label_lines, filtered_count = self.make_labels(det, class_map, iou_threshold, image_size)
+                        total_filtered += filtered_count
+                        empty += not label_lines
+                        label_files[os.path.join(labels_dir, os.path.splitext(img_name)[0] + '.txt')] = label_lines
+                    with timer.stage('write_labels'):
+                        with locked_many(label_files):
+                            for label_file, label_lines in label_files.items():
+                                write_label_lines(label_file, label_lines, fsync=False)
+                    relabeled += len(label_files)
+                    progress.extra['filtered_count'] = total_filtered
+            finally:
+                io_pool.shutdown(wait=True)
+                cache.flush()
+
+            if relabeled:
+                # One rescan re-indexes every rewritten label file for the review page
+                get_index(out_folder).refresh(force=True)
+            if not progress.cancelled:
+                progress.update(total_images)
+            progress.finish()
+
+            message = (f'Relabeled {relabeled} of {total_images} images in {out_folder} '
+                       f'({cached_count} from cached detections, {inferred} through the model). '
+                       f'Filtered {total_filtered} overlapping detections; {empty} images have no labels.')
+            if unreadable:
+                message += f' {len(unreadable)} unreadable images were skipped.'
+            result = {
+                'message': f'Relabeling cancelled. {message}' if progress.cancelled else message,
+                'processed_count': relabeled,
+                'cached_count': cached_count,
+                'inferred_count': inferred,
+                'empty_count': empty,
+                'filtered_count': total_filtered,
+                'unreadable': unreadable,
+                'output_folder': out_folder,
+                'progress': progress.snapshot(),
+                'stage_timings': timer.snapshot()
             }
+            result['cancelled' if progress.cancelled else 'success'] = True
+            return result
 
         except Exception as e:
-            return {'error': f'Error during annotation: {str(e)}'} 
\ No newline at end of file
+            return {'error': f'Error during relabeling: {str(e)}'}
@@ -0,0 +1,485 @@
+"""
+Offline benchmark suite
+
+Generates synthetic videos, image folders and annotated folders in a temporary
+working directory and measures extraction, annotation, overlap filtering and
+the reviewer endpoints. A deterministic stub detector with configurable
+latency stands in for YOLO, so no GPU, footage or model download is needed;
+a small real model is benchmarked as well when one is available.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 1000,10000 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import cv2
+import numpy as np
+from inference import Detections
+from model_registry import registry as model_registry
+
+STUB_MODEL_NAME = 'stub.pt'
+
+
+class StubDetector:
+    """
+    Deterministic stand-in for a YOLO model
+
+    Called like a YOLO model with a list of BGR images, it sleeps for the
+    configured latency and returns Detections whose boxes depend only on the
+    seed and the image content, so repeated runs produce identical output.
+
+    Args:
+        latency_ms (float): Fixed latency per call
+        per_image_ms (float): Additional latency per image in the batch
+        boxes_per_frame (int): Number of boxes returned for every image
+        num_classes (int): Class indices are drawn from range(num_classes)
+        seed (int): Seed mixed into every image's box generator
+    """
+
+    def __init__(self, latency_ms=5.0, per_image_ms=2.0, boxes_per_frame=10, num_classes=3, seed=0):
+        self.latency_ms = latency_ms
+        self.per_image_ms = per_image_ms
+        self.boxes_per_frame = boxes_per_frame
+        self.num_classes = num_classes
+        self.seed = seed
+        self.names = {i: f'class{i}' for i in range(num_classes)}
+
+    def _detect(self, image):
+        h, w = image.shape[:2]
+        rng = np.random.default_rng([self.seed, zlib.crc32(image[::16, ::16].tobytes())])
+        n = self.boxes_per_frame
+        sizes = rng.uniform(0.05, 0.25, (n, 2)) * (w, h)
+        centers = rng.uniform(0, 1, (n, 2)) * ((w, h) - sizes) + sizes / 2
+        xywh = np.hstack([centers, sizes]).astype(np.float32)
+        cls = rng.integers(0, self.num_classes, n)
+        conf = rng.uniform(0.25, 1.0, n).astype(np.float32)
+        return Detections(xywh, cls, conf)
+
+    def __call__(self, images, verbose=False, **kwargs):
+        time.sleep((self.latency_ms + self.per_image_ms * len(images)) / 1000)
+        return [self._detect(image) for image in images]
+
+
+def latency_stats(durations):
+    """Summarize a list of durations in seconds"""
+    ms = np.array(durations) * 1000
+    return {
+        'calls': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'min_ms': round(float(ms.min()), 3),
+        'max_ms': round(float(ms.max()), 3)
+    }
+
+
+def time_calls(fn, repeat=None, budget=0.5, max_repeat=1000):
+    """Call fn repeatedly (a fixed number of times, or until budget seconds pass) and return stats"""
+    durations = []
+    deadline = time.perf_counter() + budget
+    while len(durations) < (repeat or max_repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+        if repeat is None and time.perf_counter() > deadline:
+            break
+    return latency_stats(durations)
+
+
+def make_video(path, frames, width, height, fps=30, seed=0):
+    """Write a synthetic video of moving rectangles over a noisy background"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    objects = [(rng.uniform(0, width), rng.uniform(0, height), rng.uniform(-8, 8), rng.uniform(-8, 8),
+                tuple(int(c) for c in rng.integers(0, 255, 3))) for _ in range(8)]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for i in range(frames):
+        frame = background.copy()
+        for x, y, dx, dy, color in objects:
+            cx = int((x + dx * i) % width)
+            cy = int((y + dy * i) % height)
+            cv2.rectangle(frame, (cx, cy), (cx + width // 10, cy + height // 10), color, -1)
+        writer.write(frame)
+    writer.release()
+
+
+def make_image_folder(folder, count, width, height, seed=0):
+    """Write count synthetic JPEG frames into folder"""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(count):
+        img = np.roll(base, i * 7, axis=1)
+        cv2.rectangle(img, (i % width, 0), (i % width + width // 8, height // 8), (255, 255, 255), -1)
+        cv2.imwrite(os.path.join(folder, f'frame_{i:06d}.jpg'), img)
+
+
+def make_annotated_folder(folder, count, num_classes=5, seed=0):
+    """Create an annotated folder of count label files; images are hardlinks of one small JPEG"""
+    images_dir = os.path.join(folder, 'images')
+    labels_dir = os.path.join(folder, 'labels')
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+    source = os.path.join(folder, 'source.jpg')
+    cv2.imwrite(source, np.full((360, 640, 3), 127, dtype=np.uint8))
+    rnd = random.Random(seed)
+    name = os.path.basename(folder)
+    for i in range(count):
+        stem = f'{name}_{i}'
+        lines = [f'{rnd.randrange(num_classes)} {rnd.uniform(0.1, 0.9):.6f} {rnd.uniform(0.1, 0.9):.6f} '
+                 f'{rnd.uniform(0.02, 0.2):.6f} {rnd.uniform(0.02, 0.2):.6f}' for _ in range(rnd.randint(1, 5))]
+        with open(os.path.join(labels_dir, stem + '.txt'), 'w') as f:
+            f.write('\n'.join(lines))
+        try:
+            os.link(source, os.path.join(images_dir, stem + '.jpg'))
+        except OSError:
+            shutil.copyfile(source, os.path.join(images_dir, stem + '.jpg'))
+    os.remove(source)
+
+
+class _QuietProgress:
+    """Progress tracker that records nothing, so benchmarks don't time console output"""
+
+    def __init__(self):
+        self.total = 0
+        self.unit = ''
+        self.done = 0
+        self.cancelled = False
+        self.extra = {}
+
+    def update(self, done):
+        self.done = done
+
+    def finish(self):
+        pass
+
+    def snapshot(self):
+        return {'done': self.done, 'total': self.total, 'unit': self.unit, **self.extra}
+
+
+def throughput_record(name, items, seconds, unit, result=None):
+    """Throughput of a run; a run whose result holds an error gets no rate, only the error"""
+    failed = result is not None and bool(result.get('error'))
+    record = {
+        'name': name,
+        'items': items,
+        'unit': unit,
+        'seconds': round(seconds, 4),
+        'items_per_s': round(items / seconds, 2) if seconds > 0 and not failed else None
+    }
+    if result is not None:
+        record['stage_timings'] = {stage: {k: v for k, v in t.items() if k != 'buckets'}
+                                   for stage, t in (result.get('stage_timings') or {}).items()}
+        if result.get('error'):
+            record['error'] = result['error']
+    return record
+
+
+def bench_extraction(args, model_name, label, frames):
+    from extractor import ImageExtractor
+
+    video = os.path.join('videos', 'bench.mp4')
+    if not os.path.exists(video):
+        make_video(video, args.frames, args.width, args.height)
+    mappings = json.dumps({str(c): c for c in range(3)})
+    configs = [
+        ('extract', {}),
+        ('extract_skip5', {'frame_skip': 5}),
+        ('extract_single_pass', {'class_mappings': mappings}),
+        ('extract_cascade', {'gate_imgsz': max(32, args.imgsz // 64 * 32)}),
+    ]
+    records = []
+    for config_name, options in configs:
+        folder = f'bench_{label}_{config_name}'
+        start = time.perf_counter()
+        result = ImageExtractor().process(
+            video, os.path.join('models', model_name), [0, 1, 2], folder_name=folder,
+            batch_size=args.batch_size, progress=_QuietProgress(), **options
+        )
+        seconds = time.perf_counter() - start
+        record = throughput_record(f'extraction/{label}/{config_name}', frames, seconds, 'frames', result)
+        record['saved'] = result.get('saved_count')
+        record['gate_count'] = result.get('gate_count')
+        record['inferred'] = result.get('inferred_count')
+        records.append(record)
+        for root in ('extracted-images', 'annotated-images'):
+            shutil.rmtree(os.path.join(root, folder), ignore_errors=True)
+    return records
+
+
+def bench_annotation(args, model_name, label, images, **options):
+    from annotator import ImageAnnotator
+
+    folder = f'bench_{label}_annotate'
+    make_image_folder(os.path.join('extracted-images', folder), images, args.width, args.height)
+    start = time.perf_counter()
+    # Without the detection cache, so every run measures the model
+    result = ImageAnnotator().process(
+        folder, os.path.join('models', model_name), json.dumps({'0': 0, '1': 1, '2': 2}),
+        batch_size=args.batch_size, progress=_QuietProgress(), use_detection_cache=False, **options
+    )
+    seconds = time.perf_counter() - start
+    record = throughput_record(f'annotation/{label}', images, seconds, 'images', result)
+    record['saved'] = result.get('processed_count')
+    for root in ('extracted-images', 'annotated-images'):
+        shutil.rmtree(os.path.join(root, folder), ignore_errors=True)
+    return [record]
+
+
+def bench_backends(args, model_name):
+    """Annotation throughput of the ONNX Runtime backends relative to the torch path"""
+    model_path = os.path.join('models', model_name)
+    configs = [
+        ('torch', {'backend': 'torch'}),
+        ('onnx', {'backend': 'onnx'}),
+        ('onnx_int8', {'backend': 'onnx', 'int8': True}),
+    ]
+    records = []
+    torch_rate = None
+    for label, options in configs:
+        options = {**options, 'imgsz': args.imgsz}
+        start = time.perf_counter()
+        try:
+            # Export (cached next to the model) and load outside the timed run
+            model_registry.get_model(model_path, options['backend'], args.imgsz, options.get('int8', False))
+        except ImportError as e:
+            print(f'Skipping {label} backend: {e}')
+            continue
+        load_seconds = time.perf_counter() - start
+        record = bench_annotation(args, model_name, f'backend_{label}', args.images, **options)[0]
+        record['load_seconds'] = round(load_seconds, 4)
+        if label == 'torch':
+            torch_rate = record['items_per_s']
+        elif torch_rate and record['items_per_s']:
+            record['speedup_vs_torch'] = round(record['items_per_s'] / torch_rate, 2)
+        records.append(record)
+    return records
+
+
+def bench_filter(args):
+    from annotator import ImageAnnotator
+
+    annotator = ImageAnnotator()
+    rng = np.random.default_rng(0)
+    records = []
+    for n in (10, 50, 200, 1000):
+        centers = rng.uniform(100, 1800, (n, 2))
+        sizes = rng.uniform(20, 300, (n, 2))
+        boxes = np.hstack([centers, sizes]).astype(np.float32)
+        classes = rng.integers(0, 3, n)
+        stats = time_calls(lambda: annotator.filter_overlapping_detections(boxes, classes, 0.5))
+        records.append({'name': f'filter_overlapping_detections/{n}_boxes', **stats})
+    return records
+
+
+def bench_reviewer(args, size):
+    import main as app_module
+
+    client = app_module.app.test_client()
+    folder = f'bench_{size}'
+    folder_path = os.path.join('annotated-images', folder)
+    start = time.perf_counter()
+    make_annotated_folder(folder_path, size)
+    records = [{'name': f'reviewer/{size}/generate_folder', 'seconds': round(time.perf_counter() - start, 3)}]
+    classes = ['0', '1', '2']
+    rnd = random.Random(1)
+    stems = [f'{folder}_{rnd.randrange(size)}' for _ in range(200)]
+
+    def review(action, **fields):
+        data = {'action': action, 'folder_name': folder, 'class_names[]': classes, **fields}
+        response = client.post('/review', data=data)
+        assert response.status_code == 200 and 'error' not in response.json, response.json
+        return response.json
+
+    def record(name, stats):
+        records.append({'name': f'reviewer/{size}/{name}', **stats})
+
+    record('class_counts_cold', time_calls(
+        lambda: client.get(f'/get_folder_class_counts?folder={folder}'), repeat=1))
+    record('class_counts', time_calls(lambda: client.get(f'/get_folder_class_counts?folder={folder}')))
+    record('get_images_page_first', time_calls(lambda: review('get_images_page', offset=0, page_size=100)))
+    record('get_images_page_middle', time_calls(
+        lambda: review('get_images_page', offset=size // 2, page_size=100)))
+
+    def follow_cursor(pages=10):
+        cursor = None
+        for _ in range(pages):
+            page = review('get_images_page', page_size=100, **({'cursor': cursor} if cursor else {}))
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+    record('get_images_page_cursor_x10', time_calls(follow_cursor))
+    record('get_image_annotations', time_calls(
+        lambda: review('get_image_annotations', image_name=rnd.choice(stems) + '.jpg')))
+
+    def batch_edit():
+        stem = rnd.choice(stems)
+        operations = [{'op': 'add', 'image_name': stem + '.jpg', 'box': '0.5,0.5,0.1,0.1', 'class_name': '9'}]
+        review('batch_edit', operations=json.dumps(operations))
+    record('batch_edit', time_calls(batch_edit))
+
+    image_path = os.path.join(folder_path, 'images', stems[0] + '.jpg')
+    record('get_image', time_calls(lambda: client.get(f'/get_image/{image_path}')))
+    record('get_image_thumbnail', time_calls(lambda: client.get(f'/get_image/{image_path}?size=160')))
+    if size <= args.full_list_limit:
+        record('get_images_full_list', time_calls(lambda: review('get_images'), repeat=3))
+
+    shutil.rmtree(folder_path, ignore_errors=True)
+    return records
+
+
+def find_real_model(path):
+    """Return the absolute path of a small real model to benchmark, or None"""
+    candidates = [path] if path else ['yolo11n.pt', os.path.join('models', 'yolo11n.pt')]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+    return None
+
+
+def git_commit(repo_dir):
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print the change of each benchmark relative to a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    print(f'\nComparison with {baseline_path}:')
+    for record in results:
+        old = baseline.get(record['name'])
+        if old is None:
+            continue
+        for key, higher_is_better in (('items_per_s', True), ('mean_ms', False)):
+            if record.get(key) and old.get(key):
+                ratio = record[key] / old[key] if higher_is_better else old[key] / record[key]
+                print(f"  {record['name']:<60} {key} {old[key]:>10} -> {record[key]:>10}  ({ratio:.2f}x)")
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for extraction, annotation and review')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma-separated label-file counts for the reviewer benchmarks')
+    parser.add_argument('--frames', type=int, default=300, help='Frames in the synthetic video')
+    parser.add_argument('--images', type=int, default=200, help='Images in the synthetic annotation folder')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--stub-latency-ms', type=float, default=5.0, help='Stub detector latency per call')
+    parser.add_argument('--stub-per-image-ms', type=float, default=2.0, help='Stub detector latency per image')
+    parser.add_argument('--boxes', type=int, default=10, help='Stub detector boxes per frame')
+    parser.add_argument('--real-model', help='Path to a small real model (default: yolo11n.pt if present)')
+    parser.add_argument('--full-list-limit', type=int, default=10000,
+                        help='Largest folder for which the legacy full get_images list is timed')
+    parser.add_argument('--imgsz', type=int, default=640, help='Inference size for the backend comparison (the cascade gate runs at half of it)')
+    parser.add_argument('--skip', default='',
+                        help='Comma-separated groups to skip: extraction,annotation,filter,reviewer,real,backends')
+    parser.add_argument('--output', default='benchmark-results.json', help='JSON file for the results')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary working directory')
+    args = parser.parse_args()
+
+    skip = {s.strip() for s in args.skip.split(',') if s.strip()}
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    # Modules are imported lazily after switching to the working directory
+    sys.path.insert(0, repo_dir)
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    real_model = None if 'real' in skip else find_real_model(args.real_model)
+
+    workdir = tempfile.mkdtemp(prefix='annotation-bench-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = []
+    try:
+        for dir_name in ('models', 'videos', 'extracted-images', 'annotated-images'):
+            os.makedirs(dir_name, exist_ok=True)
+        stub_path = os.path.join('models', STUB_MODEL_NAME)
+        with open(stub_path, 'wb'):
+            pass
+        model_registry.register(stub_path, StubDetector(
+            latency_ms=args.stub_latency_ms, per_image_ms=args.stub_per_image_ms, boxes_per_frame=args.boxes))
+
+        if 'filter' not in skip:
+            print('Benchmarking filter_overlapping_detections...')
+            results += bench_filter(args)
+        if 'extraction' not in skip:
+            print('Benchmarking extraction (stub detector)...')
+            results += bench_extraction(args, STUB_MODEL_NAME, 'stub', args.frames)
+        if 'annotation' not in skip:
+            print('Benchmarking annotation (stub detector)...')
+            results += bench_annotation(args, STUB_MODEL_NAME, 'stub', args.images)
+        if real_model:
+            shutil.copy(real_model, os.path.join('models', 'real.pt'))
+            print(f'Benchmarking extraction and annotation with {real_model}...')
+            try:
+                if 'extraction' not in skip:
+                    results += bench_extraction(args, 'real.pt', 'real', args.frames)
+                if 'annotation' not in skip:
+                    results += bench_annotation(args, 'real.pt', 'real', args.images)
+                if 'backends' not in skip:
+                    print('Comparing inference backends...')
+                    results += bench_backends(args, 'real.pt')
+            except ImportError as e:
+                print(f'Skipping real model benchmarks: {e}')
+        if 'reviewer' not in skip:
+            for size in (int(s) for s in args.sizes.split(',') if s.strip()):
+                print(f'Benchmarking reviewer endpoints with {size} label files...')
+                results += bench_reviewer(args, size)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f'Working directory kept at {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': git_commit(repo_dir),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'real_model': real_model,
+            'args': vars(args)
+        },
+        'results': results
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for record in results:
+        if record.get('error'):
+            print(f"{record['name']:<60} FAILED: {record['error']}")
+        elif 'items_per_s' in record:
+            print(f"{record['name']:<60} {record['items_per_s']:>10} {record['unit']}/s")
+        elif 'mean_ms' in record:
+            print(f"{record['name']:<60} {record['mean_ms']:>10} ms (p95 {record['p95_ms']} ms)")
+        else:
+            print(f"{record['name']:<60} {record['seconds']:>10} s")
+    print(f'Results written to {output}')
+    if baseline:
+        compare(results, baseline)
+    failed = [record['name'] for record in results if record.get('error')]
+    if failed:
+        print(f'{len(failed)} benchmark runs failed: {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
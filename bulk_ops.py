@@ -0,0 +1,199 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from annotation_index import get_index
+from label_io import lock_path, locked_many, read_label_lines, write_label_lines
+
+
+def _edit_lines(lines, remap, drop):
+    """
+    Apply a class remap and drop set to the lines of one label file
+
+    Returns:
+        tuple: (new lines, {class: remapped count}, {class: dropped count})
+    """
+    new_lines = []
+    remapped = {}
+    dropped = {}
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        cls = parts[0]
+        if cls in drop:
+            dropped[cls] = dropped.get(cls, 0) + 1
+            continue
+        if cls in remap and remap[cls] != cls:
+            remapped[cls] = remapped.get(cls, 0) + 1
+            parts[0] = remap[cls]
+            line = ' '.join(parts)
+        new_lines.append(line)
+    return new_lines, remapped, dropped
+
+
+def _merge_counts(total, counts):
+    for cls, count in counts.items():
+        total[cls] = total.get(cls, 0) + count
+
+
+def _process_chunk(folder_path, stems, remap, drop, delete_empty_frames, dry_run):
+    """Apply a bulk operation to a chunk of label files (runs in a worker process)"""
+    labels_dir = os.path.join(folder_path, 'labels')
+    images_dir = os.path.join(folder_path, 'images')
+    result = {
+        'files_changed': 0,
+        'frames_deleted': 0,
+        'remapped': {},
+        'dropped': {}
+    }
+
+    # Files sharing a lock file are edited under one acquisition of that lock
+    by_lock = {}
+    for stem in stems:
+        label_file = os.path.join(labels_dir, stem + '.txt')
+        by_lock.setdefault(lock_path(label_file), []).append((stem, label_file))
+
+    for label_files in by_lock.values():
+        with locked_many(label_file for _, label_file in label_files):
+            for stem, label_file in label_files:
+                try:
+                    new_lines, remapped, dropped = _edit_lines(read_label_lines(label_file), remap, drop)
+                except OSError:
+                    continue
+                delete_frame = delete_empty_frames and not new_lines
+                if delete_frame:
+                    if not dry_run:
+                        image_path = os.path.join(images_dir, stem + '.jpg')
+                        if os.path.exists(image_path):
+                            os.remove(image_path)
+                        os.remove(label_file)
+                    result['frames_deleted'] += 1
+                elif remapped or dropped:
+                    if not dry_run:
+                        write_label_lines(label_file, new_lines, fsync=False)
+                    result['files_changed'] += 1
+                _merge_counts(result['remapped'], remapped)
+                _merge_counts(result['dropped'], dropped)
+    return result
+
+
+class BulkClassEditor:
+    """
+    Folder-wide class operations on annotated label files
+
+    Label files are processed in chunks by a pool of worker processes. Every
+    file that needs a change is locked and rewritten atomically, so bulk
+    edits are safe to run while the folder is being reviewed.
+    """
+
+    def __init__(self):
+        self.annotated_dir = 'annotated-images'
+
+    def process(self, folder_name, remap=None, drop_classes=None, delete_empty_frames=False,
+                dry_run=False, workers=None, chunk_size=1000, progress=None):
+        """
+        Remap, merge or drop classes across every label file of a folder
+
+        Args:
+            folder_name (str): Name of the annotated folder
+            remap (dict): Map of class -> new class. Mapping several classes to
+                the same target merges them.
+            drop_classes (list): Classes whose annotations are removed
+            delete_empty_frames (bool): Delete frames (image and label) that have
+                no annotations left afterwards
+            dry_run (bool): Only count what would change; nothing is written
+            workers (int): Number of worker processes (default: CPU count)
+            chunk_size (int): Label files per task
+            progress (ProgressTracker): Optional progress reporter
+
+        Returns:
+            dict: Per-class remapped/dropped counts, files changed and frames deleted
+        """
+        folder_path = os.path.join(self.annotated_dir, folder_name)
+        labels_dir = os.path.join(folder_path, 'labels')
+        if not os.path.isdir(labels_dir):
+            return {'error': 'Labels directory not found'}
+
+        remap = {str(k).strip(): str(v).strip() for k, v in (remap or {}).items()}
+        drop = {str(c).strip() for c in (drop_classes or [])}
+        if any(not cls or len(cls.split()) != 1 for cls in remap.values()):
+            return {'error': 'Invalid target class'}
+        if not remap and not drop and not delete_empty_frames:
+            return {'error': 'No operation given'}
+        overlap = drop & remap.keys()
+        if overlap:
+            return {'error': f'Classes cannot be both remapped and dropped: {", ".join(sorted(overlap))}'}
+
+        stems = sorted(name[:-4] for name in os.listdir(labels_dir) if name.endswith('.txt'))
+        chunks = [stems[i:i + chunk_size] for i in range(0, len(stems), chunk_size)]
+        if progress is not None:
+            progress.total = len(stems)
+            progress.unit = 'files'
+
+        totals = {'files_changed': 0, 'frames_deleted': 0, 'remapped': {}, 'dropped': {}}
+        done = 0
+        cancelled = False
+
+        def collect(result, chunk_len):
+            nonlocal done
+            totals['files_changed'] += result['files_changed']
+            totals['frames_deleted'] += result['frames_deleted']
+            _merge_counts(totals['remapped'], result['remapped'])
+            _merge_counts(totals['dropped'], result['dropped'])
+            done += chunk_len
+            if progress is not None:
+                progress.update(done)
+
+        options = (remap, drop, delete_empty_frames, dry_run)
+        workers = workers or os.cpu_count() or 1
+        if len(chunks) <= 1 or workers <= 1:
+            # Not worth starting processes for a small folder
+            for chunk in chunks:
+                collect(_process_chunk(folder_path, chunk, *options), len(chunk))
+                if progress is not None and progress.cancelled:
+                    cancelled = True
+                    break
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)),
+                mp_context=multiprocessing.get_context('spawn')
+            ) as executor:
+                pending = {executor.submit(_process_chunk, folder_path, chunk, *options): len(chunk)
+                           for chunk in chunks}
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        collect(future.result(), pending.pop(future))
+                    if progress is not None and progress.cancelled:
+                        cancelled = True
+                        for future in pending:
+                            future.cancel()
+                        break
+
+        if not dry_run and (totals['files_changed'] or totals['frames_deleted']):
+            # One rescan re-indexes every changed file in a single transaction
+            get_index(folder_path).refresh(force=True)
+        if progress is not None:
+            progress.finish()
+
+        remapped = sum(totals['remapped'].values())
+        dropped = sum(totals['dropped'].values())
+        verb = 'Would change' if dry_run else 'Changed'
+        message = (f"{verb} {totals['files_changed']} label files ({remapped} annotations remapped, "
+                   f"{dropped} dropped) and {'delete' if dry_run else 'deleted'} "
+                   f"{totals['frames_deleted']} empty frames out of {len(stems)}")
+        if cancelled:
+            message = f'Bulk edit cancelled. {message} before stopping'
+
+        result = {
+            'dry_run': dry_run,
+            'message': message,
+            'files_scanned': done,
+            'files_total': len(stems),
+            'files_changed': totals['files_changed'],
+            'frames_deleted': totals['frames_deleted'],
+            'annotations_remapped': totals['remapped'],
+            'annotations_dropped': totals['dropped']
+        }
+        result['cancelled' if cancelled else 'success'] = True
+        return result
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+
+CHECKPOINT_NAME = '.checkpoint.json'
+JOURNAL_NAME = '.journal.jsonl'
+
+
+class JobCheckpoint:
+    """
+    Small JSON manifest recording how far a job got, kept in its output folder
+
+    Written atomically (temp file, fsync, rename) and at most once per
+    interval unless forced, so it costs next to nothing on long runs. The
+    settings a job was started with are stored alongside its progress; a
+    resume with different settings is refused.
+
+    Args:
+        folder (str): Output folder of the job
+        interval (float): Minimum seconds between checkpoint writes
+    """
+
+    def __init__(self, folder, interval=30.0):
+        self.path = os.path.join(folder, CHECKPOINT_NAME)
+        self.interval = interval
+        self._last_save = 0.0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Return the saved checkpoint dict, or None if there is none"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def due(self):
+        """Return True if the interval since the last save has passed"""
+        return time.time() - self._last_save >= self.interval
+
+    def save(self, state):
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._last_save = time.time()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class JobJournal:
+    """
+    Append-only record of the decisions a job has made, one JSON object per line
+
+    The first line holds the job settings. Lines are appended before the
+    work they describe is started, so after a crash every input that may
+    have been touched is in the journal.
+
+    Args:
+        folder (str): Output folder of the job
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, JOURNAL_NAME)
+        self._file = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """
+        Return (settings, entries) from an existing journal
+
+        A partially written last line (from a crash mid-append) is ignored.
+        """
+        settings = None
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if settings is None:
+                    settings = record
+                else:
+                    entries.append(record)
+        return settings, entries
+
+    def open(self, settings=None):
+        """Open the journal for appending, writing the settings line to a new journal"""
+        is_new = not self.exists()
+        self._file = open(self.path, 'a')
+        if is_new:
+            self.append([settings or {}])
+
+    def append(self, records):
+        """Durably append a list of records"""
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
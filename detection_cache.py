@@ -0,0 +1,121 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+from inference import Detections
+
+CACHE_DIR = '.cache/detections'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    image_key TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER,
+    boxes BLOB
+);
+"""
+
+
+def image_key(data):
+    """Return the cache key of an image: the sha1 of its encoded bytes"""
+    return hashlib.sha1(memoryview(data)).hexdigest()
+
+
+def _pack(detections):
+    # One float32 row per box: x, y, w, h (pixels), confidence, class
+    rows = np.empty((len(detections), 6), dtype=np.float32)
+    rows[:, :4] = detections.xywh
+    rows[:, 4] = detections.conf
+    rows[:, 5] = detections.cls
+    return rows.tobytes()
+
+
+def _unpack(blob):
+    rows = np.frombuffer(blob, dtype=np.float32).reshape(-1, 6)
+    return Detections(rows[:, :4].copy(), rows[:, 5].astype(int), rows[:, 4].copy())
+
+
+class DetectionCache:
+    """
+    Raw detections of one model for every image it has seen
+
+    Boxes, classes and confidences are stored before any class mapping or
+    overlap filtering, keyed by the content hash of the encoded image, so
+    they survive images being renamed or moved between folders. Each model
+    (by content hash) gets its own SQLite file under cache_dir; the cache can
+    be deleted at any time. Writes are buffered and committed in batches.
+
+    Args:
+        model_sha256 (str): Content hash of the model the detections come from
+        cache_dir (str): Directory holding one database per model
+        flush_every (int): Buffered detections that trigger a commit
+    """
+
+    def __init__(self, model_sha256, cache_dir=CACHE_DIR, flush_every=256):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(os.path.abspath(cache_dir), f'{model_sha256[:16]}.sqlite')
+        self.flush_every = flush_every
+        self._pending = []
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection for one transaction; segment workers write concurrently"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys):
+        """
+        Look up several images
+
+        Returns:
+            dict: image key -> (Detections, (width, height)) for the keys found
+        """
+        keys = list(keys)
+        wanted = set(keys)
+        found = {}
+        with self._lock:
+            for key, width, height, blob in self._pending:
+                if key in wanted:
+                    found[key] = (_unpack(blob), (width, height))
+        with self._connect() as conn:
+            for i in range(0, len(keys), 500):
+                chunk = [k for k in keys[i:i + 500] if k not in found]
+                if not chunk:
+                    continue
+                placeholders = ','.join('?' * len(chunk))
+                for key, width, height, blob in conn.execute(
+                        f'SELECT image_key, width, height, boxes FROM detections WHERE image_key IN ({placeholders})',
+                        chunk):
+                    found[key] = (_unpack(blob), (width, height))
+        return found
+
+    def add(self, key, detections, image_size):
+        """Queue the detections of one image for storage"""
+        width, height = image_size
+        with self._lock:
+            self._pending.append((key, int(width), int(height), _pack(detections)))
+            flush = len(self._pending) >= self.flush_every
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Commit buffered detections"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with self._connect() as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO detections (image_key, width, height, boxes) VALUES (?, ?, ?, ?)',
+                    pending
+                )
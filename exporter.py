@@ -0,0 +1,398 @@
+import io
+import os
+import json
+import logging
+import tarfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from annotation_index import get_index
+from reviewer import remove_review_overlays
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'exports'
+MANIFEST_NAME = 'manifest.json'
+COCO_NAME = 'annotations.coco.json'
+BOXES_NAME = 'boxes.npy'
+OFFSETS_NAME = 'offsets.npy'
+TAR_OVERHEAD = 1024  # Header and padding bytes per tar member, used to size shards
+
+# Start-of-frame markers (everything from 0xC0 to 0xCF except DHT, JPG and DAC)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data):
+    """
+    Return (width, height) of a JPEG from its header, without decoding it
+
+    Returns:
+        tuple: (width, height), or None if no frame header was found
+    """
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+        elif marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+        elif marker in _SOF_MARKERS:
+            return int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+        else:
+            i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+def _image_size(data):
+    size = jpeg_size(data)
+    if size is None:
+        import cv2
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        size = (img.shape[1], img.shape[0])
+    return size
+
+
+def _signature(image_path, label_path):
+    """mtime and size of a frame's image and label file; any change means it is exported again"""
+    st = os.stat(image_path)
+    try:
+        label_st = os.stat(label_path)
+        label_sig = [label_st.st_mtime_ns, label_st.st_size]
+    except OSError:
+        label_sig = None
+    return [st.st_mtime_ns, st.st_size, label_sig]
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _add_member(tar, name, data, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _write_shard(folder_path, shard_path, stems):
+    """
+    Write one tar shard of image/label pairs (runs in a worker process)
+
+    Each frame becomes <stem>.jpg and <stem>.txt, adjacent in the archive, so
+    WebDataset-style loaders read a sample with one sequential read. Frames
+    deleted since they were planned are left out.
+
+    Returns:
+        dict: stem -> {signature, width, height} for every frame written
+    """
+    images_dir = os.path.join(folder_path, 'images')
+    labels_dir = os.path.join(folder_path, 'labels')
+    samples = {}
+    tmp_path = f'{shard_path}.{os.getpid()}.tmp'
+    with tarfile.open(tmp_path, 'w', format=tarfile.USTAR_FORMAT) as tar:
+        for stem in stems:
+            image_path = os.path.join(images_dir, stem + '.jpg')
+            label_path = os.path.join(labels_dir, stem + '.txt')
+            try:
+                # Stat before reading: a frame edited meanwhile is exported again next time
+                signature = _signature(image_path, label_path)
+                with open(image_path, 'rb') as f:
+                    image_data = f.read()
+            except OSError:
+                continue
+            try:
+                with open(label_path, 'rb') as f:
+                    label_data = f.read()
+            except OSError:
+                label_data = b''
+            size = _image_size(image_data)
+            if size is None:
+                logger.warning('Could not read image %s', image_path)
+                continue
+            _add_member(tar, stem + '.jpg', image_data, signature[0] // 10 ** 9)
+            _add_member(tar, stem + '.txt', label_data, signature[0] // 10 ** 9)
+            samples[stem] = {'signature': signature, 'width': size[0], 'height': size[1]}
+    os.replace(tmp_path, shard_path)
+    return samples
+
+
+class DatasetExporter:
+    """
+    Exports an annotated folder as a training-ready dataset
+
+    The export in exports/<folder_name> holds:
+        shards/<folder_name>-NNNNNN.tar: image/label pairs in sequential tar shards
+        annotations.coco.json: every frame and box in COCO format
+        boxes.npy: float32 rows of (class, x, y, w, h) in normalized YOLO
+            coordinates for all frames, loadable with np.load(mmap_mode='r')
+        offsets.npy: int64 table; the boxes of COCO image i are rows
+            offsets[i]:offsets[i + 1]
+        manifest.json: the shard of every frame and the mtime/size of its
+            files when exported
+
+    Exports are incremental: only shards holding frames that changed, were
+    added or were deleted since the last export are written again, and new
+    frames go into new shards. Shards are written by a pool of worker
+    processes; an interrupted export keeps the shards it finished.
+    """
+
+    def __init__(self):
+        self.annotated_dir = 'annotated-images'
+        self.export_dir = EXPORT_DIR
+
+    def _load_manifest(self, path, folder_name):
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('folder') != folder_name:
+            return None
+        return manifest
+
+    def _plan(self, manifest, current, shards_dir, shard_bytes, sort_key, folder_name):
+        """
+        Decide which shards to keep, rewrite, delete and create
+
+        Returns:
+            tuple: (kept shard names, [(shard name, stems)] to write, shard names to delete)
+        """
+        kept, tasks, removed = [], [], []
+        placed = set()
+        for name, stems in sorted(manifest['shards'].items()):
+            members = [stem for stem in stems if stem in current]
+            placed.update(members)
+            unchanged = (
+                len(members) == len(stems)
+                and all(manifest['samples'].get(stem, {}).get('signature') == current[stem] for stem in members)
+                and os.path.exists(os.path.join(shards_dir, name))
+            )
+            if not members:
+                removed.append(name)
+            elif unchanged:
+                kept.append(name)
+            else:
+                tasks.append((name, members))
+
+        # New frames are packed in frame order into new shards after the existing ones
+        next_num = max((int(name.rsplit('-', 1)[1][:-len('.tar')]) + 1 for name in manifest['shards']), default=0)
+        batch, batch_bytes = [], 0
+        for stem in sorted(current.keys() - placed, key=sort_key):
+            sample_bytes = current[stem][1] + (current[stem][2] or [0, 0])[1] + 2 * TAR_OVERHEAD
+            if batch and batch_bytes + sample_bytes > shard_bytes:
+                tasks.append((f'{folder_name}-{next_num:06d}.tar', batch))
+                next_num += 1
+                batch, batch_bytes = [], 0
+            batch.append(stem)
+            batch_bytes += sample_bytes
+        if batch:
+            tasks.append((f'{folder_name}-{next_num:06d}.tar', batch))
+        return kept, tasks, removed
+
+    def _write_annotations(self, export_path, folder_path, manifest, sort_key):
+        """
+        Write the COCO JSON and the box arrays for every exported frame
+
+        Returns:
+            tuple: (number of boxes, number of annotations skipped for a non-numeric class)
+        """
+        index = get_index(folder_path)
+        index.refresh(force=True)
+        annotations = dict(index.annotations_for_classes(list(index.class_counts())))
+
+        stems = sorted(manifest['samples'], key=sort_key)
+        shard_of = {stem: name for name, members in manifest['shards'].items() for stem in members}
+        images, coco_annotations, rows = [], [], []
+        offsets = np.zeros(len(stems) + 1, dtype=np.int64)
+        categories = set()
+        skipped = 0
+        for image_id, stem in enumerate(stems):
+            sample = manifest['samples'][stem]
+            w_img, h_img = sample['width'], sample['height']
+            images.append({
+                'id': image_id,
+                'file_name': stem + '.jpg',
+                'width': w_img,
+                'height': h_img,
+                'shard': shard_of.get(stem)
+            })
+            for annotation in annotations.get(stem, []):
+                try:
+                    cls = int(annotation['class'])
+                except ValueError:
+                    skipped += 1
+                    continue
+                x, y, w, h = annotation['x'], annotation['y'], annotation['width'], annotation['height']
+                rows.append((cls, x, y, w, h))
+                categories.add(cls)
+                box_w, box_h = w * w_img, h * h_img
+                coco_annotations.append({
+                    'id': len(coco_annotations) + 1,
+                    'image_id': image_id,
+                    'category_id': cls,
+                    'bbox': [round((x - w / 2) * w_img, 2), round((y - h / 2) * h_img, 2),
+                             round(box_w, 2), round(box_h, 2)],
+                    'area': round(box_w * box_h, 2),
+                    'iscrowd': 0
+                })
+            offsets[image_id + 1] = len(rows)
+
+        _write_json(os.path.join(export_path, COCO_NAME), {
+            'images': images,
+            'annotations': coco_annotations,
+            'categories': [{'id': cls, 'name': str(cls)} for cls in sorted(categories)]
+        })
+        for name, array in ((BOXES_NAME, np.array(rows, dtype=np.float32).reshape(-1, 5)), (OFFSETS_NAME, offsets)):
+            tmp_path = os.path.join(export_path, f'{name}.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, os.path.join(export_path, name))
+        return len(rows), skipped
+
+    def process(self, folder_name, shard_size_mb=256, workers=None, full=False, progress=None):
+        """
+        Export an annotated folder as tar shards, COCO JSON and box arrays
+
+        Args:
+            folder_name (str): Name of the annotated folder
+            shard_size_mb (float): Target size of each tar shard in MB
+            workers (int): Number of worker processes (default: CPU count)
+            full (bool): Ignore the previous export and write every shard again
+            progress (ProgressTracker): Optional tracker for progress and cancellation
+
+        Returns:
+            dict: Result containing status and message
+        """
+        if not folder_name:
+            return {'error': 'No folder name provided'}
+        folder_path = os.path.join(self.annotated_dir, folder_name)
+        images_dir = os.path.join(folder_path, 'images')
+        labels_dir = os.path.join(folder_path, 'labels')
+        if not os.path.isdir(images_dir):
+            return {'error': f'Annotated folder "{folder_name}" not found'}
+        try:
+            shard_bytes = int(float(shard_size_mb) * 1024 * 1024)
+        except (TypeError, ValueError):
+            return {'error': 'Invalid shard size'}
+        if shard_bytes <= 0:
+            return {'error': 'Invalid shard size'}
+
+        export_path = os.path.join(self.export_dir, folder_name)
+        shards_dir = os.path.join(export_path, 'shards')
+        manifest_path = os.path.join(export_path, MANIFEST_NAME)
+        os.makedirs(shards_dir, exist_ok=True)
+        # Overlays older reviewers saved next to the frames are not part of the dataset
+        remove_review_overlays(folder_path)
+
+        current = {}
+        for entry in os.scandir(images_dir):
+            if entry.name.endswith('.jpg'):
+                stem = entry.name[:-len('.jpg')]
+                try:
+                    current[stem] = _signature(entry.path, os.path.join(labels_dir, stem + '.txt'))
+                except OSError:
+                    continue
+        sort_key = get_index(folder_path).sort_key
+
+        manifest = None if full else self._load_manifest(manifest_path, folder_name)
+        if manifest is None:
+            manifest = {'folder': folder_name, 'shards': {}, 'samples': {}}
+            for name in os.listdir(shards_dir):
+                os.remove(os.path.join(shards_dir, name))
+        kept, tasks, removed = self._plan(manifest, current, shards_dir, shard_bytes, sort_key, folder_name)
+
+        for name in removed:
+            for stem in manifest['shards'].pop(name):
+                manifest['samples'].pop(stem, None)
+            if os.path.exists(os.path.join(shards_dir, name)):
+                os.remove(os.path.join(shards_dir, name))
+        for name, _ in tasks:
+            # Until its shard is rewritten a frame counts as not exported
+            for stem in manifest['shards'].pop(name, []):
+                manifest['samples'].pop(stem, None)
+        _write_json(manifest_path, manifest)
+
+        to_write = sum(len(stems) for _, stems in tasks)
+        if progress is not None:
+            progress.total = to_write
+            progress.unit = 'images'
+        done = 0
+        written = 0
+        cancelled = False
+
+        def collect(name, samples, planned):
+            nonlocal done, written
+            manifest['shards'][name] = [stem for stem in planned if stem in samples]
+            manifest['samples'].update(samples)
+            _write_json(manifest_path, manifest)
+            done += len(planned)
+            written += len(samples)
+            if progress is not None:
+                progress.update(done)
+
+        workers = workers or os.cpu_count() or 1
+        if len(tasks) <= 1 or workers <= 1:
+            # Not worth starting processes for one shard
+            for name, stems in tasks:
+                collect(name, _write_shard(folder_path, os.path.join(shards_dir, name), stems), stems)
+                if progress is not None and progress.cancelled:
+                    cancelled = True
+                    break
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(tasks)),
+                mp_context=multiprocessing.get_context('spawn')
+            ) as executor:
+                pending = {
+                    executor.submit(_write_shard, folder_path, os.path.join(shards_dir, name), stems): (name, stems)
+                    for name, stems in tasks
+                }
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name, stems = pending.pop(future)
+                        collect(name, future.result(), stems)
+                    if progress is not None and progress.cancelled:
+                        cancelled = True
+                        for future in pending:
+                            future.cancel()
+                        break
+
+        if progress is not None:
+            progress.finish()
+        summary = (f'{written} frames written to {len(tasks)} shards, {len(current) - to_write} unchanged '
+                   f'in {len(kept)} shards, {len(removed)} shards removed')
+        if cancelled:
+            return {
+                'cancelled': True,
+                'message': f'Export cancelled. {summary} before stopping; run the export again to finish it',
+                'exported_count': written,
+                'output_folder': export_path,
+                'progress': progress.snapshot() if progress is not None else None
+            }
+
+        box_count, skipped = self._write_annotations(export_path, folder_path, manifest, sort_key)
+        message = f'Export complete! {summary}. {len(manifest["samples"])} frames and {box_count} boxes in {export_path}'
+        if skipped:
+            message += f'. Skipped {skipped} annotations with a non-numeric class'
+        return {
+            'success': True,
+            'message': message,
+            'exported_count': written,
+            'unchanged_count': len(current) - to_write,
+            'frame_count': len(manifest['samples']),
+            'box_count': box_count,
+            'shard_count': len(manifest['shards']),
+            'shards_written': len(tasks),
+            'shards_removed': len(removed),
+            'output_folder': export_path,
+            'progress': progress.snapshot() if progress is not None else None
+        }
@@ -1,14 +1,372 @@
 import os
 import cv2
-from ultralytics import YOLO
+import json
+import math
+import time
+import shutil
+import hashlib
+import queue
+import itertools
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from progress import ProgressTracker
+from metrics import StageTimer
+from model_registry import registry as model_registry
+from inference import predict
+from prefilter import FramePrefilter
+from annotator import ImageAnnotator
+from checkpoint import JobCheckpoint
+from detection_cache import DetectionCache, image_key
+from onnx_backend import BACKENDS
+from tracker import ChangeTracker, TRACKS_NAME
+
+_END = object()
+SEGMENTS_DIRNAME = '.segments'
+STOP_NAME = '.stop'
+MIN_SEGMENT_FRAMES = 1000  # Shorter segments spend too much of their time seeking
+SEGMENT_COUNTS = ('saved_count', 'sampled_count', 'skipped_count', 'gate_count', 'inferred_count',
+                  'duplicate_count', 'unchanged_count', 'filtered_count', 'track_count')
+GATE_CONF = 0.1  # Low, so the gate passes anything the confirm model might keep
+
+
+class FrameSampler:
+    """
+    Yields the sampled frames of a video as (frame_idx, frame) tuples
+
+    Frames between samples are skipped with cap.grab(), which avoids the color
+    conversion and copy of cap.read(), and gaps longer than seek_threshold
+    frames are skipped by seeking instead of decoding linearly.
+
+    Args:
+        video_path (str): Path to the video file
+        frame_skip (int): Sample every Nth frame
+        interval_seconds (float): Sample one frame every N seconds (overrides frame_skip)
+        keyframes_only (bool): Only decode keyframes (requires PyAV). Combined
+            with interval_seconds, at most one keyframe is kept per interval.
+        seek_threshold (int): Minimum gap in frames for which seeking is used
+        start_frame (int): Skip samples before this frame, as if the video had been
+            read up to it
+        end_frame (int): Stop before this frame (None: read to the end)
+        previous_sample (int): Index of the last frame sampled before start_frame when
+            resuming, so keyframe intervals continue from it
+    """
+
+    def __init__(self, video_path, frame_skip=1, interval_seconds=None, keyframes_only=False, seek_threshold=250,
+                 start_frame=0, end_frame=None, previous_sample=None):
+        self.video_path = video_path
+        self.frame_skip = max(1, int(frame_skip))
+        self.interval_seconds = float(interval_seconds) if interval_seconds else None
+        self.keyframes_only = keyframes_only
+        self.seek_threshold = seek_threshold
+        self.start_frame = max(0, int(start_frame))
+        self.end_frame = end_frame
+        self.previous_sample = previous_sample
+        self.position = self.start_frame  # Frames consumed from the video so far
+        self.sampled = 0
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f'Could not open video {video_path}')
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        if keyframes_only:
+            cap.release()
+            self.cap = None
+        else:
+            self.cap = cap
+
+    def _targets(self):
+        """Yield the frame indices to sample, in increasing order"""
+        if self.interval_seconds is None:
+            first = -(-self.start_frame // self.frame_skip) * self.frame_skip
+            yield from itertools.count(first, self.frame_skip)
+            return
+        last = -1
+        for k in itertools.count(int(self.start_frame / (self.interval_seconds * self.fps))):
+            target = int(round(k * self.interval_seconds * self.fps))
+            if target > last and target >= self.start_frame:
+                last = target
+                yield target
+
+    def __iter__(self):
+        frames = self._iter_keyframes() if self.keyframes_only else self._iter_frames()
+        for frame_idx, frame in frames:
+            self.sampled += 1
+            yield frame_idx, frame
+
+    def _iter_frames(self):
+        cap = self.cap
+        pos = 0  # Index of the next frame the capture will return
+        for target in self._targets():
+            if self.end_frame is not None and target >= self.end_frame:
+                return
+            if target - pos > self.seek_threshold and cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+                pos = target
+            while pos < target:
+                if not cap.grab():
+                    return
+                pos += 1
+                self.position = pos
+            ret, frame = cap.read()
+            if not ret:
+                return
+            pos += 1
+            self.position = pos
+            yield target, frame
+
+    def _iter_keyframes(self):
+        try:
+            import av
+        except ImportError:
+            raise ImportError('Keyframe sampling requires PyAV (pip install av)')
+
+        with av.open(self.video_path) as container:
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = 'NONKEY'
+            stream.thread_type = 'AUTO'
+            min_gap = self.interval_seconds * self.fps if self.interval_seconds else 0
+            next_allowed = 0
+            if self.start_frame > 0:
+                # Seek to the keyframe at or before start_frame; when resuming, the
+                # interval still applies from the previous sample
+                container.seek(int(self.start_frame / self.fps / stream.time_base), stream=stream)
+                next_allowed = self.start_frame
+                if self.previous_sample is not None:
+                    next_allowed = self.previous_sample + min_gap
+            for frame in container.decode(stream):
+                if frame.pts is None:
+                    continue
+                frame_idx = int(round(float(frame.pts * stream.time_base) * self.fps))
+                if frame_idx < self.start_frame:
+                    continue
+                if self.end_frame is not None and frame_idx >= self.end_frame:
+                    break
+                self.position = frame_idx + 1
+                if frame_idx < next_allowed:
+                    continue
+                next_allowed = frame_idx + min_gap
+                yield frame_idx, frame.to_ndarray(format='bgr24')
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class FrameReader(threading.Thread):
+    """
+    Reads sampled frames on a background thread into a bounded queue
+
+    Frames are queued as (frame_idx, frame) tuples, followed by a final end
+    marker. frames_read counts every frame consumed from the video so far.
+    Sampled frames rejected by the optional prefilter are counted in skipped
+    and never queued. Decode and prefilter times are recorded in timer.
+    """
+
+    def __init__(self, sampler, max_queued=32, prefilter=None, timer=None):
+        super().__init__(daemon=True)
+        self.sampler = sampler
+        self.prefilter = prefilter
+        self.timer = timer or StageTimer()
+        self.frames = queue.Queue(maxsize=max_queued)
+        self.skipped = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    @property
+    def frames_read(self):
+        return self.sampler.position
+
+    def _put(self, item):
+        # Block while the queue is full, but give up promptly once stopped
+        while not self._stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        check_motion = self.prefilter is not None and self.prefilter.motion_threshold is not None
+        try:
+            frames = iter(self.sampler)
+            while True:
+                start = time.perf_counter()
+                item = next(frames, None)
+                if item is None:
+                    break
+                self.timer.add('decode', time.perf_counter() - start)
+                if self._stop_event.is_set():
+                    break
+                if check_motion:
+                    with self.timer.stage('prefilter'):
+                        needed = self.prefilter.needs_inference(item[1])
+                    if not needed:
+                        self.skipped += 1
+                        continue
+                if not self._put(item):
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.sampler.release()
+            self._put(_END)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class FrameWriter:
+    """JPEG-encodes and writes frames on a thread pool, bounding pending writes"""
+
+    def __init__(self, num_threads=2, max_pending=16, timer=None, detection_cache=None):
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+        self.max_pending = max_pending
+        self.pending = []
+        self.timer = timer or StageTimer()
+        self.detection_cache = detection_cache
+
+    def _check(self, future):
+        out_path, ok = future.result()
+        if not ok:
+            raise IOError(f'Could not write {out_path}')
+
+    def _write(self, out_path, frame, detections=None):
+        # Encode and write separately (same bytes as cv2.imwrite) so both are timed
+        with self.timer.stage('encode'):
+            ok, buf = cv2.imencode(os.path.splitext(out_path)[1], frame)
+        if not ok:
+            return out_path, False
+        with self.timer.stage('write'):
+            buf.tofile(out_path)
+        if detections is not None and self.detection_cache is not None:
+            # Keyed by the written bytes, so annotating this image later is a cache hit
+            h_img, w_img = frame.shape[:2]
+            self.detection_cache.add(image_key(buf), detections, (w_img, h_img))
+        return out_path, True
+
+    def _write_labels(self, label_path, label_lines):
+        with self.timer.stage('write_labels'):
+            with open(label_path, 'w') as f:
+                f.write('\n'.join(label_lines))
+        return label_path, True
+
+    def _submit(self, fn, *args):
+        if len(self.pending) >= self.max_pending:
+            with self.timer.stage('wait_write'):
+                self._check(self.pending.pop(0))
+        self.pending.append(self.pool.submit(fn, *args))
+
+    def write(self, out_path, frame, detections=None):
+        self._submit(self._write, out_path, frame, detections)
+
+    def write_labels(self, label_path, label_lines):
+        self._submit(self._write_labels, label_path, label_lines)
+
+    def flush(self):
+        """Wait for all pending writes, raising if any of them failed"""
+        pending, self.pending = self.pending, []
+        for future in pending:
+            self._check(future)
+
+    def close(self):
+        """Wait for all pending writes and stop the pool, raising if any write failed"""
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown(wait=True)
+
+
+def video_fingerprint(video_path, sample_bytes=1024 * 1024):
+    """
+    Identify a video file by its size and a hash of its first and last megabyte
+
+    Cheap even for very large files, and unlike the mtime it survives the same
+    video being uploaded again.
+    """
+    size = os.path.getsize(video_path)
+    sha = hashlib.sha256()
+    with open(video_path, 'rb') as f:
+        sha.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(sample_bytes, size - sample_bytes))
+            sha.update(f.read(sample_bytes))
+    return f'{size}-{sha.hexdigest()[:32]}'
+
+
+def remove_numbered_outputs(folder_name, dirs, first_num):
+    """Delete <folder_name>_<n> outputs with n >= first_num, written after the last checkpoint"""
+    prefix = f'{folder_name}_'
+    for directory in dirs:
+        for name in os.listdir(directory):
+            stem = os.path.splitext(name)[0]
+            if not stem.startswith(prefix):
+                continue
+            num = stem[len(prefix):]
+            if num.isdigit() and int(num) >= first_num:
+                os.remove(os.path.join(directory, name))
+
+
+def truncate_tracks(tracks_path, folder_name, first_num):
+    """Drop the .tracks.jsonl entries of <folder_name>_<n> frames with n >= first_num"""
+    if not os.path.exists(tracks_path):
+        return
+    prefix = f'{folder_name}_'
+    kept = []
+    with open(tracks_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Blank, or cut off by the crash
+            if int(os.path.splitext(entry['image'])[0][len(prefix):]) < first_num:
+                kept.append(line if line.endswith('\n') else line + '\n')
+    tmp_path = tracks_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.writelines(kept)
+    os.replace(tmp_path, tracks_path)
+
+
+def _init_segment_worker(threads):
+    # Keep every worker from starting one decode and inference thread per core
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    cv2.setNumThreads(threads)
+
+
+def _extract_segment(segments_dir, name, kwargs):
+    """Extract one frame range of a video into segments_dir/name (runs in a worker process)"""
+    stop_path = os.path.join(segments_dir, STOP_NAME)
+    extractor = ImageExtractor()
+    extractor.extracted_dir = extractor.annotated_dir = segments_dir
+    progress = ProgressTracker(0, unit='frames', callback=lambda snapshot: None,
+                               should_stop=lambda: os.path.exists(stop_path))
+    segment_folder = os.path.join(segments_dir, name)
+    resume = False
+    if os.path.exists(segment_folder):
+        if JobCheckpoint(segment_folder).exists():
+            resume = True
+        else:
+            # Finished but not yet recorded, or created without a checkpoint: redo it
+            shutil.rmtree(segment_folder)
+    return extractor.process(folder_name=name, progress=progress, resume=resume, **kwargs)
+
 
 class ImageExtractor:
     def __init__(self):
         self.videos_dir = 'videos'
         self.models_dir = 'models'
         self.extracted_dir = 'extracted-images'
+        self.annotated_dir = 'annotated-images'
 
-    def process(self, video_path, model_path, selected_classes, frame_skip=1, folder_name=None):
+    def process(self, video_path, model_path, selected_classes, frame_skip=1, folder_name=None, progress=None,
+                batch_size=8, writer_threads=2, sample_interval=None, keyframes_only=False,
+                motion_threshold=None, hash_threshold=None, class_mappings=None, iou_threshold=0.5,
+                resume=False, checkpoint_interval=30.0, start_frame=0, end_frame=None, workers=1,
+                segment_frames=None, use_detection_cache=True, backend='torch', imgsz=None, int8=False,
+                threads=None, gate_model_path=None, gate_imgsz=None, gate_conf=GATE_CONF, track_changes=False,
+                track_move_threshold=0.25, track_size_threshold=0.25, track_max_interval=None):
         """
         Process a video file and extract frames based on YOLO detections
         
@@ -18,16 +376,89 @@ class ImageExtractor:
             selected_classes (list): List of class indices to extract
             frame_skip (int): Number of frames to skip between processing
             folder_name (str): Name of the output folder
+            progress (ProgressTracker): Optional tracker for progress and cancellation
+            batch_size (int): Number of frames sent to the model per call
+            writer_threads (int): Number of threads encoding and writing saved frames
+            sample_interval (float): Sample one frame every N seconds instead of using frame_skip
+            keyframes_only (bool): Only sample keyframes (requires PyAV)
+            motion_threshold (float): Skip inference on frames whose mean grayscale difference
+                from the last inferred frame is below this value (0-255, None to disable)
+            hash_threshold (int): Don't save frames within this perceptual-hash Hamming
+                distance of the last saved frame (0-64, None to disable)
+            class_mappings (str): JSON string of class mappings. When given, frames and
+                YOLO labels are written straight to annotated-images/<folder_name> from
+                the detections of this single pass, as ImageAnnotator would produce them.
+            iou_threshold (float): IoU threshold for overlap filtering when annotating
+            resume (bool): Continue an interrupted extraction into an existing folder
+                from its checkpoint. Output names are the same as for an
+                uninterrupted run.
+            checkpoint_interval (float): Seconds between checkpoints
+            start_frame (int): First frame of the range to extract
+            end_frame (int): End (exclusive) of the range to extract (None: end of video)
+            workers (int): Split the video into segments extracted by this many worker
+                processes (see process_batch)
+            segment_frames (int): Frames per segment when workers > 1
+            use_detection_cache (bool): Store the raw detections of saved frames so that
+                annotating them later doesn't run the model again
+            backend (str): Inference backend, 'torch' or 'onnx' (ONNX Runtime on the CPU)
+            imgsz (int): Inference size (default: 640)
+            int8 (bool): Use an int8-quantized model with the onnx backend
+            threads (int): ONNX Runtime intra-op threads
+            gate_model_path (str): Optional cheap model that screens every sampled frame
+                first. Only frames in which it detects a selected class (matched by
+                class name) with at least gate_conf go on to the model at model_path.
+            gate_imgsz (int): Inference size of the gate. Without gate_model_path, the
+                model at model_path itself is the gate at this size.
+            gate_conf (float): Confidence threshold of the gate; keep it low so the
+                cascade doesn't lose frames the full model would keep
+            track_changes (bool): Track the selected classes across frames and only save
+                frames in which a track appears, moves or changes size, or is due again.
+                The track ids of every saved frame are appended to .tracks.jsonl in the
+                output folder.
+            track_move_threshold (float): Center displacement since the last saved frame,
+                as a fraction of the box size, that counts as moved
+            track_size_threshold (float): Relative change in box area that counts as changed
+            track_max_interval (float): Save an unchanged track again after this many
+                seconds (None: never)
             
         Returns:
             dict: Result containing status and message
         """
+        if workers and int(workers) > 1:
+            result = self.process_batch(
+                [{'video_path': video_path, 'folder_name': folder_name}], model_path, selected_classes,
+                workers=workers, segment_frames=segment_frames, progress=progress, resume=resume,
+                frame_skip=frame_skip, batch_size=batch_size, writer_threads=writer_threads,
+                sample_interval=sample_interval, keyframes_only=keyframes_only,
+                motion_threshold=motion_threshold, hash_threshold=hash_threshold,
+                class_mappings=class_mappings, iou_threshold=iou_threshold,
+                use_detection_cache=use_detection_cache, backend=backend, imgsz=imgsz, int8=int8, threads=threads,
+                gate_model_path=gate_model_path, gate_imgsz=gate_imgsz, gate_conf=gate_conf,
+                track_changes=track_changes, track_move_threshold=track_move_threshold,
+                track_size_threshold=track_size_threshold, track_max_interval=track_max_interval
+            )
+            if 'videos' not in result:
+                return result
+            return {**result['videos'][0], 'progress': result['progress'], 'stage_timings': result['stage_timings']}
+
         try:
             # Validate inputs
+            annotator = None
+            if class_mappings:
+                annotator = ImageAnnotator()
+                try:
+                    class_map = annotator.parse_class_mappings(class_mappings)
+                except ValueError as e:
+                    return {'error': str(e)}
+                selected_classes = selected_classes or list(class_map)
             if not os.path.exists(video_path):
                 return {'error': 'Video file not found'}
             if not os.path.exists(model_path):
                 return {'error': 'Model file not found'}
+            if gate_model_path and not os.path.exists(gate_model_path):
+                return {'error': 'Gate model file not found'}
+            if backend not in BACKENDS:
+                return {'error': f'Unknown inference backend: {backend}'}
             if not selected_classes:
                 return {'error': 'No classes selected'}
             if not folder_name:
@@ -36,52 +467,633 @@ class ImageExtractor:
                 return {'error': 'Folder name contains invalid characters'}
 
             # Create output directory
-            out_folder = os.path.join(self.extracted_dir, folder_name)
-            if os.path.exists(out_folder):
-                return {'error': f'Folder "{folder_name}" already exists'}
+            if annotator is not None:
+                out_folder = os.path.join(self.annotated_dir, folder_name)
+                images_out = os.path.join(out_folder, 'images')
+                labels_out = os.path.join(out_folder, 'labels')
+            else:
+                out_folder = images_out = os.path.join(self.extracted_dir, folder_name)
+            out_dirs = [images_out] if annotator is None else [images_out, labels_out]
+            selected = set(map(int, selected_classes))
+            cascade = bool(gate_model_path or gate_imgsz)
+            if cascade:
+                gate_model_path = gate_model_path or model_path
+                gate_classes = self.gate_classes(model_path, gate_model_path, selected)
+                if not gate_classes:
+                    return {'error': 'The gate model detects none of the selected classes'}
 
-            os.makedirs(out_folder, exist_ok=False)
+            # Everything that affects which frames are saved and how they are named
+            settings = json.loads(json.dumps({
+                'video': video_fingerprint(video_path),
+                'model_sha256': model_registry.content_hash(model_path),
+                'inference': {'backend': backend, 'imgsz': imgsz, 'int8': bool(int8)},
+                'cascade': {
+                    'model_sha256': model_registry.content_hash(gate_model_path),
+                    'imgsz': gate_imgsz,
+                    'conf': gate_conf
+                } if cascade else None,
+                'tracking': {
+                    'move_threshold': track_move_threshold,
+                    'size_threshold': track_size_threshold,
+                    'max_interval': track_max_interval
+                } if track_changes else None,
+                'selected_classes': sorted(selected),
+                'frame_skip': frame_skip,
+                'sample_interval': sample_interval,
+                'keyframes_only': keyframes_only,
+                'motion_threshold': motion_threshold,
+                'hash_threshold': hash_threshold,
+                'class_map': class_map if annotator is not None else None,
+                'iou_threshold': iou_threshold if annotator is not None else None,
+                'start_frame': start_frame,
+                'end_frame': end_frame
+            }))
+            checkpoint = JobCheckpoint(out_folder, interval=checkpoint_interval)
+            state = None
+            if os.path.exists(out_folder):
+                if not resume:
+                    return {'error': f'Folder "{folder_name}" already exists'}
+                state = checkpoint.load()
+                if state is None:
+                    return {'error': f'Folder "{folder_name}" has no checkpoint to resume from'}
+                if state['settings'] != settings:
+                    return {'error': 'The checkpoint was written for a different video, model or settings'}
+                # Frames saved after the checkpoint are extracted again under the same names
+                remove_numbered_outputs(folder_name, out_dirs, state['img_num'])
+                truncate_tracks(os.path.join(out_folder, TRACKS_NAME), folder_name, state['img_num'])
+            else:
+                for out_dir in out_dirs:
+                    os.makedirs(out_dir, exist_ok=False)
 
             # Load model
-            model = YOLO(model_path)
+            model = model_registry.get_model(model_path, backend, imgsz, int8, threads)
+            predict_options = {'imgsz': imgsz} if imgsz else {}
+            gate = None
+            if cascade:
+                gate = model_registry.get_model(gate_model_path, backend, gate_imgsz, int8, threads)
+                gate_options = {'conf': gate_conf, **({'imgsz': gate_imgsz} if gate_imgsz else {})}
 
-            # Process video
-            cap = cv2.VideoCapture(video_path)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            frame_idx = 0
-            saved = 0
-            img_num = 0
+            # Process video: a reader thread decodes sampled frames while this thread
+            # runs batched inference and a writer pool encodes the frames to keep
+            last_frame = state['last_frame'] if state else start_frame - 1  # Last sampled frame fully handled
+            sampler = FrameSampler(video_path, frame_skip=frame_skip, interval_seconds=sample_interval,
+                                   keyframes_only=keyframes_only, start_frame=last_frame + 1, end_frame=end_frame,
+                                   previous_sample=last_frame if last_frame >= start_frame else None)
+            if progress is None:
+                progress = ProgressTracker(sampler.frame_count, unit='frames')
+            else:
+                progress.total = sampler.frame_count
+            batch_size = max(1, int(batch_size))
+            prefilter = FramePrefilter(motion_threshold=motion_threshold, hash_threshold=hash_threshold)
+            timer = StageTimer()
+            counts = state['counts'] if state else {
+                'saved': 0, 'sampled': 0, 'skipped': 0, 'gated': 0, 'inferred': 0, 'duplicates': 0, 'unchanged': 0,
+                'filtered': 0
+            }
+            saved = counts['saved']
+            img_num = state['img_num'] if state else 0
+            gated = counts['gated']
+            inferred = counts['inferred']
+            duplicates = counts['duplicates']
+            unchanged = counts['unchanged']
+            total_filtered = counts['filtered']
+            last_inferred = None
+            if state:
+                prefilter.restore_state(state['prefilter'])
+            tracker = tracks_file = None
+            if track_changes:
+                max_interval = round(float(track_max_interval) * sampler.fps) if track_max_interval else None
+                tracker = ChangeTracker(move_threshold=track_move_threshold, size_threshold=track_size_threshold,
+                                        max_interval=max_interval)
+                if state:
+                    tracker.restore_state(state['tracker'])
+                tracks_file = open(os.path.join(out_folder, TRACKS_NAME), 'a')
 
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
+            def save_checkpoint():
+                # Only frames whose files are on disk may be recorded as done. The
+                # sampled and skipped counts may include frames the reader has read
+                # ahead, so they can come out slightly high after a resume.
+                writer.flush()
+                if cache is not None:
+                    cache.flush()
+                if tracks_file is not None and not tracks_file.closed:
+                    tracks_file.flush()
+                checkpoint.save({
+                    'settings': settings,
+                    'last_frame': last_frame,
+                    'img_num': img_num,
+                    'counts': {
+                        'saved': saved,
+                        'sampled': counts['sampled'] + sampler.sampled,
+                        'skipped': counts['skipped'] + reader.skipped,
+                        'gated': gated,
+                        'inferred': inferred,
+                        'duplicates': duplicates,
+                        'unchanged': unchanged,
+                        'filtered': total_filtered
+                    },
+                    'prefilter': prefilter.checkpoint_state(last_inferred),
+                    'tracker': tracker.checkpoint_state() if tracker is not None else None
+                })
 
-                if frame_idx % frame_skip == 0:
-                    results = model(frame)
-                    for r in results:
-                        # Convert class indices to integers for comparison
-                        detected_classes = [int(cls) for cls in r.boxes.cls]
-                        # Check if any of the selected classes are in the detected classes
-                        if any(cls in detected_classes for cls in map(int, selected_classes)):
-                            out_path = os.path.join(out_folder, f'{folder_name}_{img_num}.jpg')
-                            cv2.imwrite(out_path, frame)
+            reader = FrameReader(sampler, max_queued=batch_size * 4, prefilter=prefilter, timer=timer)
+            cache = None
+            if use_detection_cache:
+                cache = DetectionCache(model_registry.detector_key(model_path, backend, imgsz, int8))
+            writer = FrameWriter(num_threads=writer_threads, max_pending=batch_size * 2, timer=timer,
+                                 detection_cache=cache)
+            reader.start()
+            if state is None:
+                save_checkpoint()
+            try:
+                batch = []
+                done = False
+                while not done:
+                    with timer.stage('wait_decode'):
+                        item = reader.frames.get()
+                    if item is _END:
+                        done = True
+                    else:
+                        batch.append(item)
+                    if batch and (done or len(batch) >= batch_size):
+                        passed = [True] * len(batch)
+                        if gate is not None:
+                            # Only frames in which the cheap gate sees a selected class reach the full model
+                            with timer.stage('gate'):
+                                gate_detections = predict(gate, [frame for _, frame in batch], **gate_options)
+                            gated += len(batch)
+                            passed = [bool(gate_classes.intersection(det.cls.tolist())) for det in gate_detections]
+                        candidates = [item for item, ok in zip(batch, passed) if ok]
+                        detections = iter(predict(model, [frame for _, frame in candidates], timer=timer,
+                                                  **predict_options))
+                        inferred += len(candidates)
+                        for (frame_idx, frame), ok in zip(batch, passed):
+                            det = next(detections) if ok else None
+                            if tracker is not None:
+                                # Frames the gate rejected still age the tracks
+                                with timer.stage('track'):
+                                    if det is None:
+                                        triggered = tracker.update(frame_idx, [], [])
+                                    else:
+                                        tracked = np.isin(det.cls, list(selected))
+                                        triggered = tracker.update(frame_idx, det.xywh[tracked], det.cls[tracked])
+                            if det is None:
+                                continue
+                            if annotator is not None:
+                                # Keep the frame if it ends up with any labels
+                                h_img, w_img = frame.shape[:2]
+                                with timer.stage('filter'):
+                                    label_lines, filtered_count = annotator.make_labels(
+                                        det, class_map, iou_threshold, (w_img, h_img)
+                                    )
+                                keep = bool(label_lines)
+                            else:
+                                # Keep the frame if any of the selected classes was detected
+                                keep = bool(selected.intersection(det.cls.tolist()))
+                            if not keep:
+                                continue
+                            if tracker is not None and not triggered:
+                                # Every object in the frame looks as it did when last saved
+                                unchanged += 1
+                                continue
+                            if prefilter.hash_threshold is not None:
+                                with timer.stage('dedupe'):
+                                    duplicate = prefilter.is_duplicate(frame)
+                                if duplicate:
+                                    duplicates += 1
+                                    continue
+
+                            out_name = f'{folder_name}_{img_num}'
+                            writer.write(os.path.join(images_out, out_name + '.jpg'), frame, det)
+                            if annotator is not None:
+                                writer.write_labels(os.path.join(labels_out, out_name + '.txt'), label_lines)
+                                total_filtered += filtered_count
+                            if tracker is not None:
+                                tracker.mark_saved(frame_idx)
+                                tracks_file.write(json.dumps({'image': out_name + '.jpg', 'frame': frame_idx,
+                                                              'tracks': tracker.visible, 'triggered': triggered}) + '\n')
                             saved += 1
                             img_num += 1
-                            break
+                        last_frame, last_inferred = batch[-1]
+                        batch = []
+                        if not done and checkpoint.due():
+                            with timer.stage('checkpoint'):
+                                save_checkpoint()
 
-                frame_idx += 1
-                # Print progress every 100 frames
-                if frame_idx % 100 == 0:
-                    print(f"Processing frame {frame_idx}/{frame_count}")
+                    progress.update(reader.frames_read)
+                    if progress.cancelled:
+                        break
+            finally:
+                reader.stop()
+                reader.join()
+                writer.close()
+                if cache is not None:
+                    cache.flush()
+                if tracks_file is not None:
+                    tracks_file.close()
 
-            cap.release()
+            if reader.error is not None:
+                raise reader.error
+            if progress.cancelled:
+                # Frames read into an unfinished batch are decoded again on resume
+                save_checkpoint()
+            else:
+                checkpoint.remove()
+            frame_idx = reader.frames_read
+            if not progress.cancelled:
+                progress.update(progress.total or frame_idx)
+
+            progress.finish()
+            saved_text = f'{saved} images and labels' if annotator is not None else f'{saved} images'
+            if progress.cancelled:
+                return {
+                    'cancelled': True,
+                    'message': f'Extraction cancelled at frame {frame_idx}. {saved_text} saved to {out_folder}. '
+                               'Run again with resume to continue.',
+                    'saved_count': saved,
+                    'skipped_count': counts['skipped'] + reader.skipped,
+                    'gate_count': gated,
+                    'inferred_count': inferred,
+                    'duplicate_count': duplicates,
+                    'unchanged_count': unchanged,
+                    'filtered_count': total_filtered,
+                    'output_folder': out_folder,
+                    'progress': progress.snapshot(),
+                    'stage_timings': timer.snapshot()
+                }
+            message = f'Extraction complete! {saved_text} saved to {out_folder}'
+            if state:
+                message += f' (resumed from frame {sampler.start_frame})'
+            if annotator is not None:
+                message += f'. Filtered {total_filtered} overlapping detections.'
+            if cascade:
+                message = message.rstrip('.') + f'. The gate passed {inferred} of {gated} frames to the full model.'
+            if tracker is not None:
+                message = message.rstrip('.') + (f'. Tracked {tracker.track_count} objects; skipped {unchanged} '
+                                                 'frames in which nothing changed.')
             return {
                 'success': True,
-                'message': f'Extraction complete! {saved} images saved to {out_folder}',
+                'message': message,
                 'saved_count': saved,
-                'output_folder': out_folder
+                'sampled_count': counts['sampled'] + sampler.sampled,
+                'skipped_count': counts['skipped'] + reader.skipped,
+                'gate_count': gated,
+                'inferred_count': inferred,
+                'duplicate_count': duplicates,
+                'unchanged_count': unchanged,
+                'filtered_count': total_filtered,
+                'track_count': tracker.track_count if tracker is not None else 0,
+                'backend': backend,
+                'output_folder': out_folder,
+                'progress': progress.snapshot(),
+                'stage_timings': timer.snapshot()
             }
 
         except Exception as e:
-            return {'error': f'Error during extraction: {str(e)}'} 
\ No newline at end of file
+            return {'error': f'Error during extraction: {str(e)}'} 
+
+    def gate_classes(self, model_path, gate_model_path, selected):
+        """
+        Return the class indices of the gate model that let a frame through the cascade
+
+        The gate may be a different model with its own class list, so the selected
+        classes of the full model are matched to the gate's classes by name.
+
+        Args:
+            model_path (str): Path to the full (confirm) model
+            gate_model_path (str): Path to the gate model
+            selected (set): Selected class indices of the full model
+
+        Returns:
+            set: Gate class indices (empty if the gate has none of the selected classes)
+        """
+        if os.path.abspath(gate_model_path) == os.path.abspath(model_path):
+            return set(selected)
+        names = model_registry.get_class_names(model_path)
+        wanted = {names[c] for c in selected if 0 <= c < len(names)}
+        return {i for i, name in enumerate(model_registry.get_class_names(gate_model_path)) if name in wanted}
+
+    def _plan_segments(self, video_path, folder_name, options, annotate, workers, segment_frames, resume):
+        """
+        Split a video into frame ranges and load its checkpoint when resuming (nothing is written)
+
+        A video extracted with track_changes is kept as one segment.
+        """
+        if not video_path or not os.path.exists(video_path):
+            return {'error': 'Video file not found'}
+        if not folder_name:
+            return {'error': 'No folder name provided'}
+        if any(c in folder_name for c in r'<>:"/\\|?*'):
+            return {'error': 'Folder name contains invalid characters'}
+
+        out_folder = os.path.join(self.annotated_dir if annotate else self.extracted_dir, folder_name)
+        out_dirs = [os.path.join(out_folder, 'images'), os.path.join(out_folder, 'labels')] if annotate else [out_folder]
+        segments_dir = os.path.join(out_folder, SEGMENTS_DIRNAME)
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return {'error': f'Could not open video {video_path}'}
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        if options.get('track_changes'):
+            # Segments run in parallel, so one can't continue the tracks of the one before
+            # it; a fresh tracker would save every visible object again at each boundary
+            bounds = [[0, None]]
+        else:
+            length = int(segment_frames or max(MIN_SEGMENT_FRAMES, math.ceil(frame_count / (workers * 4))))
+            starts = list(range(0, frame_count, length)) or [0]
+            # The last segment runs to the end, as frame counts from the container can be off
+            bounds = [[start, start + length] for start in starts]
+            bounds[-1][1] = None
+
+        settings = json.loads(json.dumps({
+            'video': video_fingerprint(video_path),
+            'options': options,
+            'segments': bounds
+        }))
+        checkpoint = JobCheckpoint(out_folder)
+        if os.path.exists(out_folder):
+            if not resume:
+                return {'error': f'Folder "{folder_name}" already exists'}
+            state = checkpoint.load()
+            if state is None:
+                return {'error': f'Folder "{folder_name}" has no checkpoint to resume from'}
+            if state['settings'] != settings:
+                return {'error': 'The checkpoint was written for a different video, model or settings'}
+        else:
+            state = None
+
+        return {
+            'video_path': video_path,
+            'folder_name': folder_name,
+            'out_folder': out_folder,
+            'out_dirs': out_dirs,
+            'segments_dir': segments_dir,
+            'segments': [(f'segment_{i:05d}', start, end) for i, (start, end) in enumerate(bounds)],
+            'frame_count': frame_count,
+            'checkpoint': checkpoint,
+            'state': state or {'settings': settings, 'done': {}},
+            'new': state is None,
+            'error': None
+        }
+
+    def _merge_segments(self, plan):
+        """
+        Move the files of finished segments into the output folder, in frame order
+
+        Segment k's file n becomes {folder_name}_{m + n}, where m is the number of
+        frames saved by the segments before it. Safe to repeat after a crash: files
+        already moved are gone from the segment and the rest get the same names.
+        """
+        annotate = len(plan['out_dirs']) == 2
+        for out_dir in plan['out_dirs']:
+            os.makedirs(out_dir, exist_ok=True)
+        self._merge_tracks(plan)
+        base = 0
+        for name, _, _ in plan['segments']:
+            segment_folder = os.path.join(plan['segments_dir'], name)
+            src_dirs = [os.path.join(segment_folder, 'images'), os.path.join(segment_folder, 'labels')] \
+                if annotate else [segment_folder]
+            prefix = f'{name}_'
+            for src_dir, out_dir in zip(src_dirs, plan['out_dirs']):
+                if not os.path.isdir(src_dir):
+                    continue
+                for file_name in os.listdir(src_dir):
+                    stem, ext = os.path.splitext(file_name)
+                    num = stem[len(prefix):]
+                    if stem.startswith(prefix) and num.isdigit():
+                        os.replace(os.path.join(src_dir, file_name),
+                                   os.path.join(out_dir, f"{plan['folder_name']}_{base + int(num)}{ext}"))
+            base += plan['state']['done'][name]['saved_count']
+        plan['checkpoint'].remove()
+        shutil.rmtree(plan['segments_dir'])
+
+    def _merge_tracks(self, plan):
+        """
+        Combine the .tracks.jsonl of each segment into the output folder
+
+        Written in one go before any file is moved, with image names renumbered as
+        in _merge_segments and track ids offset so they stay unique across segments.
+        """
+        entries = []
+        base = id_base = 0
+        for name, _, _ in plan['segments']:
+            tracks_path = os.path.join(plan['segments_dir'], name, TRACKS_NAME)
+            if os.path.exists(tracks_path):
+                with open(tracks_path) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        num = int(os.path.splitext(entry['image'])[0][len(name) + 1:])
+                        entry['image'] = f"{plan['folder_name']}_{base + num}.jpg"
+                        entry['tracks'] = [track_id + id_base for track_id in entry['tracks']]
+                        entry['triggered'] = [track_id + id_base for track_id in entry['triggered']]
+                        entries.append(json.dumps(entry) + '\n')
+            done = plan['state']['done'][name]
+            base += done['saved_count']
+            id_base += done['track_count']
+        if entries:
+            tracks_path = os.path.join(plan['out_folder'], TRACKS_NAME)
+            with open(tracks_path + '.tmp', 'w') as f:
+                f.writelines(entries)
+            os.replace(tracks_path + '.tmp', tracks_path)
+
+    def process_batch(self, videos, model_path, selected_classes, workers=None, segment_frames=None,
+                      progress=None, resume=False, **options):
+        """
+        Extract several videos, each split into frame-range segments, on one pool of worker processes
+
+        Each segment seeks to its first frame and is extracted by process() into a
+        hidden .segments directory of its video's output folder, with its own
+        checkpoint. Once every segment of a video is done, the files are renamed
+        into the output folder in frame order, giving the same gap-free
+        {folder_name}_{n} numbering a sequential run would. The motion and
+        duplicate prefilters and keyframe intervals restart at segment
+        boundaries, so with those options a few more frames may be kept.
+        Videos extracted with track_changes are not split: the change tracker's
+        state can't be handed between segments that run in parallel, so each
+        such video is one segment and only separate videos run in parallel.
+
+        Args:
+            videos (list): Dicts with the video_path and folder_name of each video
+            model_path (str): Path to the YOLO model file
+            selected_classes (list): List of class indices to extract
+            workers (int): Number of worker processes (default: CPU count)
+            segment_frames (int): Frames per segment (default: about four segments per
+                worker, at least MIN_SEGMENT_FRAMES); ignored with track_changes
+            progress (ProgressTracker): Optional tracker for progress and cancellation
+            resume (bool): Continue interrupted videos. Finished segments are kept and
+                unfinished ones continue from their own checkpoints.
+            **options: Other process() options (frame_skip, sample_interval, batch_size,
+                class_mappings, ...)
+
+        Returns:
+            dict: Totals, plus one result per video under 'videos'
+        """
+        annotate = bool(options.get('class_mappings'))
+        if annotate:
+            try:
+                class_map = ImageAnnotator().parse_class_mappings(options['class_mappings'])
+            except ValueError as e:
+                return {'error': str(e)}
+            selected_classes = selected_classes or list(class_map)
+        if not os.path.exists(model_path):
+            return {'error': 'Model file not found'}
+        if options.get('gate_model_path') and not os.path.exists(options['gate_model_path']):
+            return {'error': 'Gate model file not found'}
+        if options.get('backend', 'torch') not in BACKENDS:
+            return {'error': f"Unknown inference backend: {options['backend']}"}
+        if not selected_classes:
+            return {'error': 'No classes selected'}
+        if not videos:
+            return {'error': 'No videos given'}
+        folder_names = [video.get('folder_name') for video in videos]
+        if len(set(folder_names)) != len(folder_names):
+            return {'error': 'Each video needs its own folder name'}
+
+        workers = max(1, int(workers or os.cpu_count() or 1))
+        options = {**options, 'model_path': model_path, 'selected_classes': list(selected_classes)}
+        # Batch size and thread counts don't change the output, so resuming may change them
+        fingerprint = {key: value for key, value in options.items()
+                       if key not in ('batch_size', 'writer_threads', 'checkpoint_interval', 'use_detection_cache',
+                                      'threads')}
+        fingerprint['model_sha256'] = model_registry.content_hash(model_path)
+        if options.get('gate_model_path'):
+            fingerprint['gate_model_sha256'] = model_registry.content_hash(options['gate_model_path'])
+        plans = []
+        for video in videos:
+            plan = self._plan_segments(video.get('video_path'), video.get('folder_name'), fingerprint, annotate,
+                                       workers, segment_frames, resume)
+            if plan['error']:
+                return {'error': f"{video.get('folder_name')}: {plan['error']}"}
+            plans.append(plan)
+        # Only create folders once every video has been checked
+        for plan in plans:
+            if plan['new']:
+                os.makedirs(plan['segments_dir'])
+                plan['checkpoint'].save(plan['state'])
+            elif os.path.exists(os.path.join(plan['segments_dir'], STOP_NAME)):
+                os.remove(os.path.join(plan['segments_dir'], STOP_NAME))
+
+        if progress is None:
+            progress = ProgressTracker(0, unit='frames')
+        progress.total = sum(plan['frame_count'] for plan in plans)
+
+        def segment_length(plan, start, end):
+            return (plan['frame_count'] if end is None else min(end, plan['frame_count'])) - start
+
+        timer = StageTimer()
+        tasks = [(plan, name, start, end) for plan in plans for name, start, end in plan['segments']
+                 if name not in plan['state']['done']]
+        done_frames = sum(segment_length(plan, start, end) for plan in plans for name, start, end in plan['segments']
+                          if name in plan['state']['done'])
+        cancelled = False
+
+        def stop(plan):
+            with open(os.path.join(plan['segments_dir'], STOP_NAME), 'w'):
+                pass
+
+        if tasks:
+            pool_size = min(workers, len(tasks))
+            worker_threads = max(1, (os.cpu_count() or 1) // pool_size)
+            with ProcessPoolExecutor(
+                max_workers=pool_size,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_segment_worker,
+                initargs=(worker_threads,)
+            ) as executor:
+                pending = {
+                    executor.submit(_extract_segment, plan['segments_dir'], name,
+                                    {**options, 'video_path': plan['video_path'], 'start_frame': start,
+                                     'end_frame': end, 'threads': worker_threads}): (plan, name, start, end)
+                    for plan, name, start, end in tasks
+                }
+                while pending:
+                    finished, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        plan, name, start, end = pending.pop(future)
+                        if future.cancelled():
+                            continue
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = {'error': f'Worker error: {str(e)}'}
+                        timer.merge(result.get('stage_timings') or {})
+                        if result.get('success'):
+                            plan['state']['done'][name] = {key: result[key] for key in SEGMENT_COUNTS}
+                            plan['checkpoint'].save(plan['state'])
+                            done_frames += segment_length(plan, start, end)
+                        elif result.get('error') and plan['error'] is None:
+                            # Give up on this video but let the others finish
+                            plan['error'] = f'Frames {start}-{end}: {result["error"]}'
+                            stop(plan)
+                            for other, (other_plan, _, _, _) in pending.items():
+                                if other_plan is plan:
+                                    other.cancel()
+                    progress.update(done_frames)
+                    if progress.cancelled and not cancelled:
+                        # Running segments checkpoint and stop; queued ones never start
+                        cancelled = True
+                        for plan in plans:
+                            stop(plan)
+                        for future in pending:
+                            future.cancel()
+
+        results = []
+        for plan in plans:
+            done = plan['state']['done']
+            counts = {key: sum(segment[key] for segment in done.values()) for key in SEGMENT_COUNTS}
+            saved_text = f"{counts['saved_count']} images and labels" if annotate else f"{counts['saved_count']} images"
+            if plan['error']:
+                results.append({'error': f"Error during extraction of {plan['folder_name']}: {plan['error']}",
+                                'output_folder': plan['out_folder']})
+            elif len(done) < len(plan['segments']):
+                results.append({
+                    'cancelled': True,
+                    'message': f"Extraction of {plan['folder_name']} cancelled with {len(done)} of "
+                               f"{len(plan['segments'])} segments done. Run again with resume to continue.",
+                    'output_folder': plan['out_folder'],
+                    **counts
+                })
+            else:
+                self._merge_segments(plan)
+                message = f"Extraction complete! {saved_text} saved to {plan['out_folder']}"
+                if annotate:
+                    message += f". Filtered {counts['filtered_count']} overlapping detections."
+                if counts['gate_count']:
+                    message = message.rstrip('.') + f". The gate passed {counts['inferred_count']} of {counts['gate_count']} frames to the full model."
+                if options.get('track_changes'):
+                    message = message.rstrip('.') + (f". Tracked {counts['track_count']} objects; skipped "
+                                                     f"{counts['unchanged_count']} frames in which nothing changed.")
+                results.append({
+                    'success': True,
+                    'message': message,
+                    'output_folder': plan['out_folder'],
+                    'segment_count': len(plan['segments']),
+                    **counts
+                })
+
+        if not cancelled:
+            progress.update(progress.total)
+        progress.finish()
+        succeeded = [r for r in results if r.get('success')]
+        failed = [r for r in results if r.get('error')]
+        summary = {
+            'videos': results,
+            'saved_count': sum(r.get('saved_count', 0) for r in results),
+            'progress': progress.snapshot(),
+            'stage_timings': timer.snapshot()
+        }
+        if cancelled:
+            return {'cancelled': True, 'message': f'Batch extraction cancelled after {len(succeeded)} of '
+                                                  f'{len(results)} videos. Run again with resume to continue.',
+                    **summary}
+        if failed and not succeeded:
+            return {'error': failed[0]['error'] if len(failed) == 1 else
+                    f'All {len(failed)} videos failed. First error: {failed[0]["error"]}', **summary}
+        message = f"Extracted {len(succeeded)} videos: {summary['saved_count']} frames saved"
+        if failed:
+            message += f'. {len(failed)} videos failed'
+        return {'success': True, 'message': message, 'failed_count': len(failed), **summary}
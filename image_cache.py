@@ -0,0 +1,151 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Thumbnails are only generated at these widths so a folder never produces
+# more than a handful of cached variants per image
+THUMBNAIL_SIZES = (160, 320, 640, 960, 1280, 1920)
+
+
+class ThumbnailCache:
+    """
+    On-disk LRU cache of downscaled JPEG copies of images.
+
+    Thumbnails are keyed by the source path, its mtime and size and the
+    target width, so a replaced source image never serves a stale thumbnail.
+    Entries are evicted least-recently-used first (by file mtime, which is
+    touched on every hit) once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir='.cache/thumbnails', max_bytes=512 * 1024 * 1024, quality=85):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._total_bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def snap_size(self, size):
+        """Return the smallest supported thumbnail width >= size, or None for full size"""
+        for width in THUMBNAIL_SIZES:
+            if size <= width:
+                return width
+        return None
+
+    def _cache_path(self, image_path, st, width):
+        key = f'{os.path.abspath(image_path)}:{st.st_mtime_ns}:{st.st_size}:{width}'
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.jpg')
+
+    def _scan(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% so every insert near the limit doesn't rescan
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def get(self, image_path, size):
+        """
+        Return the path of a thumbnail of an image, generating it if needed
+
+        Args:
+            image_path (str): Path to the source image
+            size (int): Requested width in pixels
+
+        Returns:
+            str: Path to the thumbnail, or image_path itself when the requested
+            size is not smaller than the image
+        """
+        width = self.snap_size(size)
+        if width is None:
+            return image_path
+
+        st = os.stat(image_path)
+        cache_path = self._cache_path(image_path, st, width)
+        try:
+            os.utime(cache_path)  # Mark as recently used
+            return cache_path
+        except OSError:
+            pass
+
+        with Image.open(image_path) as img:
+            if img.width <= width:
+                return image_path
+            height = max(1, round(img.height * width / img.width))
+            # draft() lets the JPEG decoder downscale by up to 8x while decoding
+            img.draft('RGB', (width, height))
+            thumb = img.convert('RGB').resize((width, height), Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        thumb.save(tmp_path, 'JPEG', quality=self.quality)
+        os.replace(tmp_path, cache_path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += os.path.getsize(cache_path)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return cache_path
+
+
+class OverlayCache:
+    """
+    In-memory LRU cache of rendered images, bounded by their total size in bytes.
+
+    Callers key entries by everything the rendering depends on (e.g. the image
+    and label file mtimes), so an edit makes the old entry unreachable and it
+    ages out; nothing is ever written to disk.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> bytes
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached bytes for a key, or None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        """Store bytes under a key, evicting least-recently-used entries past max_bytes"""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old)
+            self._entries[key] = data
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
@@ -0,0 +1,63 @@
+import time
+
+
+class Detections:
+    """
+    Detections for a single image as NumPy arrays
+
+    Attributes:
+        xywh: (N, 4) float array of boxes in pixels (x_center, y_center, width, height)
+        cls: (N,) int array of class indices
+        conf: (N,) float array of confidences
+    """
+    __slots__ = ('xywh', 'cls', 'conf')
+
+    def __init__(self, xywh, cls, conf):
+        self.xywh = xywh
+        self.cls = cls
+        self.conf = conf
+
+    def __len__(self):
+        return len(self.cls)
+
+
+def to_detections(result):
+    """Convert an ultralytics Results object into Detections"""
+    boxes = result.boxes
+    return Detections(
+        boxes.xywh.cpu().numpy(),
+        boxes.cls.cpu().numpy().astype(int),
+        boxes.conf.cpu().numpy()
+    )
+
+
+def predict(model, images, timer=None, **kwargs):
+    """
+    Run a model on a batch of images
+
+    Args:
+        model: A loaded YOLO model (or any callable returning per-image results)
+        images (list): List of BGR images as NumPy arrays
+        timer (StageTimer): Optional timer recording the model call, plus the
+            preprocess, inference and postprocess (NMS) split reported by ultralytics
+        **kwargs: Extra keyword arguments for the model call (e.g. imgsz, conf)
+
+    Returns:
+        list: One Detections per input image
+    """
+    if not images:
+        return []
+    start = time.perf_counter()
+    results = model(images, verbose=False, **kwargs)
+    if timer is not None:
+        timer.add('model_call', time.perf_counter() - start)
+        # ultralytics reports per-image milliseconds for each step of the call
+        speeds = [getattr(r, 'speed', None) for r in results]
+        if not any(speeds) and getattr(model, 'speed', None):
+            # Backends returning Detections report per-image averages of the whole call
+            speeds = [model.speed] * len(results)
+        for step, stage in (('preprocess', 'preprocess'), ('inference', 'inference'), ('postprocess', 'nms')):
+            ms = [s[step] for s in speeds if s and s.get(step) is not None]
+            if ms:
+                timer.add(stage, sum(ms) / 1000)
+    return [r if isinstance(r, Detections) else to_detections(r) for r in results]
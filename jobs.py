@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+from model_registry import registry as model_registry
+
+JOB_KINDS = ('extract', 'extract_batch', 'annotate', 'bulk_edit', 'export')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+RESUMABLE_KINDS = ('extract', 'extract_batch', 'annotate')  # Jobs that checkpoint and accept resume=True
+
+
+def _state_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f'{job_id}.json')
+
+
+def _cancel_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f'{job_id}.cancel')
+
+
+def _read_state(jobs_dir, job_id):
+    try:
+        with open(_state_path(jobs_dir, job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(jobs_dir, job_id, state):
+    # Write to a temp file and rename so readers never see a partial file
+    path = _state_path(jobs_dir, job_id)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _worker_alive(state):
+    pid = state.get('worker_pid')
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _run_job(jobs_dir, job_id, kind, params):
+    """Run a job inside a pool worker process, recording progress in its state file"""
+    from progress import ProgressTracker
+
+    state = _read_state(jobs_dir, job_id)
+    if os.path.exists(_cancel_path(jobs_dir, job_id)):
+        state.update({'status': 'cancelled', 'finished_at': time.time()})
+        _write_state(jobs_dir, job_id, state)
+        return state
+
+    state.update({'status': 'running', 'started_at': time.time(), 'worker_pid': os.getpid()})
+    _write_state(jobs_dir, job_id, state)
+
+    def report(snapshot):
+        state['progress'] = snapshot
+        _write_state(jobs_dir, job_id, state)
+
+    progress = ProgressTracker(
+        0,
+        unit='frames' if kind in ('extract', 'extract_batch') else 'images',
+        callback=report,
+        should_stop=lambda: os.path.exists(_cancel_path(jobs_dir, job_id))
+    )
+
+    try:
+        if kind == 'extract':
+            from extractor import ImageExtractor
+            result = ImageExtractor().process(progress=progress, **params)
+        elif kind == 'extract_batch':
+            from extractor import ImageExtractor
+            result = ImageExtractor().process_batch(progress=progress, **params)
+        elif kind == 'annotate':
+            from annotator import ImageAnnotator
+            result = ImageAnnotator().process(progress=progress, **params)
+        elif kind == 'bulk_edit':
+            from bulk_ops import BulkClassEditor
+            result = BulkClassEditor().process(progress=progress, **params)
+        elif kind == 'export':
+            from exporter import DatasetExporter
+            result = DatasetExporter().process(progress=progress, **params)
+        else:
+            result = {'error': f'Unknown job kind: {kind}'}
+    except Exception as e:
+        result = {'error': f'Job failed: {str(e)}'}
+
+    if result.get('cancelled'):
+        state['status'] = 'cancelled'
+    elif result.get('error'):
+        state['status'] = 'failed'
+        state['error'] = result['error']
+    else:
+        state['status'] = 'completed'
+    state.update({'result': result, 'progress': progress.snapshot(), 'finished_at': time.time()})
+    _write_state(jobs_dir, job_id, state)
+    return state
+
+
+def _load_class_names(model_path):
+    """Load a model in a worker process, write its class-names sidecar and return the names"""
+    from model_registry import registry
+    return registry.write_sidecar(model_path)
+
+
+class JobManager:
+    """
+    Runs extraction, annotation and bulk edit jobs in a bounded pool of worker processes
+
+    Job state lives in one JSON file per job under jobs_dir, so any web worker
+    can report status. Workers write progress to the file as they go and stop
+    when a cancel marker file appears next to it.
+
+    Anything that needs a loaded model (jobs and class-name lookups) runs in
+    a worker process, so the web process never imports torch.
+    """
+
+    def __init__(self, jobs_dir='jobs', max_workers=2):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self._executor = None
+        self._model_executor = None
+        self._futures = {}
+        self._class_futures = {}  # Model path -> background class-names lookup
+        self._lock = threading.Lock()
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawn rather than fork so workers never inherit web server threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _get_model_executor(self):
+        with self._lock:
+            if self._model_executor is None:
+                # A separate worker so lookups don't queue behind long jobs; it is
+                # replaced after every call so torch is not kept resident
+                self._model_executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    max_tasks_per_child=1
+                )
+            return self._model_executor
+
+    def request_class_names(self, model_path, refresh=False):
+        """
+        Return a model's class names, loading them in the background if needed
+
+        Names come from the class-names sidecar when it is up to date. Otherwise a
+        worker process loads the model and rewrites the sidecar while this returns
+        at once; callers poll again until the names or an error come back. The
+        model is never loaded in this process and callers never wait for it.
+
+        Args:
+            model_path (str): Path to the YOLO model file
+            refresh (bool): Drop the outcome of an earlier lookup (e.g. after the
+                file was replaced by an upload)
+
+        Returns:
+            dict: {'classes': [...]} when known, {'pending': True} while the model
+                loads, or {'error': ...} if it could not be loaded
+        """
+        classes = model_registry.read_sidecar(model_path)
+        if classes is not None and not refresh:
+            return {'classes': classes}
+        executor = self._get_model_executor()
+        with self._lock:
+            future = self._class_futures.get(model_path)
+            if future is not None and (refresh or future.done()):
+                del self._class_futures[model_path]
+                if not refresh and future.exception() is not None:
+                    return {'error': str(future.exception())}
+                # Done, yet the sidecar is stale again: the file changed since
+                future = None
+            if future is None:
+                self._class_futures[model_path] = executor.submit(_load_class_names, model_path)
+        return {'pending': True}
+
+    def submit(self, kind, params):
+        """
+        Queue a job and return its id immediately
+
+        Args:
+            kind (str): One of JOB_KINDS
+            params (dict): Keyword arguments for the job's process() call
+
+        Returns:
+            str: The job id
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f'Unknown job kind: {kind}')
+
+        job_id = uuid.uuid4().hex[:12]
+        state = {
+            'id': job_id,
+            'kind': kind,
+            'params': params,
+            'status': 'queued',
+            'progress': None,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        _write_state(self.jobs_dir, job_id, state)
+        future = self._get_executor().submit(_run_job, self.jobs_dir, job_id, kind, params)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            state = _read_state(self.jobs_dir, job_id)
+        elif future.exception() is not None:
+            # The worker died before it could record the outcome itself
+            state = _read_state(self.jobs_dir, job_id) or {'id': job_id}
+            state.update({'status': 'failed', 'error': f'Worker error: {str(future.exception())}',
+                          'finished_at': time.time()})
+            _write_state(self.jobs_dir, job_id, state)
+        else:
+            state = future.result()
+        if state is not None:
+            # Stage timings come back in the result and feed this process's /metrics
+            metrics.record_job(state)
+
+    def get(self, job_id):
+        """Return the state dict of a job, or None if it does not exist"""
+        if not job_id or not job_id.isalnum():
+            return None
+        return _read_state(self.jobs_dir, job_id)
+
+    def list(self):
+        """Return the state of all jobs, newest first"""
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith('.json'):
+                state = _read_state(self.jobs_dir, name[:-len('.json')])
+                if state is not None:
+                    jobs.append(state)
+        jobs.sort(key=lambda j: j.get('created_at') or 0, reverse=True)
+        return jobs
+
+    def cancel(self, job_id):
+        """Request cancellation of a queued or running job"""
+        state = self.get(job_id)
+        if state is None:
+            return {'error': 'Job not found'}
+        if state['status'] in FINISHED_STATUSES:
+            return {'error': f'Job already {state["status"]}'}
+
+        # Running workers poll for this marker; queued jobs check it on start
+        with open(_cancel_path(self.jobs_dir, job_id), 'w'):
+            pass
+
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            state.update({'status': 'cancelled', 'finished_at': time.time()})
+            _write_state(self.jobs_dir, job_id, state)
+
+        return {'success': True, 'message': 'Cancellation requested'}
+
+    def resume(self, job_id):
+        """
+        Queue a new job that continues an interrupted extraction or annotation job
+
+        Allowed for failed and cancelled jobs, and for jobs still marked running
+        whose worker process is gone (e.g. after a crash or a deploy).
+
+        Returns:
+            dict: The new job id on success, otherwise an error
+        """
+        state = self.get(job_id)
+        if state is None:
+            return {'error': 'Job not found'}
+        if state['kind'] not in RESUMABLE_KINDS:
+            return {'error': f'{state["kind"]} jobs cannot be resumed'}
+        if state['status'] == 'completed':
+            return {'error': 'Job already completed'}
+        if state['status'] == 'queued' or (state['status'] == 'running' and _worker_alive(state)):
+            return {'error': f'Job is still {state["status"]}'}
+        if state.get('resumed_by'):
+            return {'error': f'Job was already resumed as {state["resumed_by"]}'}
+
+        new_id = self.submit(state['kind'], {**state['params'], 'resume': True})
+        state['resumed_by'] = new_id
+        if state['status'] == 'running':
+            state.update({'status': 'failed', 'error': 'Worker exited before the job finished',
+                          'finished_at': time.time()})
+        _write_state(self.jobs_dir, job_id, state)
+        return {'success': True, 'job_id': new_id, 'message': 'Resume job queued'}
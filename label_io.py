@@ -0,0 +1,102 @@
+import os
+import zlib
+import hashlib
+import threading
+from contextlib import contextmanager, ExitStack
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+LOCKS_DIR = '.cache/locks'
+LEGACY_LOCKS_DIRNAME = '.locks'  # Older versions kept the lock files inside the folder
+LOCK_BUCKETS = 256  # Label files share this many lock files per folder
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_lock:
+        if path not in _thread_locks:
+            _thread_locks[path] = threading.Lock()
+        return _thread_locks[path]
+
+
+def lock_path(label_file):
+    """
+    Return the lock file guarding a label file
+
+    Label files are hashed into LOCK_BUCKETS lock files per folder, so bulk
+    edits of large folders don't leave one lock file per frame behind. The
+    lock files are kept under LOCKS_DIR, in a directory named by a hash of the
+    folder's absolute path, so they never end up in the dataset itself.
+    """
+    labels_dir, name = os.path.split(os.path.abspath(label_file))
+    folder_digest = hashlib.sha1(os.path.dirname(labels_dir).encode()).hexdigest()
+    bucket = zlib.crc32(os.path.splitext(name)[0].encode()) % LOCK_BUCKETS
+    return os.path.join(os.path.abspath(LOCKS_DIR), folder_digest[:16], f'{bucket:02x}.lock')
+
+
+def locked(label_file):
+    """
+    Hold an exclusive lock on a label file
+
+    Serializes threads of this process with an in-memory lock and, where
+    fcntl is available, other processes with a flock on a lock file under
+    LOCKS_DIR.
+    """
+    return _locked_path(lock_path(label_file))
+
+
+@contextmanager
+def locked_many(label_files):
+    """Hold the locks of several label files, acquired in a fixed order to avoid deadlocks"""
+    with ExitStack() as stack:
+        for path in sorted({lock_path(label_file) for label_file in label_files}):
+            stack.enter_context(_locked_path(path))
+        yield
+
+
+@contextmanager
+def _locked_path(path):
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_label_lines(label_file):
+    """Return the stripped lines of a label file; line numbers are annotation ids"""
+    with open(label_file) as f:
+        return [line.strip() for line in f]
+
+
+def write_label_lines(label_file, lines, fsync=True):
+    """
+    Atomically replace a label file: write a temp file, then rename over it
+
+    Args:
+        fsync (bool): Flush the temp file to disk before the rename. Bulk
+            rewrites skip this; the rename alone keeps readers from ever
+            seeing a partial file.
+    """
+    tmp_path = f'{label_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, label_file)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -1,19 +1,66 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, g, Response
 import os
+import json
+import time
 import shutil
-from extractor import ImageExtractor
-from annotator import ImageAnnotator
+import metrics
 from reviewer import AnnotationReviewer
-from ultralytics import YOLO
+from jobs import JobManager
+from image_cache import ThumbnailCache, OverlayCache
+from uploads import UploadStore
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024  # 16GB max file size
+app.config['JOB_WORKERS'] = 2  # Concurrent extraction/annotation jobs
+app.config['EXTRACT_WORKERS'] = os.cpu_count() or 1  # Max processes one segmented extraction may use
+app.config['THUMBNAIL_CACHE_BYTES'] = 512 * 1024 * 1024  # On-disk LRU limit for resized images
+app.config['OVERLAY_CACHE_BYTES'] = 64 * 1024 * 1024  # In-memory LRU limit for rendered review overlays (per process)
+app.config['IMAGE_DIRS'] = ['extracted-images', 'annotated-images']  # Directories /get_image may serve
+app.config['EXPORT_SHARD_MB'] = 256  # Default size of dataset export tar shards
+app.config['INFERENCE_BACKEND'] = 'torch'  # Default backend: 'torch' or 'onnx' (ONNX Runtime, CPU)
+app.config['GATE_CONF'] = 0.1  # Default confidence threshold of the cascade gate
+# ONNX Runtime threads per job, so concurrent jobs split the cores instead of oversubscribing them
+app.config['ONNX_THREADS'] = max(1, (os.cpu_count() or 1) // app.config['JOB_WORKERS'])
 
 # Ensure required directories exist
-for dir_name in ['uploads', 'models', 'videos', 'extracted-images', 'annotated-images']:
+for dir_name in ['uploads', 'models', 'videos', 'extracted-images', 'annotated-images', 'exports', 'jobs']:
     os.makedirs(dir_name, exist_ok=True)
 
+job_manager = JobManager(jobs_dir='jobs', max_workers=app.config['JOB_WORKERS'])
+thumbnail_cache = ThumbnailCache(max_bytes=app.config['THUMBNAIL_CACHE_BYTES'])
+overlay_cache = OverlayCache(max_bytes=app.config['OVERLAY_CACHE_BYTES'])
+upload_store = UploadStore(uploads_dir=app.config['UPLOAD_FOLDER'], videos_dir='videos')
+
+# Actions handled by POST /review
+REVIEW_ACTIONS = ('get_images', 'get_images_page', 'get_image_annotations', 'update_annotation',
+                  'delete_annotation', 'add_annotation', 'update_annotation_box', 'batch_edit', 'delete_frame')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None and request.endpoint not in (None, 'static', 'metrics_endpoint'):
+        endpoint = request.endpoint
+        if endpoint == 'review' and request.method == 'POST':
+            # Review actions differ widely in cost, so track them separately
+            # Only known actions get their own series, so clients can't create unbounded labels
+            action = request.form.get('action', '')
+            endpoint = f"review:{action if action in REVIEW_ACTIONS else 'other'}"
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start,
+            endpoint=endpoint, method=request.method, status=response.status_code
+        )
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics: request latency, job counts and per-stage job timings"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 def secure_filename(filename):
     """Basic filename sanitization"""
     # Remove any directory components
@@ -39,11 +86,16 @@ def get_model_classes():
         return jsonify({'error': 'Model not found'}), 404
         
     try:
-        model = YOLO(model_path)
-        class_names = model.names.values() if hasattr(model.names, 'values') else model.names
+        # Reading the sidecar is cheap; a missing or stale one is rewritten in the
+        # background and the client polls again
+        lookup = job_manager.request_class_names(model_path)
+        if lookup.get('error'):
+            return jsonify({'error': f'Error loading model: {lookup["error"]}'}), 500
+        if lookup.get('pending'):
+            return jsonify({'pending': True, 'message': 'Loading model classes...'}), 202
         return jsonify({
             'success': True,
-            'classes': list(class_names)
+            'classes': lookup['classes']
         })
     except Exception as e:
         return jsonify({'error': f'Error loading model: {str(e)}'}), 500
@@ -59,21 +111,10 @@ def get_folder_classes():
         return jsonify({'error': 'Folder not found'}), 404
         
     try:
-        # Get all unique class numbers from label files
-        classes = set()
-        labels_dir = os.path.join(folder_path, 'labels')
-        if os.path.exists(labels_dir):
-            for label_file in os.listdir(labels_dir):
-                if label_file.endswith('.txt'):
-                    with open(os.path.join(labels_dir, label_file), 'r') as f:
-                        for line in f:
-                            parts = line.strip().split()
-                            if parts:
-                                classes.add(parts[0])
-        
+        reviewer = AnnotationReviewer()
         return jsonify({
             'success': True,
-            'classes': sorted(list(classes), key=lambda x: int(x) if x.isdigit() else x)
+            'classes': reviewer.get_classes(folder_name)
         })
     except Exception as e:
         return jsonify({'error': f'Error loading classes: {str(e)}'}), 500
@@ -109,43 +150,168 @@ def upload_model():
             return jsonify({'error': 'No selected file'}), 400
         if file:
             filename = secure_filename(file.filename)
-            file.save(os.path.join('models', filename))
-            return jsonify({'message': f'Model uploaded successfully: {filename}'})
+            model_path = os.path.join('models', filename)
+            file.save(model_path)
+            # A worker loads the model in the background to validate the file and write
+            # its class-names sidecar; the page polls /get_model_classes for the outcome
+            job_manager.request_class_names(model_path, refresh=True)
+            return jsonify({'message': f'Model uploaded successfully: {filename}', 'model': filename})
     return render_template('upload_model.html')
 
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a chunked video upload; skipped when a video with the given sha256 or block_sha256 is stored"""
+    try:
+        size = int(request.form.get('size', ''))
+    except ValueError:
+        return jsonify({'error': 'Invalid size'}), 400
+    result = upload_store.create(secure_filename(request.form.get('filename', '')), size,
+                                 request.form.get('sha256') or None, request.form.get('block_sha256') or None)
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    """GET the received offset of an upload, or PUT a raw chunk at ?offset="""
+    if request.method == 'GET':
+        result = upload_store.status(upload_id)
+        return jsonify(result), 404 if 'error' in result else 200
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Invalid offset'}), 400
+    # Streamed to disk from the request body, never held in memory as a whole
+    result = upload_store.write_chunk(upload_id, offset, request.stream, request.content_length)
+    if 'error' in result:
+        return jsonify(result), 404 if result['error'] == 'Upload not found' else 409
+    return jsonify(result)
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    result = upload_store.complete(upload_id)
+    if 'error' in result:
+        return jsonify(result), 404 if result['error'] == 'Upload not found' else 409
+    return jsonify(result)
+
+@app.route('/videos')
+def list_videos():
+    return jsonify({'success': True, 'videos': upload_store.list_videos()})
+
+def inference_options(form):
+    """Parse the inference backend options shared by extraction and annotation"""
+    imgsz = form.get('imgsz')
+    return {
+        'backend': form.get('backend') or app.config['INFERENCE_BACKEND'],
+        'imgsz': int(imgsz) if imgsz else None,
+        'int8': form.get('int8') == 'true',
+        'threads': app.config['ONNX_THREADS']
+    }
+
+def extraction_options(form):
+    """Parse the extraction options shared by /extract and /extract_batch"""
+    sample_interval = form.get('sample_interval')
+    motion_threshold = form.get('motion_threshold')
+    hash_threshold = form.get('hash_threshold')
+    gate_model = form.get('gate_model')
+    gate_imgsz = form.get('gate_imgsz')
+    gate_conf = form.get('gate_conf')
+    track_max_interval = form.get('track_max_interval')
+    return {
+        'frame_skip': int(form.get('frame_skip', 1)),
+        'batch_size': int(form.get('batch_size', 8)),
+        'sample_interval': float(sample_interval) if sample_interval else None,
+        'keyframes_only': form.get('keyframes_only') == 'true',
+        'motion_threshold': float(motion_threshold) if motion_threshold else None,
+        'hash_threshold': int(hash_threshold) if hash_threshold else None,
+        # Optional single-pass mode: write images and labels straight to annotated-images
+        'class_mappings': form.get('class_mappings') or None,
+        'iou_threshold': float(form.get('iou_threshold', 0.5)),
+        # Continue an interrupted extraction into the existing folder from its checkpoint
+        'resume': form.get('resume') == 'true',
+        # Worker processes; above 1 the video is split into segments extracted in parallel
+        'workers': max(1, min(int(form.get('workers') or 1), app.config['EXTRACT_WORKERS'])),
+        # Optional cascade: a cheap gate model (or the model at a smaller size) screens every frame first
+        'gate_model_path': os.path.join('models', gate_model) if gate_model else None,
+        'gate_imgsz': int(gate_imgsz) if gate_imgsz else None,
+        'gate_conf': float(gate_conf) if gate_conf else app.config['GATE_CONF'],
+        # Optional tracking mode: only save frames in which a tracked object appears, moves or changes size
+        'track_changes': form.get('track_changes') == 'true',
+        'track_move_threshold': float(form.get('track_move_threshold') or 0.25),
+        'track_size_threshold': float(form.get('track_size_threshold') or 0.25),
+        'track_max_interval': float(track_max_interval) if track_max_interval else None,
+        **inference_options(form)
+    }
+
 @app.route('/extract', methods=['GET', 'POST'])
 def extract():
     if request.method == 'POST':
-        if 'video' not in request.files:
+        # A stored video is referenced by id; a file in the request is stored first
+        video_id = request.form.get('video_id')
+        video = request.files.get('video')
+        if not video_id and video is None:
             return jsonify({'error': 'No video file'}), 400
-        video = request.files['video']
         model_name = request.form.get('model')
         classes = request.form.getlist('classes[]')
-        frame_skip = int(request.form.get('frame_skip', 1))
         folder_name = request.form.get('folder_name')
+        options = extraction_options(request.form)
         
-        if not all([video.filename, model_name, classes, folder_name]):
+        if not all([video_id or video.filename, model_name, classes, folder_name]):
             return jsonify({'error': 'Missing required fields'}), 400
             
-        # Save video
-        video_path = os.path.join('videos', secure_filename(video.filename))
-        video.save(video_path)
-        
-        # Initialize extractor and process
-        extractor = ImageExtractor()
-        result = extractor.process(
-            video_path=video_path,
-            model_path=os.path.join('models', model_name),
-            selected_classes=classes,
-            frame_skip=frame_skip,
-            folder_name=folder_name
-        )
+        if video_id:
+            video_path = upload_store.video_path(video_id)
+            if video_path is None:
+                return jsonify({'error': 'Video not found'}), 404
+        else:
+            meta = upload_store.save_stream(video.stream, secure_filename(video.filename))
+            video_path = upload_store.video_path(meta['id'])
+        
+        # Queue extraction in the background and return the job id right away
+        job_id = job_manager.submit('extract', {
+            'video_path': video_path,
+            'model_path': os.path.join('models', model_name),
+            'selected_classes': classes,
+            'folder_name': folder_name,
+            **options
+        })
         
-        return jsonify(result)
+        return jsonify({'success': True, 'job_id': job_id, 'message': 'Extraction job queued'})
         
     # GET request - show form
     models = [f for f in os.listdir('models') if f.endswith('.pt')]
-    return render_template('extract.html', models=models)
+    return render_template('extract.html', models=models, videos=upload_store.list_videos(),
+                           max_workers=app.config['EXTRACT_WORKERS'], default_backend=app.config['INFERENCE_BACKEND'],
+                           gate_conf=app.config['GATE_CONF'])
+
+@app.route('/extract_batch', methods=['POST'])
+def extract_batch():
+    """Queue one job extracting several stored videos (video_ids[] and folder_names[]) on one process pool"""
+    video_ids = request.form.getlist('video_ids[]')
+    folder_names = request.form.getlist('folder_names[]')
+    model_name = request.form.get('model')
+    classes = request.form.getlist('classes[]')
+    if not all([video_ids, model_name, classes]) or len(video_ids) != len(folder_names) or not all(folder_names):
+        return jsonify({'error': 'Missing required fields'}), 400
+        
+    videos = []
+    for video_id, folder_name in zip(video_ids, folder_names):
+        video_path = upload_store.video_path(video_id)
+        if video_path is None:
+            return jsonify({'error': f'Video not found: {video_id}'}), 404
+        videos.append({'video_path': video_path, 'folder_name': folder_name})
+    options = extraction_options(request.form)
+    if not request.form.get('workers'):
+        options['workers'] = app.config['EXTRACT_WORKERS']
+        
+    job_id = job_manager.submit('extract_batch', {
+        'videos': videos,
+        'model_path': os.path.join('models', model_name),
+        'selected_classes': classes,
+        **options
+    })
+    
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Batch extraction job queued'})
 
 @app.route('/annotate', methods=['GET', 'POST'])
 def annotate():
@@ -154,25 +320,114 @@ def annotate():
         model_name = request.form.get('model')
         class_mappings = request.form.get('class_mappings')
         iou_threshold = float(request.form.get('iou_threshold', 0.5))
+        batch_size = int(request.form.get('batch_size', 8))
+        resume = request.form.get('resume') == 'true'
+        # Rewrite the labels of an annotated folder from cached detections
+        relabel_only = request.form.get('relabel_only') == 'true'
         
         if not all([folder_name, model_name, class_mappings]):
             return jsonify({'error': 'Missing required fields'}), 400
             
-        # Initialize annotator and process
-        annotator = ImageAnnotator()
-        result = annotator.process(
-            folder_name=folder_name,
-            model_path=os.path.join('models', model_name),
-            class_mappings=class_mappings,
-            iou_threshold=iou_threshold
-        )
+        # Queue annotation in the background and return the job id right away
+        job_id = job_manager.submit('annotate', {
+            'folder_name': folder_name,
+            'model_path': os.path.join('models', model_name),
+            'class_mappings': class_mappings,
+            'iou_threshold': iou_threshold,
+            'batch_size': batch_size,
+            'resume': resume,
+            'relabel_only': relabel_only,
+            **inference_options(request.form)
+        })
         
-        return jsonify(result)
+        return jsonify({'success': True, 'job_id': job_id, 'message': 'Annotation job queued'})
         
     # GET request - show form
     folders = [f for f in os.listdir('extracted-images') if os.path.isdir(os.path.join('extracted-images', f))]
+    annotated_folders = [f for f in os.listdir('annotated-images') if os.path.isdir(os.path.join('annotated-images', f))]
     models = [f for f in os.listdir('models') if f.endswith('.pt')]
-    return render_template('annotate.html', folders=folders, models=models)
+    return render_template('annotate.html', folders=folders, annotated_folders=annotated_folders, models=models,
+                           default_backend=app.config['INFERENCE_BACKEND'])
+
+@app.route('/bulk_edit', methods=['POST'])
+def bulk_edit():
+    """Queue a folder-wide class operation: remap, merge, drop or delete_empty"""
+    folder_name = request.form.get('folder_name')
+    operation = request.form.get('operation')
+    source_classes = [c.strip() for c in request.form.get('source_classes', '').split(',') if c.strip()]
+    target_class = request.form.get('target_class', '').strip()
+    delete_empty_frames = request.form.get('delete_empty_frames') == 'true' or operation == 'delete_empty'
+    dry_run = request.form.get('dry_run') == 'true'
+    
+    if not folder_name or operation not in ('remap', 'merge', 'drop', 'delete_empty'):
+        return jsonify({'error': 'Missing folder or unknown operation'}), 400
+        
+    remap = {}
+    drop_classes = []
+    if operation in ('remap', 'merge'):
+        if not source_classes or not target_class:
+            return jsonify({'error': 'Source and target classes are required'}), 400
+        if operation == 'remap' and len(source_classes) != 1:
+            return jsonify({'error': 'Remap takes exactly one source class; use merge for several'}), 400
+        remap = {cls: target_class for cls in source_classes}
+    elif operation == 'drop':
+        if not source_classes:
+            return jsonify({'error': 'Classes to drop are required'}), 400
+        drop_classes = source_classes
+        
+    job_id = job_manager.submit('bulk_edit', {
+        'folder_name': folder_name,
+        'remap': remap,
+        'drop_classes': drop_classes,
+        'delete_empty_frames': delete_empty_frames,
+        'dry_run': dry_run
+    })
+    
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Bulk edit job queued'})
+
+@app.route('/export', methods=['POST'])
+def export():
+    """Queue an incremental dataset export of an annotated folder to exports/<folder_name>"""
+    folder_name = request.form.get('folder_name')
+    if not folder_name or not os.path.isdir(os.path.join('annotated-images', folder_name)):
+        return jsonify({'error': 'Annotated folder not found'}), 400
+    try:
+        shard_size_mb = float(request.form.get('shard_size_mb') or app.config['EXPORT_SHARD_MB'])
+    except ValueError:
+        return jsonify({'error': 'Invalid shard size'}), 400
+        
+    job_id = job_manager.submit('export', {
+        'folder_name': folder_name,
+        'shard_size_mb': shard_size_mb,
+        'full': request.form.get('full') == 'true'
+    })
+    
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Export job queued'})
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify({'success': True, 'jobs': job_manager.list()})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    result = job_manager.cancel(job_id)
+    if 'error' in result:
+        return jsonify(result), 404 if result['error'] == 'Job not found' else 400
+    return jsonify(result)
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    result = job_manager.resume(job_id)
+    if 'error' in result:
+        return jsonify(result), 404 if result['error'] == 'Job not found' else 400
+    return jsonify(result)
 
 @app.route('/review', methods=['GET', 'POST'])
 def review():
@@ -188,6 +443,19 @@ def review():
         if action == 'get_images':
             class_names = request.form.getlist('class_names[]')
             return jsonify(reviewer.get_images(folder_name, class_names))
+        elif action == 'get_images_page':
+            class_names = request.form.getlist('class_names[]')
+            return jsonify(reviewer.get_images_page(
+                folder_name, class_names,
+                offset=request.form.get('offset', 0),
+                page_size=request.form.get('page_size', 50),
+                cursor=request.form.get('cursor'),
+                around=request.form.get('around')
+            ))
+        elif action == 'get_image_annotations':
+            class_names = request.form.getlist('class_names[]')
+            image_name = request.form.get('image_name')
+            return jsonify(reviewer.get_image_annotations(folder_name, image_name, class_names))
         elif action == 'update_annotation':
             image_name = request.form.get('image_name')
             annotation_id = request.form.get('annotation_id')
@@ -207,6 +475,13 @@ def review():
             annotation_id = request.form.get('annotation_id')
             box_data = request.form.get('box_data')
             return jsonify(reviewer.update_annotation_box(folder_name, image_name, annotation_id, box_data))
+        elif action == 'batch_edit':
+            try:
+                operations = json.loads(request.form.get('operations', '[]'))
+            except ValueError:
+                return jsonify({'error': 'Invalid operations JSON'})
+            class_names = request.form.getlist('class_names[]') or None
+            return jsonify(reviewer.apply_batch(folder_name, operations, class_names))
         elif action == 'delete_frame':
             image_name = request.form.get('image_name')
             return jsonify(reviewer.delete_frame(folder_name, image_name))
@@ -217,7 +492,73 @@ def review():
 
 @app.route('/get_image/<path:image_path>')
 def get_image(image_path):
-    return send_file(image_path)
+    """
+    Serve an image, optionally downscaled
+    
+    Query parameters:
+        size: Width in pixels to downscale to (snapped to a fixed set of widths)
+        v: Image version; versioned URLs never change and are cached for a year
+    """
+    real_path = os.path.realpath(image_path)
+    allowed = [os.path.realpath(d) + os.sep for d in app.config['IMAGE_DIRS']]
+    if not any(real_path.startswith(d) for d in allowed) or not os.path.isfile(real_path):
+        return jsonify({'error': 'Image not found'}), 404
+        
+    st = os.stat(real_path)
+    etag = f'{st.st_mtime_ns:x}-{st.st_size:x}'
+    serve_path = real_path
+    size = request.args.get('size', type=int)
+    if size:
+        width = thumbnail_cache.snap_size(size)
+        if width is not None:
+            serve_path = thumbnail_cache.get(real_path, width)
+            if serve_path != real_path:
+                etag += f'-w{width}'
+                
+    versioned = 'v' in request.args
+    response = send_file(
+        serve_path,
+        mimetype='image/jpeg' if serve_path != real_path else None,
+        conditional=True,
+        etag=etag,
+        last_modified=st.st_mtime,
+        max_age=31536000 if versioned else 0
+    )
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        # Unversioned URLs may be reused for a changed file, so always revalidate
+        response.cache_control.no_cache = True
+    return response
+
+@app.route('/overlay/<folder_name>/<image_name>')
+def get_overlay(folder_name, image_name):
+    """
+    Serve an annotated image with its boxes drawn on it, rendered in memory
+    
+    Query parameters:
+        classes: Comma-separated classes to draw (default: all)
+        size: Width in pixels to downscale to (snapped like /get_image)
+    """
+    annotated_dir = os.path.realpath('annotated-images')
+    real_path = os.path.realpath(os.path.join(annotated_dir, folder_name, 'images', image_name))
+    if not real_path.startswith(annotated_dir + os.sep) or not os.path.isfile(real_path):
+        return jsonify({'error': 'Image not found'}), 404
+        
+    classes = request.args.get('classes')
+    size = request.args.get('size', type=int)
+    width = thumbnail_cache.snap_size(size) if size else None
+    result = AnnotationReviewer().get_annotated_image(
+        folder_name, image_name, classes.split(',') if classes else None, width=width, cache=overlay_cache
+    )
+    if 'error' in result:
+        return jsonify(result), 500
+        
+    response = Response(result['image_data'], mimetype='image/jpeg')
+    response.set_etag(result['etag'])
+    # The same URL renders differently after an edit, so always revalidate
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
     app.run(debug=True)
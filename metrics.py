@@ -0,0 +1,225 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds; an implicit +Inf bucket follows
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing Prometheus counter with optional labels"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram with optional labels"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def _get_series(self, labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self._series:
+            self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        return self._series[key]
+
+    def observe(self, value, **labels):
+        with self._lock:
+            series = self._get_series(labels)
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def merge(self, bucket_counts, total, count, **labels):
+        """Add observations recorded elsewhere (e.g. a StageTimer in a worker process)"""
+        if len(bucket_counts) != len(self.buckets) + 1:
+            raise ValueError('Bucket layout does not match')
+        with self._lock:
+            series = self._get_series(labels)
+            for i, n in enumerate(bucket_counts):
+                series[0][i] += n
+            series[1] += total
+            series[2] += count
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", le))} {cumulative}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the metrics of this process and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Accumulates the time spent in each stage of one extraction or annotation run
+
+    Safe to use from several threads. snapshot() returns plain data (including
+    histogram bucket counts) so a worker process can hand it back in a job
+    result, where record_job merges it into the process-wide histograms.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._stages = {}  # name -> [per-bucket counts, total seconds, count]
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """Record one observation of a stage"""
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry = self._stages[stage]
+            entry[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def merge(self, snapshot):
+        """Add the stages of a snapshot taken elsewhere (e.g. in another worker process)"""
+        with self._lock:
+            for stage, timing in snapshot.items():
+                if len(timing['buckets']) != len(self.buckets) + 1:
+                    raise ValueError('Bucket layout does not match')
+                if stage not in self._stages:
+                    self._stages[stage] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                entry = self._stages[stage]
+                for i, n in enumerate(timing['buckets']):
+                    entry[0][i] += n
+                entry[1] += timing['seconds']
+                entry[2] += timing['count']
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the enclosed block as one observation of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Return {stage: {seconds, count, mean_ms, buckets}} as JSON-serializable data"""
+        with self._lock:
+            return {
+                stage: {
+                    'seconds': round(total, 6),
+                    'count': count,
+                    'mean_ms': round(1000 * total / count, 3) if count else 0.0,
+                    'buckets': list(counts)
+                }
+                for stage, (counts, total, count) in self._stages.items()
+            }
+
+
+registry = MetricsRegistry()
+
+job_stage_seconds = registry.histogram(
+    'annotation_job_stage_seconds',
+    'Time spent per call in each stage of extraction and annotation jobs',
+    ('kind', 'stage')
+)
+job_duration_seconds = registry.histogram(
+    'annotation_job_duration_seconds',
+    'Wall time of finished jobs',
+    ('kind', 'status'),
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 4 * 3600.0)
+)
+jobs_total = registry.counter('annotation_jobs_total', 'Finished jobs', ('kind', 'status'))
+job_items_total = registry.counter(
+    'annotation_job_items_total', 'Frames, images or files processed by finished jobs', ('kind', 'unit'))
+http_request_seconds = registry.histogram(
+    'annotation_http_request_duration_seconds',
+    'Latency of HTTP requests',
+    ('endpoint', 'method', 'status')
+)
+
+
+def record_job(state):
+    """Record a finished job's status, duration and stage timings"""
+    kind = state.get('kind', '')
+    status = state.get('status', '')
+    jobs_total.inc(kind=kind, status=status)
+    if state.get('started_at') and state.get('finished_at'):
+        job_duration_seconds.observe(state['finished_at'] - state['started_at'], kind=kind, status=status)
+    progress = state.get('progress') or {}
+    if progress.get('done'):
+        job_items_total.inc(progress['done'], kind=kind, unit=progress.get('unit', ''))
+
+    result = state.get('result') or {}
+    for stage, timing in (result.get('stage_timings') or {}).items():
+        try:
+            job_stage_seconds.merge(timing['buckets'], timing['seconds'], timing['count'], kind=kind, stage=stage)
+        except (KeyError, ValueError):
+            continue
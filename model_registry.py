@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from onnx_backend import BACKENDS, DEFAULT_IMGSZ, export_onnx, OnnxDetector
+
+SIDECAR_SUFFIX = '.classes.json'
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded YOLO models.
+
+    Models are kept in an LRU bounded by the total size of their weight files
+    and keyed by (path, mtime, content hash), so replacing a model file on disk
+    never serves stale weights. Class names are also written to a small JSON
+    sidecar next to the model so they can be looked up without loading torch.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()  # key -> (model, size)
+        self._hashes = {}  # (path, mtime_ns, size) -> sha256
+        self._total_bytes = 0
+        self._overrides = {}  # abspath -> model object registered in place of the file
+        self._lock = threading.RLock()
+
+    def content_hash(self, model_path):
+        """Return the sha256 of a model file, cached by path, mtime and size"""
+        path = os.path.abspath(model_path)
+        st = os.stat(path)
+        stat_key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stat_key in self._hashes:
+                return self._hashes[stat_key]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self._lock:
+            self._hashes[stat_key] = digest
+        return digest
+
+    def cache_key(self, model_path):
+        """Return the (path, mtime_ns, sha256) key used for a model file"""
+        path = os.path.abspath(model_path)
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, self.content_hash(path))
+
+    def detector_key(self, model_path, backend='torch', imgsz=None, int8=False):
+        """
+        Identify the detections a model produces, e.g. to key cached detections
+
+        The content hash of the model, combined with the backend settings when
+        they differ from running the .pt file at the default size.
+        """
+        digest = self.content_hash(model_path)
+        imgsz = imgsz or DEFAULT_IMGSZ
+        int8 = int8 and backend == 'onnx'
+        if backend == 'torch' and imgsz == DEFAULT_IMGSZ:
+            return digest
+        return hashlib.sha256(f"{digest}:{backend}:{imgsz}:{'int8' if int8 else 'fp32'}".encode()).hexdigest()
+
+    def get_model(self, model_path, backend='torch', imgsz=None, int8=False, threads=None):
+        """
+        Return a loaded YOLO model, loading it on first use
+
+        Args:
+            model_path (str): Path to the YOLO model file
+            backend (str): 'torch' runs the model with ultralytics; 'onnx' exports
+                it once to ONNX and runs it with ONNX Runtime on the CPU
+            imgsz (int): Inference size the ONNX export is made for (default 640)
+            int8 (bool): Use an int8-quantized ONNX export
+            threads (int): ONNX Runtime intra-op threads
+
+        Returns:
+            YOLO: The loaded model (an OnnxDetector for the onnx backend)
+        """
+        with self._lock:
+            override = self._overrides.get(os.path.abspath(model_path))
+        if override is not None:
+            return override
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown inference backend: {backend}')
+
+        key = self.cache_key(model_path)
+        if backend == 'onnx':
+            key += ('onnx', imgsz or DEFAULT_IMGSZ, bool(int8), threads)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0]
+
+            if backend == 'onnx':
+                path = export_onnx(key[0], key[2], imgsz or DEFAULT_IMGSZ, int8)
+                model = OnnxDetector(path, imgsz or DEFAULT_IMGSZ, threads)
+                size = os.path.getsize(path)
+            else:
+                from ultralytics import YOLO
+                model = YOLO(key[0])
+                size = os.path.getsize(key[0])
+
+            # Drop entries for older versions of the same file
+            for old_key in [k for k in self._models if k[0] == key[0] and k[1:3] != key[1:3]]:
+                self._total_bytes -= self._models.pop(old_key)[1]
+
+            self._models[key] = (model, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._models) > 1:
+                _, (_, old_size) = self._models.popitem(last=False)
+                self._total_bytes -= old_size
+            return model
+
+    def register(self, model_path, model):
+        """
+        Serve a model object for a path instead of loading the file
+
+        Used by the benchmark suite to plug a stub detector into the normal
+        extraction and annotation code paths. Pass None to remove the override.
+        """
+        with self._lock:
+            if model is None:
+                self._overrides.pop(os.path.abspath(model_path), None)
+            else:
+                self._overrides[os.path.abspath(model_path)] = model
+
+    def sidecar_path(self, model_path):
+        return os.path.splitext(model_path)[0] + SIDECAR_SUFFIX
+
+    def read_sidecar(self, model_path):
+        """Return class names from the sidecar, or None if it is missing or stale"""
+        sidecar = self.sidecar_path(model_path)
+        if not os.path.exists(sidecar):
+            return None
+        try:
+            with open(sidecar) as f:
+                meta = json.load(f)
+            st = os.stat(model_path)
+            if meta.get('size') != st.st_size:
+                return None
+            if meta.get('mtime_ns') != st.st_mtime_ns:
+                # Touched but possibly unchanged; fall back to the content hash
+                if meta.get('sha256') != self.content_hash(model_path):
+                    return None
+            return meta['classes']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def write_sidecar(self, model_path, model=None):
+        """Write the class-names sidecar for a model and return the class names"""
+        if model is None:
+            model = self.get_model(model_path)
+        names = model.names
+        if hasattr(names, 'items'):
+            classes = [names[k] for k in sorted(names)]
+        else:
+            classes = list(names)
+
+        st = os.stat(model_path)
+        meta = {
+            'classes': classes,
+            'sha256': self.content_hash(model_path),
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size
+        }
+        sidecar = self.sidecar_path(model_path)
+        tmp_path = sidecar + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, sidecar)
+        return classes
+
+    def get_class_names(self, model_path):
+        """Return class names, using the sidecar when it is up to date"""
+        classes = self.read_sidecar(model_path)
+        if classes is None:
+            classes = self.write_sidecar(model_path)
+        return classes
+
+
+registry = ModelRegistry()
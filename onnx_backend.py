@@ -0,0 +1,194 @@
+import os
+import ast
+import math
+import time
+import shutil
+import tempfile
+import cv2
+import numpy as np
+from inference import Detections
+
+BACKENDS = ('torch', 'onnx')
+DEFAULT_IMGSZ = 640
+
+# ultralytics predict defaults, so both backends keep the same detections
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DET = 300
+MAX_NMS = 30000
+MAX_WH = 7680  # Per-class box offset that keeps NMS class-aware
+PAD_VALUE = 114
+
+
+def onnx_path(model_path, model_sha256, imgsz=DEFAULT_IMGSZ, int8=False):
+    """Return the path of the cached ONNX export of a model: <stem>.<hash16>.<imgsz>[.int8].onnx"""
+    stem = os.path.splitext(model_path)[0]
+    return f"{stem}.{model_sha256[:16]}.{imgsz}{'.int8' if int8 else ''}.onnx"
+
+
+def export_onnx(model_path, model_sha256, imgsz=DEFAULT_IMGSZ, int8=False):
+    """
+    Export a .pt model to ONNX once and return the path of the cached file
+
+    The export has dynamic input shapes, so batches are letterboxed to the
+    same minimal rectangle the torch path uses. With int8, the float export
+    is quantized with ONNX Runtime's dynamic (weight-only) quantization.
+
+    Args:
+        model_path (str): Path to the .pt model
+        model_sha256 (str): Content hash of the model, part of the cache name
+        imgsz (int): Inference size (long side) the model is run at
+        int8 (bool): Quantize weights to int8
+
+    Returns:
+        str: Path of the ONNX file next to the model
+    """
+    path = onnx_path(model_path, model_sha256, imgsz, int8)
+    if os.path.exists(path):
+        return path
+    fp32_path = onnx_path(model_path, model_sha256, imgsz)
+    if not os.path.exists(fp32_path):
+        # ultralytics writes the export next to its input, so export a private copy
+        tmp_dir = tempfile.mkdtemp(prefix='.export-', dir=os.path.dirname(os.path.abspath(model_path)))
+        try:
+            tmp_model = os.path.join(tmp_dir, 'model.pt')
+            shutil.copyfile(model_path, tmp_model)
+            from ultralytics import YOLO
+            exported = YOLO(tmp_model).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=False)
+            os.replace(exported, fp32_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, path)
+    return path
+
+
+def _nms(boxes, scores, iou_threshold):
+    """Class-offset NMS over xyxy boxes (OpenCV); returns kept indices by descending score"""
+    rects = np.empty_like(boxes, dtype=np.float64)
+    rects[:, :2] = boxes[:, :2]
+    rects[:, 2:] = boxes[:, 2:] - boxes[:, :2]
+    keep = cv2.dnn.NMSBoxes(rects, scores.astype(np.float32), 0.0, iou_threshold)
+    return np.asarray(keep, dtype=int).reshape(-1)
+
+
+class OnnxDetector:
+    """
+    YOLO detection model exported to ONNX, run with ONNX Runtime on the CPU
+
+    Called like a YOLO model with a list of BGR images, it reproduces the
+    ultralytics letterbox, NMS and box scaling and returns Detections, so
+    extraction and annotation consume it exactly like the torch model.
+
+    Args:
+        path (str): Path to the exported .onnx file
+        imgsz (int): Inference size the model was exported for
+        threads (int): Intra-op threads (default: ONNX Runtime's choice, one per
+            physical core). Set it to the cores one job should use when several
+            jobs share a machine.
+    """
+
+    def __init__(self, path, imgsz=DEFAULT_IMGSZ, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        # Don't busy-wait between calls: the decode and write threads need those cores
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        if meta.get('task', 'detect') != 'detect':
+            raise ValueError(f"Only detection models are supported, not {meta['task']}")
+        self.names = ast.literal_eval(meta['names']) if 'names' in meta else {}
+        self.stride = int(meta.get('stride', 32))
+        self.end2end = meta.get('end2end') == 'True'
+        self.imgsz = math.ceil(imgsz / self.stride) * self.stride
+        self.speed = None  # Per-image milliseconds of the last call, as ultralytics reports them
+
+    def _letterbox(self, image, auto):
+        """Resize and pad an image the way ultralytics LetterBox does"""
+        h, w = image.shape[:2]
+        r = min(self.imgsz / h, self.imgsz / w)
+        new_w, new_h = round(w * r), round(h * r)
+        dw, dh = self.imgsz - new_w, self.imgsz - new_h
+        if auto:
+            dw, dh = dw % self.stride, dh % self.stride
+        dw, dh = dw / 2, dh / 2
+        if (w, h) != (new_w, new_h):
+            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = round(dh - 0.1), round(dh + 0.1)
+        left, right = round(dw - 0.1), round(dw + 0.1)
+        return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                  value=(PAD_VALUE,) * 3)
+
+    def _postprocess(self, pred, conf, iou, max_det):
+        """Return (xyxy, conf, cls) in letterboxed pixels for one image"""
+        if self.end2end or pred.shape[-1] == 6:
+            # NMS-free head: rows are already (x1, y1, x2, y2, conf, cls)
+            pred = pred[pred[:, 4] > conf][:max_det]
+            return pred[:, :4], pred[:, 4], pred[:, 5].astype(int)
+
+        # Rows are (x, y, w, h, class scores...) by anchor; reduce along the contiguous axis
+        scores = pred[4:]
+        cls = scores.argmax(0)
+        best = np.take_along_axis(scores, cls[None], 0)[0]
+        mask = best > conf
+        xywh, best, cls = pred[:4, mask].T, best[mask], cls[mask]
+        if len(best) > MAX_NMS:
+            top = np.argsort(-best, kind='stable')[:MAX_NMS]
+            xywh, best, cls = xywh[top], best[top], cls[top]
+        xyxy = np.empty_like(xywh)
+        xyxy[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+        xyxy[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+        keep = _nms(xyxy + (cls * MAX_WH)[:, None], best, iou)[:max_det]
+        return xyxy[keep], best[keep], cls[keep]
+
+    def _scale(self, xyxy, input_shape, image_shape):
+        """Map boxes from the letterboxed input back to the original image (ultralytics scale_boxes)"""
+        h0, w0 = image_shape[:2]
+        h1, w1 = input_shape
+        gain = min(h1 / h0, w1 / w0)
+        new_h, new_w = round(h0 * gain), round(w0 * gain)
+        pad_x, pad_y = round((w1 - new_w) / 2 - 0.1), round((h1 - new_h) / 2 - 0.1)
+        xyxy = xyxy.astype(np.float32)
+        xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - pad_x) / (new_w / w0)).clip(0, w0)
+        xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - pad_y) / (new_h / h0)).clip(0, h0)
+        return xyxy
+
+    def __call__(self, images, verbose=False, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, max_det=MAX_DET, **kwargs):
+        start = time.perf_counter()
+        # Same-shape batches use the minimal stride-aligned rectangle, like the torch path
+        auto = len({image.shape for image in images}) == 1
+        batch = np.stack([self._letterbox(image, auto) for image in images])
+        batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255
+        preprocessed = time.perf_counter()
+
+        preds = self.session.run(None, {self.input_name: batch})[0]
+        inferred = time.perf_counter()
+
+        results = []
+        for pred, image in zip(preds, images):
+            xyxy, scores, cls = self._postprocess(pred, conf, iou, max_det)
+            xyxy = self._scale(xyxy, batch.shape[2:], image.shape)
+            xywh = np.empty_like(xyxy)
+            xywh[:, :2] = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+            xywh[:, 2:] = xyxy[:, 2:] - xyxy[:, :2]
+            results.append(Detections(xywh, cls.astype(int), scores.astype(np.float32)))
+        done = time.perf_counter()
+
+        n = len(images)
+        self.speed = {
+            'preprocess': 1000 * (preprocessed - start) / n,
+            'inference': 1000 * (inferred - preprocessed) / n,
+            'postprocess': 1000 * (done - inferred) / n
+        }
+        return results
@@ -0,0 +1,81 @@
+import cv2
+import base64
+import numpy as np
+
+
+class FramePrefilter:
+    """
+    Cheap checks that skip work on near-identical video frames
+
+    Args:
+        motion_threshold (float): Mean absolute difference (0-255) between a
+            downscaled grayscale frame and the last inferred frame below which
+            inference is skipped. None disables the motion check.
+        hash_threshold (int): Maximum Hamming distance between the perceptual
+            hashes of a frame and the last saved frame for it to count as a
+            duplicate. None disables duplicate detection.
+        size (int): Side length of the downscaled frame used for motion checks
+    """
+
+    def __init__(self, motion_threshold=None, hash_threshold=None, size=64):
+        self.motion_threshold = motion_threshold
+        self.hash_threshold = hash_threshold
+        self.size = size
+        self._reference = None
+        self._last_hash = None
+
+    def _small_gray(self, frame, size):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+
+    def needs_inference(self, frame):
+        """Return True if the frame differs enough from the last inferred frame"""
+        if self.motion_threshold is None:
+            return True
+        small = self._small_gray(frame, self.size)
+        if self._reference is not None:
+            diff = cv2.absdiff(small, self._reference).mean()
+            if diff < self.motion_threshold:
+                return False
+        self._reference = small
+        return True
+
+    def perceptual_hash(self, frame):
+        """Return a 64-bit DCT perceptual hash of a frame as an int"""
+        small = self._small_gray(frame, 32).astype(np.float32)
+        low = cv2.dct(small)[:8, :8].flatten()
+        median = np.median(low[1:])  # Exclude the DC term, which only tracks brightness
+        bits = low > median
+        return int(np.packbits(bits).view('>u8')[0])
+
+    def is_duplicate(self, frame):
+        """Return True if the frame is a near-duplicate of the last saved frame"""
+        if self.hash_threshold is None:
+            return False
+        frame_hash = self.perceptual_hash(frame)
+        if self._last_hash is not None and bin(frame_hash ^ self._last_hash).count('1') <= self.hash_threshold:
+            return True
+        self._last_hash = frame_hash
+        return False
+
+    def checkpoint_state(self, last_inferred_frame=None):
+        """
+        Return the prefilter state as JSON-serializable data
+
+        Args:
+            last_inferred_frame (np.ndarray): The last frame passed to inference. The
+                motion reference is rebuilt from it, since the reader thread that
+                runs the motion check may already be ahead of the checkpoint.
+        """
+        state = {'last_hash': self._last_hash, 'reference': None}
+        if self.motion_threshold is not None and last_inferred_frame is not None:
+            small = self._small_gray(last_inferred_frame, self.size)
+            state['reference'] = base64.b64encode(small.tobytes()).decode('ascii')
+        return state
+
+    def restore_state(self, state):
+        """Restore state saved by checkpoint_state"""
+        self._last_hash = state.get('last_hash')
+        if state.get('reference'):
+            data = np.frombuffer(base64.b64decode(state['reference']), dtype=np.uint8)
+            self._reference = data.reshape(self.size, self.size)
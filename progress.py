@@ -0,0 +1,70 @@
+import time
+
+
+class ProgressTracker:
+    """
+    Tracks progress of a long-running task and reports rate and ETA
+
+    Args:
+        total (int): Total number of items (0 if unknown)
+        unit (str): Name of the items being processed, e.g. 'frames'
+        callback (callable): Called with a snapshot dict on every report.
+            Defaults to printing a progress line.
+        should_stop (callable): Returns True when the task should be cancelled
+        interval (float): Minimum seconds between reports
+    """
+
+    def __init__(self, total, unit='items', callback=None, should_stop=None, interval=1.0):
+        self.total = total
+        self.unit = unit
+        self.callback = callback or self._print
+        self.should_stop = should_stop
+        self.interval = interval
+        self.done = 0
+        self.cancelled = False
+        # Task-specific fields reported with every snapshot, e.g. counts of skipped items
+        self.extra = {}
+        self.start_time = time.time()
+        self._last_time = self.start_time
+        self._last_done = 0
+        self._rate = 0.0
+
+    def _print(self, snapshot):
+        eta = snapshot['eta_seconds']
+        eta_text = f", ETA {eta:.0f}s" if eta is not None else ''
+        print(f"Processing {self.unit} {snapshot['done']}/{snapshot['total']} "
+              f"({snapshot['rate']:.1f} {self.unit}/s{eta_text})")
+
+    def snapshot(self):
+        """Return the current progress as a JSON-serializable dict"""
+        remaining = self.total - self.done if self.total else 0
+        eta = remaining / self._rate if self._rate > 0 and remaining > 0 else None
+        return {
+            'done': self.done,
+            'total': self.total,
+            'unit': self.unit,
+            'rate': round(self._rate, 2),
+            'elapsed_seconds': round(time.time() - self.start_time, 1),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            **self.extra
+        }
+
+    def update(self, done):
+        """Record the number of items done, reporting at most once per interval"""
+        self.done = done
+        now = time.time()
+        if now - self._last_time < self.interval:
+            return
+        self._rate = (done - self._last_done) / (now - self._last_time)
+        self._last_time = now
+        self._last_done = done
+        if self.should_stop is not None and self.should_stop():
+            self.cancelled = True
+        self.callback(self.snapshot())
+
+    def finish(self):
+        """Report final progress using the average rate over the whole task"""
+        elapsed = time.time() - self.start_time
+        if elapsed > 0:
+            self._rate = self.done / elapsed
+        self.callback(self.snapshot())
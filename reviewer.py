@@ -1,12 +1,55 @@
+import io
 import os
-import glob
 import json
+import hashlib
 from PIL import Image, ImageDraw
+from annotation_index import get_index
+from label_io import locked, locked_many, read_label_lines, write_label_lines
+
+EDIT_OPS = ('update_class', 'update_box', 'delete', 'add')
+OVERLAY_QUALITY = 85
+
+
+def remove_review_overlays(folder_path):
+    """
+    Delete review_<name> images left in a folder by older versions of the reviewer
+
+    Only files whose <name> is also in the folder and that have no label file of
+    their own are removed, so a dataset whose frames really are named review_*
+    keeps them.
+
+    Returns:
+        int: Number of files removed
+    """
+    images_dir = os.path.join(folder_path, 'images')
+    labels_dir = os.path.join(folder_path, 'labels')
+    if not os.path.isdir(images_dir):
+        return 0
+    names = set(os.listdir(images_dir))
+    removed = 0
+    for name in names:
+        if not name.startswith('review_') or name[len('review_'):] not in names:
+            continue
+        if os.path.exists(os.path.join(labels_dir, os.path.splitext(name)[0] + '.txt')):
+            continue
+        try:
+            os.remove(os.path.join(images_dir, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
 
 class AnnotationReviewer:
     def __init__(self):
         self.annotated_dir = 'annotated-images'
 
+    def _index(self, folder_name):
+        return get_index(os.path.join(self.annotated_dir, folder_name))
+
+    def _reindex(self, folder_name, image_name):
+        """Update the folder index after a label file was edited"""
+        self._index(folder_name).update_file(os.path.splitext(image_name)[0])
+
     def get_class_counts(self, folder_name):
         """Get class counts for a folder"""
         folder_path = os.path.join(self.annotated_dir, folder_name)
@@ -15,15 +58,12 @@ class AnnotationReviewer:
         if not os.path.exists(labels_dir):
             return {}
             
-        class_counts = {}
-        for label_file in glob.glob(os.path.join(labels_dir, '*.txt')):
-            with open(label_file) as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if parts:
-                        cls = parts[0]
-                        class_counts[cls] = class_counts.get(cls, 0) + 1
-        return class_counts
+        return self._index(folder_name).class_counts()
+
+    def get_classes(self, folder_name):
+        """Get the sorted list of classes used in a folder"""
+        classes = self.get_class_counts(folder_name).keys()
+        return sorted(classes, key=lambda x: int(x) if x.isdigit() else x)
 
     def get_images(self, folder_name, class_names):
         """Get images and annotations for specified classes"""
@@ -34,168 +74,306 @@ class AnnotationReviewer:
         if not os.path.exists(images_dir) or not os.path.exists(labels_dir):
             return {'error': 'Images or labels directory not found'}
             
-        images_data = []
-        for label_file in glob.glob(os.path.join(labels_dir, '*.txt')):
-            img_name = os.path.splitext(os.path.basename(label_file))[0] + '.jpg'
-            img_path = os.path.join(images_dir, img_name)
-            
-            if not os.path.exists(img_path):
-                continue
-                
-            annotations = []
-            with open(label_file) as f:
-                for idx, line in enumerate(f):
-                    parts = line.strip().split()
-                    if len(parts) == 5:
-                        cls, x, y, bw, bh = parts
-                        if cls in class_names:
-                            annotations.append({
-                                'id': idx,
-                                'class': cls,
-                                'x': float(x),
-                                'y': float(y),
-                                'width': float(bw),
-                                'height': float(bh)
-                            })
-            
-            if annotations:  # Only include images that have annotations for selected classes
-                images_data.append({
-                    'image_name': img_name,
-                    'image_path': img_path,
-                    'label_file': label_file,
-                    'annotations': annotations
-                })
+        # Only images that have annotations for selected classes are returned
+        images_data = [
+            self._image_record(folder_name, stem, annotations)
+            for stem, annotations in self._index(folder_name).annotations_for_classes(class_names)
+        ]
         
         return {
             'success': True,
             'images': images_data
         }
 
-    def update_annotation(self, folder_name, image_name, annotation_id, new_class):
-        """Update annotation class"""
+    def _image_record(self, folder_name, stem, annotations, index=None):
         folder_path = os.path.join(self.annotated_dir, folder_name)
-        label_file = os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
+        img_name = stem + '.jpg'
+        image_path = os.path.join(folder_path, 'images', img_name)
+        try:
+            # Lets clients build versioned image URLs that can be cached indefinitely
+            version = f'{os.stat(image_path).st_mtime_ns:x}'
+        except OSError:
+            version = None
+        record = {
+            'image_name': img_name,
+            'image_path': image_path,
+            'label_file': os.path.join(folder_path, 'labels', stem + '.txt'),
+            'image_version': version,
+            'annotations': annotations
+        }
+        if index is not None:
+            record['index'] = index
+        return record
+
+    def get_images_page(self, folder_name, class_names, offset=0, page_size=50, cursor=None, around=None):
+        """
+        Get one page of images and annotations for specified classes
+        
+        Images are in stable natural frame order. Pages are addressed by offset,
+        or by the opaque next_cursor returned with the previous page.
         
-        if not os.path.exists(label_file):
-            return {'error': 'Label file not found'}
+        Args:
+            folder_name (str): Name of the annotated folder
+            class_names (list): Classes to include
+            offset (int): Index of the first image of the page
+            page_size (int): Maximum number of images to return
+            cursor (str): Continue after the page that returned this cursor
+            around (str): Return the page containing this image name, if it matches
+            
+        Returns:
+            dict: Page of images with their absolute index, total count and next cursor
+        """
+        folder_path = os.path.join(self.annotated_dir, folder_name)
+        if not os.path.exists(os.path.join(folder_path, 'images')) or not os.path.exists(os.path.join(folder_path, 'labels')):
+            return {'error': 'Images or labels directory not found'}
             
         try:
-            annotation_id = int(annotation_id)
-            new_lines = []
-            with open(label_file) as f:
-                for idx, line in enumerate(f):
-                    if idx == annotation_id:
-                        parts = line.strip().split()
-                        if parts:
-                            parts[0] = new_class
-                            new_lines.append(' '.join(parts))
-                        else:
-                            new_lines.append(line.strip())
-                    else:
-                        new_lines.append(line.strip())
+            index = self._index(folder_name)
+            page_size = max(1, min(int(page_size), 500))
+            offset = max(0, int(offset))
+            after = None
+            anchor_index = None
             
-            with open(label_file, 'w') as f:
-                f.write('\n'.join(new_lines))
+            if around:
+                stem = os.path.splitext(around)[0]
+                if index.image_annotations(stem, class_names) is not None:
+                    anchor_index = index.count_images(class_names, before=index.sort_key(stem))
+                    offset = anchor_index - anchor_index % page_size
+            elif cursor:
+                seq, _, stem = cursor.partition(':')
+                after = (int(seq), stem)
+                offset = index.count_images(class_names, before=after)
+                if index.image_annotations(stem, class_names) is not None:
+                    offset += 1
+                
+            rows = index.list_images(class_names, offset=0 if after else offset, limit=page_size, after=after)
+            images = [
+                self._image_record(folder_name, stem, annotations, offset + i)
+                for i, (stem, seq, annotations) in enumerate(rows)
+            ]
+            total = index.count_images(class_names)
+            next_cursor = None
+            if rows and offset + len(rows) < total:
+                last_stem, last_seq, _ = rows[-1]
+                next_cursor = f'{last_seq}:{last_stem}'
             
-            return {'success': True, 'message': 'Annotation updated successfully'}
-        except Exception as e:
-            return {'error': f'Error updating annotation: {str(e)}'}
+            return {
+                'success': True,
+                'images': images,
+                'offset': offset,
+                'total': total,
+                'next_cursor': next_cursor,
+                'anchor_index': anchor_index
+            }
+        except ValueError:
+            return {'error': 'Invalid page parameters'}
 
-    def update_annotation_box(self, folder_name, image_name, annotation_id, box_data):
-        """Update annotation box coordinates"""
+    def get_image_annotations(self, folder_name, image_name, class_names):
+        """Get the annotations of specified classes for a single image"""
         folder_path = os.path.join(self.annotated_dir, folder_name)
-        label_file = os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
-        
-        if not os.path.exists(label_file):
-            return {'error': 'Label file not found'}
+        if not os.path.exists(os.path.join(folder_path, 'labels')):
+            return {'error': 'Labels directory not found'}
             
+        stem = os.path.splitext(image_name)[0]
+        annotations = self._index(folder_name).image_annotations(stem, class_names)
+        return {
+            'success': True,
+            'matches': annotations is not None,
+            'image': self._image_record(folder_name, stem, annotations or [])
+        }
+
+    def _parse_box(self, box_data):
+        """Parse 'x,y,w,h' (or a 4-item list) into normalized YOLO box values"""
+        box_parts = box_data.split(',') if isinstance(box_data, str) else list(box_data)
+        if len(box_parts) != 4:
+            raise ValueError('Invalid box data format')
+        x_center, y_center, width, height = map(float, box_parts)
+        if not (0 <= x_center <= 1 and 0 <= y_center <= 1 and 0 <= width <= 1 and 0 <= height <= 1):
+            raise ValueError('Box coordinates must be normalized (0-1)')
+        return x_center, y_center, width, height
+
+    def _apply_operations(self, lines, operations, image_path):
+        """
+        Apply edit operations to the lines of one label file in memory
+
+        Annotation ids refer to line numbers before the batch, so an operation
+        is unaffected by deletions or additions earlier in the same batch.
+        """
+        lines = list(lines)
+        deleted = set()
+        added = []
+        for op in operations:
+            kind = op.get('op')
+            if kind not in EDIT_OPS:
+                raise ValueError(f'Unknown operation: {kind}')
+            if kind == 'add':
+                if not os.path.exists(image_path):
+                    raise ValueError('Image file not found')
+                x_center, y_center, width, height = self._parse_box(op.get('box'))
+                class_name = str(op.get('class_name', '')).strip()
+                if not class_name or len(class_name.split()) != 1:
+                    raise ValueError('Invalid class name')
+                added.append(f'{class_name} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}')
+                continue
+
+            try:
+                annotation_id = int(op.get('annotation_id'))
+            except (TypeError, ValueError):
+                raise ValueError('Invalid annotation id')
+            if not 0 <= annotation_id < len(lines) or annotation_id in deleted:
+                raise ValueError(f'Annotation {annotation_id} not found')
+            parts = lines[annotation_id].split()
+
+            if kind == 'delete':
+                deleted.add(annotation_id)
+            elif kind == 'update_class':
+                new_class = str(op.get('new_class', '')).strip()
+                if not new_class or len(new_class.split()) != 1:
+                    raise ValueError('Invalid class name')
+                if parts:
+                    parts[0] = new_class
+                    lines[annotation_id] = ' '.join(parts)
+            elif kind == 'update_box':
+                x_center, y_center, width, height = self._parse_box(op.get('box'))
+                if len(parts) >= 5:
+                    # Keep the class but update the box coordinates
+                    lines[annotation_id] = f'{parts[0]} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}'
+
+        return [line for idx, line in enumerate(lines) if idx not in deleted] + added
+
+    def _annotations_from_lines(self, lines, class_names=None):
+        """Build annotation dicts (as returned by get_images) from label lines"""
+        annotations = []
+        for idx, line in enumerate(lines):
+            parts = line.split()
+            if len(parts) != 5 or (class_names is not None and parts[0] not in class_names):
+                continue
+            try:
+                x, y, w, h = map(float, parts[1:])
+            except ValueError:
+                continue
+            annotations.append({'id': idx, 'class': parts[0], 'x': x, 'y': y, 'width': w, 'height': h})
+        return annotations
+
+    def _edit_locked(self, folder_path, by_image, label_files):
+        """
+        Validate and write the edits of a batch; the caller holds all file locks
+
+        Returns:
+            tuple: ({image_name: new lines}, None) or (None, error message)
+        """
+        new_lines = {}
+        for image_name, image_ops in by_image.items():
+            label_file = label_files[image_name]
+            if not os.path.exists(label_file):
+                return None, f'Label file not found for {image_name}'
+            try:
+                image_path = os.path.join(folder_path, 'images', image_name)
+                new_lines[image_name] = self._apply_operations(
+                    read_label_lines(label_file), image_ops, image_path)
+            except ValueError as e:
+                return None, f'{image_name}: {str(e)}'
+
+        # Nothing is written unless every operation in the batch was valid
+        for image_name, lines in new_lines.items():
+            write_label_lines(label_files[image_name], lines)
+        return new_lines, None
+
+    def apply_batch(self, folder_name, operations, class_names=None):
+        """
+        Apply a batch of annotation edits to one or more images atomically
+
+        Every label file touched is locked (in a fixed order, so concurrent
+        batches cannot deadlock) and all operations are validated before
+        anything is written. Each file is then replaced via temp-then-rename,
+        so readers and crashes never see a half-written label file.
+
+        Args:
+            folder_name (str): Name of the annotated folder
+            operations (list): Dicts with 'op' (one of EDIT_OPS) and 'image_name', plus
+                'annotation_id' for update_class/update_box/delete, 'new_class' for
+                update_class, 'box' ('x,y,w,h' or [x, y, w, h]) for update_box/add and
+                'class_name' for add. Annotation ids are line numbers before the batch.
+            class_names (list): If given, only annotations of these classes are returned
+
+        Returns:
+            dict: Success and the updated annotations of every touched image, or an error
+        """
+        if not isinstance(operations, list) or not operations:
+            return {'error': 'No operations given'}
+        folder_path = os.path.join(self.annotated_dir, folder_name)
+
+        by_image = {}
+        for op in operations:
+            if not isinstance(op, dict) or not op.get('image_name'):
+                return {'error': 'Every operation needs an image_name'}
+            image_name = os.path.basename(op['image_name'])
+            by_image.setdefault(image_name, []).append(op)
+
+        label_files = {
+            image_name: os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
+            for image_name in by_image
+        }
         try:
-            # Parse box data (should be in YOLO format: x_center, y_center, width, height)
-            box_parts = box_data.split(',')
-            if len(box_parts) != 4:
-                return {'error': 'Invalid box data format'}
-            
-            x_center, y_center, width, height = map(float, box_parts)
-            
-            # Validate coordinates
-            if not (0 <= x_center <= 1 and 0 <= y_center <= 1 and 0 <= width <= 1 and 0 <= height <= 1):
-                return {'error': 'Box coordinates must be normalized (0-1)'}
-            
-            annotation_id = int(annotation_id)
-            new_lines = []
-            with open(label_file) as f:
-                for idx, line in enumerate(f):
-                    if idx == annotation_id:
-                        parts = line.strip().split()
-                        if len(parts) >= 5:
-                            # Keep the class but update the box coordinates
-                            class_name = parts[0]
-                            new_lines.append(f'{class_name} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}')
-                        else:
-                            new_lines.append(line.strip())
-                    else:
-                        new_lines.append(line.strip())
-            
-            with open(label_file, 'w') as f:
-                f.write('\n'.join(new_lines))
-            
-            return {'success': True, 'message': 'Annotation box updated successfully'}
+            with locked_many(label_files.values()):
+                new_lines, error = self._edit_locked(folder_path, by_image, label_files)
+            if error:
+                return {'error': error}
         except Exception as e:
-            return {'error': f'Error updating annotation box: {str(e)}'}
+            return {'error': f'Error applying edits: {str(e)}'}
+
+        images = {}
+        for image_name, lines in new_lines.items():
+            self._reindex(folder_name, image_name)
+            annotations = self._annotations_from_lines(lines, class_names)
+            images[image_name] = {
+                'annotations': annotations,
+                'matches': bool(annotations) if class_names is not None else True
+            }
+
+        return {
+            'success': True,
+            'message': f'Applied {len(operations)} edit(s) to {len(images)} image(s)',
+            'images': images
+        }
+
+    def _apply_single(self, folder_name, image_name, operation, message):
+        operation['image_name'] = image_name
+        result = self.apply_batch(folder_name, [operation])
+        if not result.get('success'):
+            # Keep the single-edit error messages free of the batch's image prefix
+            error = result['error']
+            prefix = f'{os.path.basename(image_name)}: '
+            if error.startswith('Label file not found'):
+                error = 'Label file not found'
+            elif error.startswith(prefix):
+                error = error[len(prefix):]
+            return {'error': error}
+        return {'success': True, 'message': message}
+
+    def update_annotation(self, folder_name, image_name, annotation_id, new_class):
+        """Update annotation class"""
+        return self._apply_single(folder_name, image_name, {
+            'op': 'update_class', 'annotation_id': annotation_id, 'new_class': new_class
+        }, 'Annotation updated successfully')
+
+    def update_annotation_box(self, folder_name, image_name, annotation_id, box_data):
+        """Update annotation box coordinates"""
+        return self._apply_single(folder_name, image_name, {
+            'op': 'update_box', 'annotation_id': annotation_id, 'box': box_data
+        }, 'Annotation box updated successfully')
 
     def delete_annotation(self, folder_name, image_name, annotation_id):
         """Delete an annotation"""
-        folder_path = os.path.join(self.annotated_dir, folder_name)
-        label_file = os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
-        
-        if not os.path.exists(label_file):
-            return {'error': 'Label file not found'}
-            
-        try:
-            annotation_id = int(annotation_id)
-            new_lines = []
-            with open(label_file) as f:
-                for idx, line in enumerate(f):
-                    if idx != annotation_id:
-                        new_lines.append(line.strip())
-            
-            with open(label_file, 'w') as f:
-                f.write('\n'.join(new_lines))
-            
-            return {'success': True, 'message': 'Annotation deleted successfully'}
-        except Exception as e:
-            return {'error': f'Error deleting annotation: {str(e)}'}
+        return self._apply_single(folder_name, image_name, {
+            'op': 'delete', 'annotation_id': annotation_id
+        }, 'Annotation deleted successfully')
 
     def add_annotation(self, folder_name, image_name, box_data, class_name):
         """Add a new annotation"""
-        folder_path = os.path.join(self.annotated_dir, folder_name)
-        label_file = os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
-        image_path = os.path.join(folder_path, 'images', image_name)
-        
-        if not os.path.exists(label_file):
-            return {'error': 'Label file not found'}
-        if not os.path.exists(image_path):
-            return {'error': 'Image file not found'}
-            
-        try:
-            # Parse box data (should be in YOLO format: x_center, y_center, width, height)
-            box_parts = box_data.split(',')
-            if len(box_parts) != 4:
-                return {'error': 'Invalid box data format'}
-            
-            x_center, y_center, width, height = map(float, box_parts)
-            
-            # Validate coordinates
-            if not (0 <= x_center <= 1 and 0 <= y_center <= 1 and 0 <= width <= 1 and 0 <= height <= 1):
-                return {'error': 'Box coordinates must be normalized (0-1)'}
-            
-            # Add to label file
-            with open(label_file, 'a') as f:
-                f.write(f'\n{class_name} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}')
-            
-            return {'success': True, 'message': 'Annotation added successfully'}
-        except Exception as e:
-            return {'error': f'Error adding annotation: {str(e)}'}
+        return self._apply_single(folder_name, image_name, {
+            'op': 'add', 'box': box_data, 'class_name': class_name
+        }, 'Annotation added successfully')
 
     def delete_frame(self, folder_name, image_name):
         """Delete an entire frame (image and label)"""
@@ -204,17 +382,69 @@ class AnnotationReviewer:
         label_file = os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
         
         try:
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            if os.path.exists(label_file):
-                os.remove(label_file)
+            with locked(label_file):
+                if os.path.exists(image_path):
+                    os.remove(image_path)
+                if os.path.exists(label_file):
+                    os.remove(label_file)
+            if os.path.isdir(folder_path):
+                self._index(folder_name).remove_file(os.path.splitext(image_name)[0])
             
             return {'success': True, 'message': 'Frame deleted successfully'}
         except Exception as e:
             return {'error': f'Error deleting frame: {str(e)}'}
 
-    def get_annotated_image(self, folder_name, image_name, selected_classes=None):
-        """Get image with annotations drawn on it"""
+    def _render_overlay(self, image_path, label_file, selected_classes=None, width=None):
+        """Draw the annotations of an image onto it and return the JPEG bytes"""
+        with Image.open(image_path) as img:
+            if width and img.width > width:
+                height = max(1, round(img.height * width / img.width))
+                # draft() lets the JPEG decoder downscale by up to 8x while decoding
+                img.draft('RGB', (width, height))
+                img = img.convert('RGB').resize((width, height), Image.LANCZOS)
+            else:
+                img = img.convert('RGB')
+        draw = ImageDraw.Draw(img)
+        w, h = img.size
+
+        lines = read_label_lines(label_file) if os.path.exists(label_file) else []
+        for idx, line in enumerate(lines):
+            parts = line.split()
+            if len(parts) == 5:
+                cls, x, y, bw, bh = parts
+                if selected_classes is None or cls in selected_classes:
+                    x, y, bw, bh = float(x), float(y), float(bw), float(bh)
+                    x1 = (x - bw/2) * w
+                    y1 = (y - bh/2) * h
+                    x2 = (x + bw/2) * w
+                    y2 = (y + bh/2) * h
+
+                    color = 'red' if selected_classes and cls in selected_classes else 'blue'
+                    draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
+                    draw.text((x1, y1 - 12), f"ID {idx}", fill=color)
+
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=OVERLAY_QUALITY)
+        return buffer.getvalue()
+
+    def get_annotated_image(self, folder_name, image_name, selected_classes=None, width=None, cache=None):
+        """
+        Get image with annotations drawn on it, rendered in memory
+
+        Nothing is written to the dataset folder. Rendered images are kept in
+        cache keyed by the mtime and size of the image and label files, the
+        selected classes and the width, so any edit renders the overlay afresh.
+
+        Args:
+            folder_name (str): Name of the annotated folder
+            image_name (str): Name of the image in the folder's images directory
+            selected_classes (list): Only draw these classes, in red (None: all, in blue)
+            width (int): Downscale to this width before drawing (None: full size)
+            cache (OverlayCache): Optional in-memory cache of rendered overlays
+
+        Returns:
+            dict: Success with the JPEG bytes under 'image_data' and an 'etag', or an error
+        """
         folder_path = os.path.join(self.annotated_dir, folder_name)
         image_path = os.path.join(folder_path, 'images', image_name)
         label_file = os.path.join(folder_path, 'labels', os.path.splitext(image_name)[0] + '.txt')
@@ -223,42 +453,25 @@ class AnnotationReviewer:
             return {'error': 'Image file not found'}
             
         try:
-            img = Image.open(image_path).convert('RGB')
-            draw = ImageDraw.Draw(img)
-            w, h = img.size
-            
-            annotations = []
-            with open(label_file) as f:
-                for idx, line in enumerate(f):
-                    parts = line.strip().split()
-                    if len(parts) == 5:
-                        cls, x, y, bw, bh = parts
-                        if selected_classes is None or cls in selected_classes:
-                            x, y, bw, bh = float(x), float(y), float(bw), float(bh)
-                            x1 = (x - bw/2) * w
-                            y1 = (y - bh/2) * h
-                            x2 = (x + bw/2) * w
-                            y2 = (y + bh/2) * h
-                            
-                            color = 'red' if selected_classes and cls in selected_classes else 'blue'
-                            draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
-                            draw.text((x1, y1 - 12), f"ID {idx}", fill=color)
-                            
-                            annotations.append({
-                                'id': idx,
-                                'class': cls,
-                                'x': x, 'y': y, 'width': bw, 'height': bh,
-                                'bbox': [x1, y1, x2, y2]
-                            })
-            
-            # Save annotated image directly to the annotated-images folder
-            output_path = os.path.join(folder_path, 'images', f"review_{image_name}")
-            img.save(output_path)
+            image_st = os.stat(image_path)
+            try:
+                label_st = os.stat(label_file)
+                label_version = (label_st.st_mtime_ns, label_st.st_size)
+            except FileNotFoundError:
+                label_version = None
+            classes = tuple(sorted(selected_classes)) if selected_classes is not None else None
+            key = (os.path.abspath(image_path), image_st.st_mtime_ns, image_st.st_size, label_version, classes, width)
+
+            image_data = cache.get(key) if cache is not None else None
+            if image_data is None:
+                image_data = self._render_overlay(image_path, label_file, selected_classes, width)
+                if cache is not None:
+                    cache.put(key, image_data)
             
             return {
                 'success': True,
-                'annotated_image_path': output_path,
-                'annotations': annotations
+                'image_data': image_data,
+                'etag': hashlib.sha1(repr(key).encode()).hexdigest()[:16]
             }
         except Exception as e:
             return {'error': f'Error processing image: {str(e)}'} 
\ No newline at end of file
@@ -0,0 +1,97 @@
+import random
+import unittest
+import numpy as np
+from annotator import ImageAnnotator
+
+
+def reference_iou(box1, box2):
+    """IoU of two (x, y, w, h) boxes, as the original pairwise implementation computed it"""
+    x1, y1, w1, h1 = box1
+    x2, y2, w2, h2 = box2
+    x1_min, x1_max = x1 - w1/2, x1 + w1/2
+    y1_min, y1_max = y1 - h1/2, y1 + h1/2
+    x2_min, x2_max = x2 - w2/2, x2 + w2/2
+    y2_min, y2_max = y2 - h2/2, y2 + h2/2
+    x_min = max(x1_min, x2_min)
+    y_min = max(y1_min, y2_min)
+    x_max = min(x1_max, x2_max)
+    y_max = min(y1_max, y2_max)
+    if x_max <= x_min or y_max <= y_min:
+        return 0.0
+    intersection = (x_max - x_min) * (y_max - y_min)
+    union = w1 * h1 + w2 * h2 - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def reference_filter(boxes, classes, iou_threshold=0.5):
+    """The original O(n^2) greedy overlap filter: largest boxes first, drop boxes overlapping a kept one"""
+    if len(boxes) <= 1:
+        return list(boxes), list(classes)
+    boxes = list(boxes)
+    classes = list(classes)
+    areas = [w * h for _, _, w, h in boxes]
+    sorted_indices = sorted(range(len(boxes)), key=lambda i: areas[i], reverse=True)
+    filtered_indices = []
+    for i in sorted_indices:
+        if all(reference_iou(boxes[i], boxes[kept]) <= iou_threshold for kept in filtered_indices):
+            filtered_indices.append(i)
+    return [boxes[i] for i in sorted(filtered_indices)], [classes[i] for i in sorted(filtered_indices)]
+
+
+class FilterOverlappingDetectionsTest(unittest.TestCase):
+    def setUp(self):
+        self.annotator = ImageAnnotator()
+
+    def assert_same_as_reference(self, boxes, classes, iou_threshold):
+        expected_boxes, expected_classes = reference_filter(boxes, classes, iou_threshold)
+        filtered_boxes, filtered_classes = self.annotator.filter_overlapping_detections(
+            np.array(boxes, dtype=np.float64).reshape(-1, 4), np.array(classes), iou_threshold
+        )
+        np.testing.assert_array_equal(filtered_boxes, np.array(expected_boxes, dtype=np.float64).reshape(-1, 4))
+        self.assertEqual(filtered_classes.tolist(), expected_classes)
+
+    def test_random_boxes(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            n = rng.randint(0, 40)
+            boxes = [(rng.random(), rng.random(), rng.uniform(0.01, 0.5), rng.uniform(0.01, 0.5)) for _ in range(n)]
+            classes = [rng.randint(0, 5) for _ in range(n)]
+            for iou_threshold in (0.0, 0.1, 0.3, 0.5, 0.7, 0.9, 1.0):
+                self.assert_same_as_reference(boxes, classes, iou_threshold)
+
+    def test_tied_areas(self):
+        # Few distinct sizes on a coarse grid: many equal areas and many exact overlaps
+        rng = random.Random(1)
+        sizes = [(0.2, 0.2), (0.1, 0.4), (0.4, 0.1), (0.25, 0.25)]
+        for _ in range(300):
+            n = rng.randint(2, 30)
+            boxes = [(rng.randint(0, 8) / 8, rng.randint(0, 8) / 8, *rng.choice(sizes)) for _ in range(n)]
+            classes = [rng.randint(0, 3) for _ in range(n)]
+            for iou_threshold in (0.0, 0.25, 0.5, 1.0):
+                self.assert_same_as_reference(boxes, classes, iou_threshold)
+
+    def test_iou_equal_to_threshold_is_kept(self):
+        # The small box covers exactly half of the union: IoU is exactly 0.5
+        boxes = [(1.0, 0.5, 2.0, 1.0), (0.5, 0.5, 1.0, 1.0)]
+        self.assertEqual(self.annotator.iou_matrix(np.array(boxes))[0, 1], 0.5)
+        for iou_threshold, kept in ((0.5, 2), (0.49, 1)):
+            self.assert_same_as_reference(boxes, [0, 1], iou_threshold)
+            filtered_boxes, _ = self.annotator.filter_overlapping_detections(np.array(boxes), np.array([0, 1]),
+                                                                             iou_threshold)
+            self.assertEqual(len(filtered_boxes), kept)
+
+    def test_touching_and_identical_boxes(self):
+        touching = [(0.25, 0.5, 0.5, 0.5), (0.75, 0.5, 0.5, 0.5)]
+        identical = [(0.5, 0.5, 0.2, 0.2)] * 3
+        degenerate = [(0.5, 0.5, 0.0, 0.0), (0.5, 0.5, 0.0, 0.0), (0.5, 0.5, 0.2, 0.2)]
+        for boxes in (touching, identical, degenerate):
+            for iou_threshold in (0.0, 0.5, 1.0):
+                self.assert_same_as_reference(boxes, list(range(len(boxes))), iou_threshold)
+
+    def test_empty_and_single(self):
+        for boxes in ([], [(0.5, 0.5, 0.1, 0.1)]):
+            self.assert_same_as_reference(boxes, list(range(len(boxes))), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import numpy as np
+
+TRACKS_NAME = '.tracks.jsonl'
+
+
+def box_iou(a, b):
+    """Return the (len(a), len(b)) IoU matrix of two arrays of xyxy boxes"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class ChangeTracker:
+    """
+    IoU tracker that decides which video frames are worth saving
+
+    Detections are matched greedily to the existing tracks of the same class by
+    IoU. A frame is worth saving when a track appears, when a track has moved or
+    changed size since the last saved frame that showed it, or when a track has
+    not been saved for max_interval frames. Anything else (e.g. a parked car)
+    adds no new information.
+
+    Args:
+        iou_threshold (float): Minimum IoU for a detection to continue a track
+        max_age (int): Updates a track survives without a match before it is
+            dropped (a reappearing object then starts a new track)
+        move_threshold (float): Center displacement, as a fraction of the box
+            size, that counts as moved
+        size_threshold (float): Relative change in box area that counts as changed
+        max_interval (int): Save a track again after this many video frames even if
+            it hasn't changed (None: never)
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=10, move_threshold=0.25, size_threshold=0.25,
+                 max_interval=None):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.move_threshold = move_threshold
+        self.size_threshold = size_threshold
+        self.max_interval = max_interval
+        self.next_id = 1
+        # track id -> {'cls', 'box' (last xyxy), 'saved_box', 'saved_frame', 'misses'}
+        self.tracks = {}
+        self.visible = []  # Ids of the tracks matched in the last update
+
+    def _match(self, boxes, cls):
+        """Greedily pair detections with tracks of the same class, highest IoU first"""
+        ids = list(self.tracks)
+        matches = {}
+        if not ids or not len(boxes):
+            return matches
+        track_boxes = np.array([self.tracks[i]['box'] for i in ids], dtype=np.float64)
+        track_cls = np.array([self.tracks[i]['cls'] for i in ids])
+        iou = box_iou(boxes, track_boxes)
+        iou[cls[:, None] != track_cls[None, :]] = 0
+        for det, col in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+            if iou[det, col] < self.iou_threshold:
+                break
+            if det not in matches and ids[col] not in matches.values():
+                matches[det] = ids[col]
+        return matches
+
+    def _changed(self, track, frame_idx):
+        """Return True if a track differs enough from how it looked in the last saved frame"""
+        if track['saved_frame'] is None:
+            return True
+        if self.max_interval is not None and frame_idx - track['saved_frame'] >= self.max_interval:
+            return True
+        box, saved = np.asarray(track['box']), np.asarray(track['saved_box'])
+        size = saved[2:] - saved[:2]
+        shift = (box[:2] + box[2:]) / 2 - (saved[:2] + saved[2:]) / 2
+        if np.hypot(*shift) > self.move_threshold * max(np.sqrt(np.prod(size)), 1e-9):
+            return True
+        area = np.prod(box[2:] - box[:2])
+        ratio = area / max(np.prod(size), 1e-9)
+        return max(ratio, 1 / max(ratio, 1e-9)) > 1 + self.size_threshold
+
+    def update(self, frame_idx, xywh, cls):
+        """
+        Advance the tracks by one inferred frame
+
+        Args:
+            frame_idx (int): Index of the frame in the video
+            xywh (np.ndarray): (N, 4) boxes in pixels (x_center, y_center, width, height)
+            cls (np.ndarray): (N,) class indices
+
+        Returns:
+            list: Ids of the tracks that make this frame worth saving (new, moved,
+                resized or due); the ids of all tracks in the frame are in visible
+        """
+        xywh = np.asarray(xywh, dtype=np.float64).reshape(-1, 4)
+        cls = np.asarray(cls, dtype=int).reshape(-1)
+        boxes = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+        matches = self._match(boxes, cls)
+
+        for track_id in set(self.tracks) - set(matches.values()):
+            self.tracks[track_id]['misses'] += 1
+            if self.tracks[track_id]['misses'] > self.max_age:
+                del self.tracks[track_id]
+
+        self.visible = []
+        triggered = []
+        for det in range(len(boxes)):
+            track_id = matches.get(det)
+            if track_id is None:
+                track_id = self.next_id
+                self.next_id += 1
+                self.tracks[track_id] = {'cls': int(cls[det]), 'saved_box': None, 'saved_frame': None}
+            track = self.tracks[track_id]
+            track['box'] = boxes[det].tolist()
+            track['misses'] = 0
+            self.visible.append(track_id)
+            if self._changed(track, frame_idx):
+                triggered.append(track_id)
+        return triggered
+
+    def mark_saved(self, frame_idx):
+        """Record that the last updated frame was saved, as the new reference for its tracks"""
+        for track_id in self.visible:
+            track = self.tracks[track_id]
+            track['saved_box'] = track['box']
+            track['saved_frame'] = frame_idx
+
+    @property
+    def track_count(self):
+        """Number of tracks started so far"""
+        return self.next_id - 1
+
+    def checkpoint_state(self):
+        """Return the tracker state as JSON-serializable data"""
+        return {'next_id': self.next_id, 'tracks': {str(k): v for k, v in self.tracks.items()}}
+
+    def restore_state(self, state):
+        """Restore state saved by checkpoint_state"""
+        self.next_id = state['next_id']
+        self.tracks = {int(k): v for k, v in state['tracks'].items()}
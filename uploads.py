@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+COPY_BUFFER = 1024 * 1024
+HASH_BLOCK_SIZE = 8 * 1024 * 1024  # Block size of block_sha256; the upload page uses the same
+
+
+def _is_video_id(video_id):
+    return isinstance(video_id, str) and len(video_id) == 64 and all(c in '0123456789abcdef' for c in video_id)
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class BlockHasher:
+    """
+    SHA-256 of the concatenated SHA-256 digests of consecutive HASH_BLOCK_SIZE blocks
+
+    Browsers can only hash a whole buffer at once, so the upload page hashes a
+    file block by block and sends this digest (block_sha256) to find out whether
+    the video is already stored before sending any of it.
+    """
+
+    def __init__(self):
+        self._outer = hashlib.sha256()
+        self._block = hashlib.sha256()
+        self._block_len = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), HASH_BLOCK_SIZE - self._block_len)
+            self._block.update(view[:take])
+            self._block_len += take
+            view = view[take:]
+            if self._block_len == HASH_BLOCK_SIZE:
+                self._outer.update(self._block.digest())
+                self._block = hashlib.sha256()
+                self._block_len = 0
+
+    def hexdigest(self):
+        outer = self._outer.copy()
+        if self._block_len:
+            outer.update(self._block.digest())
+        return outer.hexdigest()
+
+
+class UploadStore:
+    """
+    Resumable chunked uploads into a content-addressed video store
+
+    An upload is a session with an id. Chunks are streamed to a .part file in
+    uploads_dir at the offset the client sends, so a dropped connection only
+    costs the chunk in flight: the client asks for the current offset and
+    carries on. Completing the upload hashes the file and moves it to
+    videos_dir/<sha256><ext>; the sha256 is the video id extraction jobs use.
+    A video that is already stored is never written twice, and a client that
+    knows the hash (or the block_sha256 of BlockHasher) up front skips the
+    upload entirely.
+
+    Args:
+        uploads_dir (str): Directory for in-progress uploads
+        videos_dir (str): Directory of stored videos
+        max_age (float): Seconds after which abandoned uploads are deleted
+    """
+
+    def __init__(self, uploads_dir='uploads', videos_dir='videos', max_age=7 * 24 * 3600):
+        self.uploads_dir = uploads_dir
+        self.videos_dir = videos_dir
+        self.max_age = max_age
+        # Running hashes of uploads whose chunks arrived in order at this process;
+        # completing any other upload hashes its file from the start instead
+        self._hashers = {}  # upload id -> (sha256 object, BlockHasher, offset hashed up to)
+        self._lock = threading.Lock()
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.videos_dir, exist_ok=True)
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.uploads_dir, f'{upload_id}.json')
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.uploads_dir, f'{upload_id}.part')
+
+    def _meta_path(self, video_id):
+        return os.path.join(self.videos_dir, f'{video_id}.json')
+
+    @contextmanager
+    def _locked(self, upload_id):
+        # One writer per upload, across threads and processes
+        with open(os.path.join(self.uploads_dir, f'{upload_id}.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _get_state(self, upload_id):
+        if not upload_id or not upload_id.isalnum():
+            return None
+        return _read_json(self._state_path(upload_id))
+
+    def _status(self, state):
+        return {
+            'success': True,
+            'upload_id': state['id'],
+            'filename': state['filename'],
+            'size': state['size'],
+            'offset': os.path.getsize(self._part_path(state['id'])),
+            'complete': False
+        }
+
+    def get_video(self, video_id):
+        """Return the metadata of a stored video, or None"""
+        if not _is_video_id(video_id):
+            return None
+        meta = _read_json(self._meta_path(video_id))
+        if meta is None or not os.path.exists(os.path.join(self.videos_dir, meta['file'])):
+            return None
+        return meta
+
+    def video_path(self, video_id):
+        """Return the path of a stored video, or None if there is no such video"""
+        meta = self.get_video(video_id)
+        return os.path.join(self.videos_dir, meta['file']) if meta else None
+
+    def list_videos(self):
+        """Return the metadata of all stored videos, newest first"""
+        videos = []
+        for name in os.listdir(self.videos_dir):
+            if name.endswith('.json'):
+                meta = self.get_video(name[:-len('.json')])
+                if meta is not None:
+                    videos.append(meta)
+        videos.sort(key=lambda v: v.get('created_at') or 0, reverse=True)
+        return videos
+
+    def find_block_hash(self, block_sha256):
+        """Return the metadata of the stored video with this block_sha256, or None"""
+        for meta in self.list_videos():
+            if meta.get('block_sha256') == block_sha256:
+                return meta
+        return None
+
+    def _store(self, part_path, digest, block_digest, filename):
+        """Move a fully received file into the store under its content hash"""
+        meta = self.get_video(digest)
+        if meta is not None:
+            # Same content uploaded before: keep the stored copy
+            os.remove(part_path)
+            if meta.get('block_sha256') != block_digest:
+                # Stored before block hashes were recorded
+                meta['block_sha256'] = block_digest
+                _write_json(self._meta_path(digest), meta)
+            return meta
+        ext = os.path.splitext(filename)[1].lower()
+        if not ext[1:].isalnum():
+            ext = ''
+        meta = {
+            'id': digest,
+            'file': digest + ext,
+            'filename': filename,
+            'size': os.path.getsize(part_path),
+            'block_sha256': block_digest,
+            'created_at': time.time()
+        }
+        os.replace(part_path, os.path.join(self.videos_dir, meta['file']))
+        _write_json(self._meta_path(digest), meta)
+        return meta
+
+    def create(self, filename, size, sha256=None, block_sha256=None):
+        """
+        Start an upload, or skip it when the video is already stored
+
+        Args:
+            filename (str): Original file name (used for the extension and display)
+            size (int): Total size in bytes
+            sha256 (str): Optional content hash known to the client
+            block_sha256 (str): Optional BlockHasher digest known to the client
+
+        Returns:
+            dict: The video id if the content is already stored, otherwise the
+                upload id and the offset to send from
+        """
+        meta = None
+        if sha256:
+            meta = self.get_video(sha256.lower())
+        if meta is None and block_sha256:
+            meta = self.find_block_hash(block_sha256.lower())
+        if meta is not None:
+            return {'success': True, 'complete': True, 'video_id': meta['id'], 'uploaded_bytes': 0}
+        if not filename:
+            return {'error': 'No filename given'}
+        if size is None or size < 0:
+            return {'error': 'Invalid size'}
+
+        self.cleanup()
+        upload_id = uuid.uuid4().hex[:16]
+        state = {
+            'id': upload_id,
+            'filename': os.path.basename(filename),
+            'size': size,
+            'sha256': sha256.lower() if sha256 else None,
+            'block_sha256': block_sha256.lower() if block_sha256 else None,
+            'created_at': time.time()
+        }
+        open(self._part_path(upload_id), 'wb').close()
+        _write_json(self._state_path(upload_id), state)
+        with self._lock:
+            self._hashers[upload_id] = (hashlib.sha256(), BlockHasher(), 0)
+        return self._status(state)
+
+    def status(self, upload_id):
+        """Return how many bytes of an upload have been received"""
+        state = self._get_state(upload_id)
+        if state is None:
+            return {'error': 'Upload not found'}
+        return self._status(state)
+
+    def write_chunk(self, upload_id, offset, stream, length=None):
+        """
+        Stream a chunk to an upload's file at the given offset
+
+        The offset may be at most the number of bytes received so far; anything
+        after it is discarded first, so resending a chunk is safe.
+
+        Args:
+            upload_id (str): The upload id
+            offset (int): Byte offset of the chunk
+            stream: File-like object the chunk is read from
+            length (int): Chunk length if known
+
+        Returns:
+            dict: The new offset
+        """
+        state = self._get_state(upload_id)
+        if state is None:
+            return {'error': 'Upload not found'}
+        part_path = self._part_path(upload_id)
+        with self._locked(upload_id):
+            received = os.path.getsize(part_path)
+            if offset < 0 or offset > received:
+                return {'error': f'Offset {offset} is past the {received} bytes received', 'offset': received}
+            with self._lock:
+                hasher, block_hasher, hashed = self._hashers.pop(upload_id, (None, None, 0))
+            if hasher is not None and hashed != offset:
+                hasher = None
+
+            written = 0
+            with open(part_path, 'r+b') as f:
+                f.seek(offset)
+                f.truncate()
+                while True:
+                    buf = stream.read(COPY_BUFFER if length is None else min(COPY_BUFFER, length - written))
+                    if not buf:
+                        break
+                    f.write(buf)
+                    if hasher is not None:
+                        hasher.update(buf)
+                        block_hasher.update(buf)
+                    written += len(buf)
+                    if offset + written > state['size']:
+                        f.truncate(offset)
+                        return {'error': 'Chunk extends past the declared size', 'offset': offset}
+                    if length is not None and written >= length:
+                        break
+
+            if hasher is not None:
+                with self._lock:
+                    self._hashers[upload_id] = (hasher, block_hasher, offset + written)
+        return {'success': True, 'upload_id': upload_id, 'offset': offset + written, 'size': state['size']}
+
+    def complete(self, upload_id):
+        """
+        Finish an upload: check its size, hash it and move it into the store
+
+        Returns:
+            dict: The video id and metadata of the stored video
+        """
+        state = self._get_state(upload_id)
+        if state is None:
+            return {'error': 'Upload not found'}
+        part_path = self._part_path(upload_id)
+        with self._locked(upload_id):
+            received = os.path.getsize(part_path)
+            if received != state['size']:
+                return {'error': f'Upload incomplete: {received} of {state["size"]} bytes received',
+                        'offset': received}
+            with self._lock:
+                hasher, block_hasher, hashed = self._hashers.pop(upload_id, (None, None, 0))
+            if hasher is None or hashed != received:
+                hasher, block_hasher = hashlib.sha256(), BlockHasher()
+                with open(part_path, 'rb') as f:
+                    for buf in iter(lambda: f.read(COPY_BUFFER), b''):
+                        hasher.update(buf)
+                        block_hasher.update(buf)
+            digest = hasher.hexdigest()
+            block_digest = block_hasher.hexdigest()
+            if (state['sha256'] and state['sha256'] != digest) or \
+                    (state.get('block_sha256') and state['block_sha256'] != block_digest):
+                return {'error': 'Content hash does not match the one given when the upload started'}
+            meta = self._store(part_path, digest, block_digest, state['filename'])
+            os.remove(self._state_path(upload_id))
+        os.remove(os.path.join(self.uploads_dir, f'{upload_id}.lock'))
+        return {'success': True, 'complete': True, 'video_id': meta['id'], 'video': meta}
+
+    def save_stream(self, stream, filename):
+        """
+        Store a whole file from a stream in one go (for single-request uploads)
+
+        Returns:
+            dict: Metadata of the stored video
+        """
+        tmp_path = os.path.join(self.uploads_dir, f'{uuid.uuid4().hex[:16]}.part')
+        hasher, block_hasher = hashlib.sha256(), BlockHasher()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for buf in iter(lambda: stream.read(COPY_BUFFER), b''):
+                    f.write(buf)
+                    hasher.update(buf)
+                    block_hasher.update(buf)
+            return self._store(tmp_path, hasher.hexdigest(), block_hasher.hexdigest(), os.path.basename(filename))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def cleanup(self):
+        """Delete uploads that have not received data for max_age seconds"""
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.uploads_dir):
+            if not name.endswith('.part'):
+                continue
+            upload_id = name[:-len('.part')]
+            path = os.path.join(self.uploads_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                for ext in ('.part', '.json', '.lock'):
+                    if os.path.exists(os.path.join(self.uploads_dir, upload_id + ext)):
+                        os.remove(os.path.join(self.uploads_dir, upload_id + ext))
+            except OSError:
+                continue
+            with self._lock:
+                self._hashers.pop(upload_id, None)